@@ -11,7 +11,7 @@ from pathlib import Path
 import pickle
 import threading
 import time
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from PIL import Image, _webp  # type: ignore
 from assets.ffmpegcv_custom import FFmpegReaderStreamRTCustomInit  # type: ignore
@@ -36,39 +36,78 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
-def cam_light_toggle(func):
-    @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        self.use_light()
+class LightManager:
+    """Keeps the light device on while camera captures are running.
 
-        if self.light_timeout > 0 and self.light_device and not self.light_device.device_state and not self.light_lock.locked():
-            self.light_timer_event.clear()
-            self.light_lock.acquire()
-            self.light_need_off = True
-            self.light_device.switch_device_sync(True)
-            time.sleep(self.light_timeout)
-            self.light_timer_event.set()
+    Runs on the event loop: the first capture switches the light on and waits `light_timeout` for the camera to adapt,
+    the last one arms a single off timer, which is cancelled if another capture starts before it fires.
+    """
 
-        self.light_timer_event.wait()
+    def __init__(self, light_device: Optional[PowerDevice], light_timeout: int):
+        self._device: Optional[PowerDevice] = light_device
+        self._timeout: int = light_timeout
+        self._requests: int = 0
+        self._switch_on_task: Optional[asyncio.Task] = None
+        self._switch_off_task: Optional[asyncio.Task] = None
+        self._off_timer: Optional[asyncio.TimerHandle] = None
 
-        # Todo: maybe add try block?
-        result = func(self, *args, **kwargs)
+    @property
+    def busy(self) -> bool:
+        return self._requests > 0 or self._switch_on_task is not None or (self._switch_off_task is not None and not self._switch_off_task.done())
+
+    async def _switch_on(self) -> None:
+        if self._device and await self._device.switch_device(True):
+            await asyncio.sleep(self._timeout)
+
+    async def _switch_off(self) -> None:
+        self._switch_on_task = None
+        if self._device:
+            await self._device.switch_device(False)
+
+    def _on_off_timer(self) -> None:
+        self._off_timer = None
+        self._switch_off_task = asyncio.create_task(self._switch_off())
+
+    async def acquire(self) -> None:
+        self._requests += 1
+        if self._off_timer is not None:
+            self._off_timer.cancel()
+            self._off_timer = None
+        if self._timeout <= 0 or not self._device:
+            return
 
-        self.free_light()
+        if self._switch_off_task is not None:
+            await self._switch_off_task
+            self._switch_off_task = None
+        if self._switch_on_task is None:
+            if self._device.device_state:
+                # switched on by the user, leave it as it is
+                return
+            self._switch_on_task = asyncio.create_task(self._switch_on())
+        try:
+            await asyncio.shield(self._switch_on_task)
+        except Exception as err:
+            logger.error("Light switch failed: %s", err)
 
-        def delayed_light_off():
-            if self.light_requests == 0:
-                if self.light_lock.locked():
-                    self.light_lock.release()
-                self.light_need_off = False
-                self.light_device.switch_device_sync(False)
-            else:
-                logger.debug("light requests count: %s", self.light_requests)
+    def release(self) -> None:
+        self._requests -= 1
+        if self._requests == 0 and self._switch_on_task is not None:
+            logger.debug("Light will be switched off in %s seconds", self._timeout)
+            self._off_timer = asyncio.get_running_loop().call_later(self._timeout, self._on_off_timer)
 
-        if self.light_need_off and self.light_requests == 0:
-            threading.Timer(self.light_timeout, delayed_light_off).start()
 
-        return result
+def cam_light_toggle(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.loop is None:
+            logger.warning("Camera is not bound to the event loop, capturing without light")
+            return func(self, *args, **kwargs)
+
+        asyncio.run_coroutine_threadsafe(self.light.acquire(), self.loop).result()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.loop.call_soon_threadsafe(self.light.release)
 
     return wrapper
 
@@ -105,15 +144,10 @@ class Camera:
         self._max_lapse_duration: int = 0
         self._last_frame_duration: int = 5
 
-        self._light_need_off: bool = False
-        self._light_need_off_lock: threading.Lock = threading.Lock()
-
-        self.light_timeout: int = config.camera.light_timeout
-        self.light_device: PowerDevice = self._klippy.light_device
+        self.light: LightManager = LightManager(self._klippy.light_device, config.camera.light_timeout)
+        # captures run in executor threads, light switching and gcode requests are sent back to this loop
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self._camera_lock: threading.Lock = threading.Lock()
-        self.light_lock = threading.Lock()
-        self.light_timer_event: threading.Event = threading.Event()
-        self.light_timer_event.set()
 
         self._picture_quality = config.camera.picture_quality
         self._img_extension: str
@@ -125,9 +159,6 @@ class Camera:
         self._save_lapse_photos_as_images: bool = config.timelapse.save_lapse_photos_as_images
         self._raw_frame_extension: str = "npz"
 
-        self._light_requests: int = 0
-        self._light_request_lock: threading.Lock = threading.Lock()
-
         self._rotate_code: int
         if config.camera.rotate == "90_cw":
             self._rotate_code = 1
@@ -162,32 +193,15 @@ class Camera:
             self.cam_cam = cv2.VideoCapture()
             self._set_cv2_params()
 
-    @property
-    def light_need_off(self) -> bool:
-        with self._light_need_off_lock:
-            return self._light_need_off
-
-    @light_need_off.setter
-    def light_need_off(self, new_value: bool):
-        with self._light_need_off_lock:
-            self._light_need_off = new_value
-
     @property
     def lapse_dir(self) -> str:
         return f"{self._base_dir}/{self._klippy.printing_filename_with_time}"
 
-    @property
-    def light_requests(self) -> int:
-        with self._light_request_lock:
-            return self._light_requests
-
-    def use_light(self) -> None:
-        with self._light_request_lock:
-            self._light_requests += 1
-
-    def free_light(self) -> None:
-        with self._light_request_lock:
-            self._light_requests -= 1
+    def _execute_gcode(self, gcode: str) -> None:
+        if self.loop is None:
+            logger.error("Camera is not bound to the event loop, skipping gcode `%s`", gcode)
+            return
+        asyncio.run_coroutine_threadsafe(self._klippy.execute_gcode_script(gcode), self.loop).result()
 
     @property
     def target_fps(self) -> int:
@@ -436,7 +450,7 @@ class Camera:
 
         if gcode:
             try:
-                self._klippy.execute_gcode_script_sync(gcode.strip())
+                self._execute_gcode(gcode.strip())
             except Exception as ex:
                 logger.error(ex)
 
@@ -494,7 +508,7 @@ class Camera:
         if not printing_filename:
             raise ValueError("Gcode file name is empty")
 
-        while self.light_need_off:
+        while self.light.busy:
             time.sleep(1)
 
         os_nice(15)
@@ -706,7 +720,7 @@ class MjpegCamera(Camera):
         with self.take_photo(force_rotate=False) as photo:
             if gcode:
                 try:
-                    self._klippy.execute_gcode_script_sync(gcode.strip())
+                    self._execute_gcode(gcode.strip())
                 except Exception as ex:
                     logger.error(ex)
 
@@ -3,6 +3,7 @@ import os
 import pathlib
 from pathlib import Path
 import re
+import tempfile
 from typing import Any, Callable, List, Optional, Tuple, Union
 
 
@@ -193,6 +194,8 @@ class BotConfig(ConfigHelper):
         "socks_proxy",
         "debug",
         "log_parser",
+        "websocket_record_file",
+        "cache_path",
         "power_device",
         "light_device",
         "upload_path",
@@ -218,6 +221,9 @@ class BotConfig(ConfigHelper):
         self.upload_path: str = self._get_str("upload_path", default="")
         self.services: List[str] = self._get_list("services", default=["klipper", "moonraker"])
         self.log_parser: bool = self._get_boolean("log_parser", default=False)
+        self.websocket_record_file: str = os.path.expanduser(self._get_str("websocket_record_file", default=""))
+        # kept apart from log_path, moonraker serves that directory as the `logs` root and log tooling walks it
+        self.cache_path: str = os.path.expanduser(self._get_str("cache_path", default=os.path.join(tempfile.gettempdir(), "moonraker-telegram-bot")))
 
         host_parts = self.host.split(":")
         if len(host_parts) == 2 and host_parts[1].isdigit():
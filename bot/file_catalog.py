@@ -0,0 +1,240 @@
+import bisect
+import hashlib
+import logging
+import math
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FileCatalog:
+    """Gcode files listing sorted newest first, with an index of the md5 hashes used in keyboard callbacks.
+
+    The listing is loaded once and then kept up to date from `notify_filelist_changed` events,
+    anything that can't be applied incrementally marks it stale so the next request reloads it.
+    Paths and known slicer metadata are tokenized for `search`. Metadata is kept for catalog files only and survives reloads
+    while the file modification time stays the same.
+    """
+
+    _GCODE_EXTENSIONS = (".gcode", ".g", ".gco", ".ufp", ".nc")
+    _METADATA_FIELDS = ("slicer", "estimated_time", "filament_total")
+    SORT_KEYS: Dict[str, Callable[[dict], Tuple]] = {
+        "new": lambda item: (-item["modified"],),
+        "old": lambda item: (item["modified"],),
+        "name": lambda item: (item["path"].lower(),),
+        "size": lambda item: (-item.get("size", 0),),
+        "time": lambda item: (item.get("estimated_time") or math.inf, -item["modified"]),
+        "filament": lambda item: (item.get("filament_total") or math.inf, -item["modified"]),
+    }
+    _METADATA_SORT_KEYS = ("time", "filament")
+    # slicer estimate and filament words as they are indexed, like `1h05m` and `12.5m`
+    _METADATA_WORD = re.compile(r"^\d+(\.\d+)?[hm]")
+
+    def __init__(self):
+        self._files: List[dict] = []
+        # negated modification times, kept parallel to _files for bisect
+        self._keys: List[float] = []
+        self._by_path: Dict[str, dict] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._search_text: Dict[str, str] = {}
+        self._metadata: Dict[str, dict] = {}
+        self._token_paths: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+        self._tokens_dirty: bool = False
+        self._valid: bool = False
+
+    @property
+    def valid(self) -> bool:
+        return self._valid
+
+    @property
+    def files(self) -> List[dict]:
+        return list(self._files)
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        return hashlib.md5(path.encode()).hexdigest()
+
+    def load(self, files: List[dict]) -> None:
+        self._files = sorted(files, key=lambda item: item["modified"], reverse=True)
+        self._keys = [-item["modified"] for item in self._files]
+        self._by_path = {item["path"]: item for item in self._files}
+        self._by_hash = {self.file_hash(path): path for path in self._by_path}
+        self._metadata = {path: metadata for path, metadata in self._metadata.items() if path in self._by_path and metadata.get("modified") == self._by_path[path]["modified"]}
+        for path, metadata in self._metadata.items():
+            self._merge_metadata(self._by_path[path], metadata)
+        self._search_text = {}
+        self._token_paths = {}
+        for path in self._by_path:
+            self._index(path)
+        self._valid = True
+
+    def invalidate(self) -> None:
+        self._valid = False
+
+    def path_by_hash(self, file_hash: str) -> Optional[str]:
+        return self._by_hash.get(file_hash)
+
+    def get(self, path: str) -> Optional[dict]:
+        return self._by_path.get(path)
+
+    def _merge_metadata(self, item: dict, metadata: dict) -> None:
+        item.update((field, metadata[field]) for field in self._METADATA_FIELDS if field in metadata)
+
+    def _index(self, path: str) -> None:
+        item = self._by_path[path]
+        text = f"{path.lower()} {str(item.get('slicer', '')).lower()}"
+        if item.get("estimated_time"):
+            minutes = round(item["estimated_time"] / 60)
+            text += f" {minutes // 60}h{minutes % 60:02}m"
+        if item.get("filament_total"):
+            text += f" {round(item['filament_total'] / 1000, 1)}m"
+        self._search_text[path] = text
+        for token in re.split(r"[^0-9a-z]+", text):
+            if token:
+                self._token_paths.setdefault(token, set()).add(path)
+        self._tokens_dirty = True
+
+    def _unindex(self, path: str) -> None:
+        for token in re.split(r"[^0-9a-z]+", self._search_text.pop(path, "")):
+            paths = self._token_paths.get(token)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._token_paths[token]
+        self._tokens_dirty = True
+
+    def metadata(self, path: str) -> Optional[dict]:
+        item = self._by_path.get(path)
+        cached = self._metadata.get(path)
+        if item is None or cached is None or cached.get("modified") != item["modified"]:
+            return None
+        return cached
+
+    def set_metadata(self, path: str, metadata: dict) -> None:
+        item = self._by_path.get(path)
+        if item is None:
+            return
+        self._metadata[path] = metadata
+        self._merge_metadata(item, metadata)
+        self._unindex(path)
+        self._index(path)
+
+    def _remove(self, path: str) -> None:
+        item = self._by_path.pop(path, None)
+        if item is None:
+            return
+        self._unindex(path)
+        self._metadata.pop(path, None)
+        pos = bisect.bisect_left(self._keys, -item["modified"])
+        while self._files[pos] is not item:
+            pos += 1
+        del self._files[pos]
+        del self._keys[pos]
+        del self._by_hash[self.file_hash(path)]
+
+    def _add(self, item: dict) -> None:
+        path = item["path"]
+        self._remove(path)
+        if not path.lower().endswith(self._GCODE_EXTENSIONS):
+            return
+        file_item = {"path": path, "modified": item.get("modified", 0.0), "size": item.get("size", 0), "permissions": item.get("permissions", "rw")}
+        pos = bisect.bisect_left(self._keys, -file_item["modified"])
+        self._files.insert(pos, file_item)
+        self._keys.insert(pos, -file_item["modified"])
+        self._by_path[path] = file_item
+        self._by_hash[self.file_hash(path)] = path
+        self._index(path)
+
+    def apply_change(self, change: dict) -> None:
+        if not self._valid:
+            return
+        item = change.get("item", {})
+        if item.get("root") != "gcodes" and change.get("source_item", {}).get("root") != "gcodes":
+            return
+
+        action = change.get("action")
+        if action in ["create_file", "modify_file"] and item.get("root") == "gcodes":
+            self._add(item)
+        elif action == "delete_file":
+            self._remove(item["path"])
+        elif action == "move_file":
+            if change.get("source_item", {}).get("root") == "gcodes":
+                self._remove(change["source_item"]["path"])
+            if item.get("root") == "gcodes":
+                self._add(item)
+        elif action == "create_dir":
+            pass
+        else:
+            logger.debug("File catalog reload required after %s", action)
+            self._valid = False
+
+    def _prefix_matches(self, word: str) -> Set[str]:
+        if self._tokens_dirty:
+            self._sorted_tokens = sorted(self._token_paths)
+            self._tokens_dirty = False
+        matches: Set[str] = set()
+        pos = bisect.bisect_left(self._sorted_tokens, word)
+        while pos < len(self._sorted_tokens) and self._sorted_tokens[pos].startswith(word):
+            matches |= self._token_paths[self._sorted_tokens[pos]]
+            pos += 1
+        return matches
+
+    @classmethod
+    def parse_query(cls, query: str) -> Tuple[List[str], Optional[str], str]:
+        words: List[str] = []
+        directory: Optional[str] = None
+        sort = "new"
+        for part in query.split():
+            if part.startswith("sort:") and part[5:] in cls.SORT_KEYS:
+                sort = part[5:]
+            elif part.startswith("dir:"):
+                directory = part[4:].strip("/")
+            elif part.endswith("/"):
+                directory = part.strip("/")
+            else:
+                words.append(part.lower())
+        return words, directory, sort
+
+    def missing_metadata(self, query: str) -> List[str]:
+        """Paths in the query directory without metadata, if the query sorts or filters by metadata, otherwise nothing."""
+        words, directory, sort = self.parse_query(query)
+        if sort not in self._METADATA_SORT_KEYS and not any(self._METADATA_WORD.match(word) for word in words):
+            return []
+        prefix = f"{directory}/" if directory else ""
+        return [item["path"] for item in self._files if item["path"].startswith(prefix) and self.metadata(item["path"]) is None]
+
+    def search(self, query: str) -> Tuple[List[dict], List[str]]:
+        """Files matching every word of the query and, when browsing a directory without words, its subdirectories.
+
+        Words match path, slicer, estimated time (`1h05m`) or filament length (`12.5m`) substrings,
+        files where each word starts a token come first.
+        `dir:<path>` or `<path>/` limits the search to a directory, `sort:<key>` picks one of SORT_KEYS.
+        """
+        words, directory, sort = self.parse_query(query)
+        files = self._files
+        subdirs: Set[str] = set()
+        if directory is not None:
+            prefix = f"{directory}/" if directory else ""
+            if words:
+                files = [item for item in files if item["path"].startswith(prefix)]
+            else:
+                files = []
+                for item in self._files:
+                    if not item["path"].startswith(prefix):
+                        continue
+                    rest = item["path"][len(prefix) :]
+                    if "/" in rest:
+                        subdirs.add(prefix + rest.partition("/")[0])
+                    else:
+                        files.append(item)
+
+        prefix_hits = [self._prefix_matches(word) for word in words]
+        ranked = []
+        for item in files:
+            text = self._search_text[item["path"]]
+            if all(word in text for word in words):
+                ranked.append((0 if all(item["path"] in hits for hits in prefix_hits) else 1, self.SORT_KEYS[sort](item), item))
+        ranked.sort(key=lambda el: (el[0], el[1]))
+        return [item for _, _, item in ranked], sorted(subdirs)
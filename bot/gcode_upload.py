@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import io
+import logging
+import os
+from pathlib import Path
+import shutil
+import tarfile
+from tempfile import SpooledTemporaryFile
+from typing import IO, BinaryIO, Callable, Generator, List, Optional, Tuple, cast
+from zipfile import BadZipFile, ZipFile
+import zlib
+
+import httpx
+from telegram import File
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar.gz", ".tar.bz2", ".tar.xz")
+_CHUNK_SIZE = 64 * 1024
+# documents up to this size stay in memory, larger ones are rolled over to a temporary file
+_SPOOL_SIZE = 4 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class _SizedReader(io.BufferedIOBase):
+    """Read-only view of an archive member with a known size.
+
+    httpx finds the multipart content length by seeking to the end of the file, which for a compressed member
+    means decompressing it twice. Seeking here only moves the reported position, reads go to the member itself.
+    """
+
+    def __init__(self, raw: IO[bytes], size: int):
+        super().__init__()
+        self._raw: IO[bytes] = raw
+        self._size: int = size
+        self._pos: int = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        data = self._raw.read(-1 if size is None else size)
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        target = {os.SEEK_SET: offset, os.SEEK_CUR: self._pos + offset, os.SEEK_END: self._size + offset}[whence]
+        if target == self._size and whence == os.SEEK_END:
+            # length probe, the next seek puts the position back
+            self._pos = target
+        elif target == 0:
+            self._raw.seek(0)
+            self._pos = 0
+        elif target != self._pos:
+            raise io.UnsupportedOperation("Archive members can only be rewound")
+        return self._pos
+
+
+async def download_document(file: File) -> IO[bytes]:
+    """Telegram document as a file object.
+
+    Documents served by a local bot api server are opened in place. Anything else is downloaded with the request object
+    of the bot, so its proxy, timeouts and file url apply, into a spooled temporary file that large documents roll over to disk.
+    """
+    file_path = str(file.file_path)
+    if not file_path.startswith(("http://", "https://")) and Path(file_path).is_file():
+        return open(file_path, "rb")  # pylint: disable=consider-using-with
+
+    spooled = SpooledTemporaryFile(max_size=_SPOOL_SIZE)  # pylint: disable=consider-using-with
+    try:
+        await file.download_to_memory(cast(BinaryIO, spooled))
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return cast(IO[bytes], spooled)
+
+
+def _spooled_copy(member: IO[bytes]) -> IO[bytes]:
+    spooled = SpooledTemporaryFile(max_size=_SPOOL_SIZE)  # pylint: disable=consider-using-with
+    shutil.copyfileobj(member, spooled, _CHUNK_SIZE)
+    spooled.seek(0)
+    return cast(IO[bytes], spooled)
+
+
+def _is_gcode_member(name: str) -> bool:
+    # archives made by the macOS Finder carry resource forks as `__MACOSX/dir/._name.gcode`
+    path = Path(name)
+    return path.suffix == ".gcode" and not path.name.startswith("._") and "__MACOSX" not in path.parts
+
+
+def iter_gcodes(document: IO[bytes], file_name: str) -> Generator[Tuple[str, IO[bytes]], None, None]:
+    """Gcode file names and streams from a plain gcode document or an archive, other archive members and macOS metadata are skipped.
+
+    Zip members are decompressed while they are read and can be read in parallel. Tar archives are a single compressed
+    stream, so each member is decompressed into a spooled temporary file before it is yielded.
+    Everything here blocks, iterate it from a worker thread. The caller closes the yielded streams.
+    """
+    gcodes_count = 0
+    try:
+        if file_name.endswith(".zip"):
+            with ZipFile(document) as zip_archive:
+                for info in zip_archive.infolist():
+                    if not info.is_dir() and _is_gcode_member(info.filename):
+                        gcodes_count += 1
+                        zip_member = zip_archive.open(info)  # pylint: disable=consider-using-with
+                        yield Path(info.filename).name, cast(IO[bytes], _SizedReader(cast(IO[bytes], zip_member), info.file_size))
+        elif file_name.endswith(ARCHIVE_EXTENSIONS):
+            with tarfile.open(fileobj=document, mode="r|*") as tar_archive:
+                for member in tar_archive:
+                    if not member.isfile() or not _is_gcode_member(member.name):
+                        continue
+                    tar_member = tar_archive.extractfile(member)
+                    if tar_member is None:
+                        raise UploadError(f"Failed extracting {member.name} from {file_name}")
+                    with tar_member:
+                        gcodes_count += 1
+                        yield Path(member.name).name, _spooled_copy(tar_member)
+        elif file_name.endswith(".gcode"):
+            gcodes_count += 1
+            yield file_name, document
+    except (BadZipFile, tarfile.TarError) as err:
+        raise UploadError(f"Broken archive {file_name}: {err}") from err
+
+    if gcodes_count == 0:
+        raise UploadError(f"Not a gcode file {file_name}")
+
+
+async def upload_gcodes(document: IO[bytes], file_name: str, upload: Callable[[IO[bytes], str], bool], concurrency: int = 3) -> Tuple[List[str], List[str]]:
+    """Uploads every gcode from the document, at most `concurrency` at a time, and returns the uploaded and failed file names.
+
+    Reading and uploading run on the default executor, the next member is only extracted once an upload slot is free.
+    Members with a file name already seen in the archive are reported as failed instead of overwriting the first one.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def upload_member(gcode_name: str, gcode_file: IO[bytes]) -> bool:
+        try:
+            return await loop.run_in_executor(None, upload, gcode_file, gcode_name)
+        except (httpx.HTTPError, OSError, BadZipFile, zlib.error) as err:
+            logger.error("Failed uploading %s from %s: %s", gcode_name, file_name, err)
+            return False
+        finally:
+            gcode_file.close()
+            slots.release()
+
+    names: List[str] = []
+    duplicates: List[str] = []
+    tasks: List[asyncio.Task] = []
+    with contextlib.closing(iter_gcodes(document, file_name)) as gcodes:
+        try:
+            while True:
+                await slots.acquire()
+                member: Optional[Tuple[str, IO[bytes]]] = await loop.run_in_executor(None, next, gcodes, None)
+                if member is None:
+                    break
+                if member[0] in names:
+                    # members are uploaded by file name, a second one would overwrite the first on the printer
+                    logger.error("Skipping %s from %s, a gcode with the same name is already in the archive", member[0], file_name)
+                    member[1].close()
+                    slots.release()
+                    duplicates.append(member[0])
+                    continue
+                names.append(member[0])
+                tasks.append(asyncio.create_task(upload_member(*member)))
+        finally:
+            results = await asyncio.gather(*tasks)
+
+    return [name for name, success in zip(names, results) if success], [name for name, success in zip(names, results) if not success] + duplicates
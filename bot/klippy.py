@@ -1,24 +1,32 @@
 # Todo: class for printer states!
 import asyncio
+import base64
 from datetime import datetime, timedelta
 from io import BytesIO
 import logging
+import os
+import random
 import re
 import threading
 import time
-from typing import List, Tuple
+from typing import IO, Any, Dict, FrozenSet, List, Optional, Set, Tuple
 import urllib
 
 from PIL import Image
-import emoji
 import httpx
 from httpx import AsyncClient, Client
 import orjson
 
 from configuration import ConfigWrapper
+from file_catalog import FileCatalog
+from status_template import StatusTemplate
+from thumbnail_cache import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
+# macro names that are valid telegram bot commands
+MACRO_COMMAND = re.compile("^[a-zA-Z0-9_]{1,32}$")
+
 
 class PowerDevice:
     def __new__(cls, name: str, klippy_: "Klippy"):
@@ -29,8 +37,6 @@ class PowerDevice:
 
     def __init__(self, name: str, klippy_: "Klippy"):
         self.name: str = name
-        # Todo: refactor! check lighting lock in camera
-        self._state_lock = threading.Lock()
         self._state_lock_async = asyncio.Lock()
         self._device_on: bool = False
         self._device_error: str = ""
@@ -65,23 +71,123 @@ class PowerDevice:
                 logger.error("Power device switch failed: %s", res)
             return self._device_on
 
-    # Todo: return exception?
-    def switch_device_sync(self, state: bool) -> bool:
-        with self._state_lock:
-            res = self._klippy.make_request_sync("POST", f"/machine/device_power/device?device={self.name}&action={'on' if state else 'off'}")
-            if res.is_success:
-                self._device_on = state
-                self._device_error = ""
-            else:
-                resp_json = orjson.loads(res.text)
-                if "error" in resp_json and "message" in resp_json["error"]:
-                    self._device_error = resp_json["error"]["message"]
-                logger.error("Power device switch failed: %s", res)
-            return self._device_on
+
+class MoonrakerToken:
+    """Moonraker JWT shared by the async client and executor threads.
+
+    All refreshes run under one lock and are skipped when another caller already replaced the token,
+    so a burst of 401 responses ends up in a single refresh_jwt request.
+    """
+
+    _EXPIRY_MARGIN = 60.0
+
+    def __init__(self, host: str, user: str, passwd: str, api_token: str, client: Client):
+        self._host: str = host
+        self._user: str = user
+        self._passwd: str = passwd
+        self._api_token: str = api_token
+        self._client: Client = client
+
+        self._jwt_token: str = ""
+        self._refresh_token: str = ""
+        self._expires_at: float = 0.0
+        self._generation: int = 0
+        self._lock = threading.Lock()
+        self._refresh_future: Optional[asyncio.Future] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._user or self._jwt_token or self._api_token)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        if self._jwt_token:
+            return {"Authorization": f"Bearer {self._jwt_token}"}
+        if self._api_token:
+            return {"X-Api-Key": self._api_token}
+        return {}
+
+    @property
+    def _expires_soon(self) -> bool:
+        return 0.0 < self._expires_at < time.time() + self._EXPIRY_MARGIN
+
+    @staticmethod
+    def _token_expiry(token: str) -> float:
+        try:
+            payload = token.split(".")[1]
+            return float(orjson.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return 0.0
+
+    def _set_token(self, token: str) -> None:
+        self._jwt_token = token
+        self._expires_at = self._token_expiry(token)
+        self._generation += 1
+
+    def _login(self) -> None:
+        if not self._user or not self._passwd:
+            return
+        try:
+            res = self._client.post(f"{self._host}/access/login", json={"username": self._user, "password": self._passwd}, timeout=15)
+            res.raise_for_status()
+            res_result = orjson.loads(res.text)["result"]
+            self._refresh_token = res_result["refresh_token"]
+            self._set_token(res_result["token"])
+        except httpx.HTTPError as err:
+            logger.error(err)
+
+    def login(self) -> None:
+        with self._lock:
+            self._login()
+
+    def refresh_sync(self, seen_generation: int) -> None:
+        with self._lock:
+            if self._generation != seen_generation:
+                logger.debug("JWT token already refreshed by another request")
+                return
+            if self._refresh_token:
+                try:
+                    res = self._client.post(f"{self._host}/access/refresh_jwt", content=orjson.dumps({"refresh_token": self._refresh_token}), timeout=15)
+                    res.raise_for_status()
+                    self._set_token(orjson.loads(res.text)["result"]["token"])
+                    logger.debug("JWT token successfully refreshed")
+                    return
+                except httpx.HTTPError as err:
+                    logger.error("Failed to refresh token: %s", err)
+            # refresh token is missing or expired as well
+            self._login()
+            if self._generation == seen_generation:
+                # leave the next attempt to a 401 response instead of retrying before every request
+                self._expires_at = 0.0
+
+    async def refresh(self, seen_generation: int) -> None:
+        if self._refresh_future is None or self._refresh_future.done():
+            self._refresh_future = asyncio.get_running_loop().run_in_executor(None, self.refresh_sync, seen_generation)
+        await asyncio.shield(self._refresh_future)
+
+    def ensure_fresh_sync(self) -> None:
+        if self._expires_soon:
+            self.refresh_sync(self._generation)
+
+    async def ensure_fresh(self) -> None:
+        if self._expires_soon:
+            await self.refresh(self._generation)
 
 
 class Klippy:
-    _DATA_MACRO = "bot_data"
+    _DATA_MACRO = "BOT_DATA"
+
+    _CONNECTION_RETRIES = 8
+    _PREFETCH_CONCURRENCY = 4
+    _BACKOFF_BASE = 0.25
+    _BACKOFF_MAX = 4.0
+    _DB_FLUSH_DELAY = 2.0
+    _DB_RETRY_MAX_DELAY = 60.0
+    _DB_DELETED = object()
 
     _SENSOR_PARAMS = {"temperature": "temperature", "target": "target", "power": "power", "speed": "speed", "rpm": "rpm"}
 
@@ -91,13 +197,16 @@ class Klippy:
         self,
         config: ConfigWrapper,
         logging_handler: logging.Handler,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        sync_transport: Optional[httpx.BaseTransport] = None,
     ):
         self._protocol: str = "https" if config.bot_config.ssl else "http"
         self._host: str = f"{self._protocol}://{config.bot_config.host}:{config.bot_config.port}"
         self._ssl_verify: bool = config.bot_config.ssl_verify
-        self._hidden_macros: List[str] = config.telegram_ui.hidden_macros + [self._DATA_MACRO]
+        self._hidden_macros: Set[str] = set(config.telegram_ui.hidden_macros + [self._DATA_MACRO])
         self._show_private_macros: bool = config.telegram_ui.show_private_macros
         self._message_parts: List[str] = config.status_message_content.content
+        self._status_templates: Dict[bool, StatusTemplate] = {markdown: StatusTemplate(self._message_parts, markdown) for markdown in (False, True)}
         self._eta_source: str = config.telegram_ui.eta_source
         self._light_device: PowerDevice
         self._psu_device: PowerDevice
@@ -106,13 +215,16 @@ class Klippy:
         self._fans_list: List[str] = config.status_message_content.fans
 
         self._devices_list: List[str] = config.status_message_content.moonraker_devices
-        self._user: str = config.secrets.user
-        self._passwd: str = config.secrets.passwd
-        self._api_token: str = config.secrets.api_token
-
         self._dbname: str = "telegram-bot"
+        # write-behind copy of the bot namespace, pending holds keys not yet written, _DB_DELETED marks deletions
+        self._db_cache: Dict[str, Any] = {}
+        self._db_pending: Dict[str, Any] = {}
+        self._db_loaded: bool = False
+        self._db_flush_task: Optional[asyncio.Task] = None
 
         self._connected: bool = False
+        # created lazily, so it binds to the loop the bot runs in and not the one active at import time
+        self._connected_event: Optional[asyncio.Event] = None
         self.printing: bool = False
         self.paused: bool = False
         self.state: str = ""
@@ -130,12 +242,20 @@ class Klippy:
         self.filament_total: float = 0.0
         self.filament_weight: float = 0.0
         self._thumbnail_path: str = ""
-
-        self._jwt_token: str = ""
-        self._refresh_token: str = ""
+        self._thumbnail_modified: float = 0.0
+        self._thumbnail_cache: ThumbnailCache = ThumbnailCache(os.path.join(config.bot_config.cache_path, "thumbnails"), self._host)
+        self._nopreview_thumb: bytes = b""
+        self._file_catalog: FileCatalog = FileCatalog()
+        self._prefetch_tasks: Dict[str, asyncio.Task] = {}
+        self._prefetch_semaphore: Optional[asyncio.Semaphore] = None
 
         # Todo: create sensors class!!
         self._objects_list: list = []
+        # rebuilt from the objects list on every klippy ready
+        self._macros_all: FrozenSet[str] = frozenset()
+        self._macros: List[str] = []
+        self._macro_commands: List[str] = []
+        self._macros_loaded: bool = False
         self._sensors_dict: dict = {}
         self._power_devices: dict = {}
 
@@ -144,9 +264,20 @@ class Klippy:
         if config.bot_config.debug:
             logger.setLevel(logging.DEBUG)
 
-        self._client: AsyncClient = AsyncClient(verify=self._ssl_verify)
-        self._client_sync: Client = Client(verify=self._ssl_verify)
-        self._auth_moonraker()
+        self._client: AsyncClient = AsyncClient(verify=self._ssl_verify, transport=transport)
+        self._client_sync: Client = Client(verify=self._ssl_verify, transport=sync_transport)
+        self._token = MoonrakerToken(self._host, config.secrets.user, config.secrets.passwd, config.secrets.api_token, self._client_sync)
+        self._token.login()
+
+    def subscription_fields(self) -> Dict[str, List[str]]:
+        fields: Dict[str, List[str]] = {"print_stats": ["state", "filename", "print_duration", "filament_used", "message"]}
+        if "progress" in self._message_parts:
+            fields["display_status"] = ["progress"]
+        if "height" in self._message_parts:
+            fields["gcode_move"] = ["gcode_position"]
+        if self._eta_source != "slicer" and ("eta" in self._message_parts or "finish_time" in self._message_parts):
+            fields["virtual_sdcard"] = ["progress"]
+        return fields
 
     def prepare_sens_dict_subscribe(self):
         self._sensors_dict = {}
@@ -188,50 +319,69 @@ class Klippy:
     def connected(self) -> bool:
         return self._connected
 
+    @property
+    def _connection_event(self) -> asyncio.Event:
+        if self._connected_event is None:
+            self._connected_event = asyncio.Event()
+        return self._connected_event
+
     async def set_connected(self, new_value: bool) -> None:
         self._connected = new_value
         self.printing = False
         self.paused = False
         self._reset_file_info()
         if new_value:
+            # file changes made while the websocket was down were not seen
+            self._file_catalog.invalidate()
             await self._update_printer_objects()
+            # retries writes that failed while moonraker was unreachable
+            await self.flush_db()
+            await self.load_db()
+            self._connection_event.set()
         else:
             self._objects_list = []
+            self._index_macros()
+            self._macros_loaded = False
+            self._connection_event.clear()
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self._connection_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
-    # Todo: save macros list until klippy restart
     @property
     def macros(self) -> List[str]:
-        return self._get_marco_list()
+        return self._macros
 
-    async def get_macros_force(self):
-        try:
-            await self._update_printer_objects()
-        except Exception as e:
-            logger.error(e)
-        return self._get_marco_list()
+    @property
+    def macros_all(self) -> FrozenSet[str]:
+        return self._macros_all
 
     @property
-    def macros_all(self) -> List[str]:
-        return self._get_full_marco_list()
+    def macro_commands(self) -> List[str]:
+        """Visible macros with names usable as telegram bot commands."""
+        return self._macro_commands
+
+    async def get_macro_commands(self) -> List[str]:
+        if not self._macros_loaded:
+            try:
+                await self._update_printer_objects()
+            except Exception as e:
+                logger.error(e)
+        return self._macro_commands
 
     @property
     def moonraker_host(self) -> str:
         return self._host
 
-    @property
-    def _headers(self):
-        heads = {}
-        if self._jwt_token:
-            heads = {"Authorization": f"Bearer {self._jwt_token}"}
-        elif self._api_token:
-            heads = {"X-Api-Key": self._api_token}
-        return heads
-
     async def get_one_shot_token(self) -> str:
-        if (not self._user and not self._jwt_token) and not self._api_token:
+        if not self._token.enabled:
             return ""
 
-        resp = await self._client.get(f"{self._host}/access/oneshot_token", headers=self._headers, timeout=15)
+        await self._token.ensure_fresh()
+        resp = await self._client.get(f"{self._host}/access/oneshot_token", headers=self._token.headers, timeout=15)
 
         try:
             resp.raise_for_status()
@@ -246,6 +396,19 @@ class Klippy:
         resp = await self.make_request("GET", "/printer/objects/list")
         if resp.is_success:
             self._objects_list = orjson.loads(resp.text)["result"]["objects"]
+            self._index_macros()
+            self._macros_loaded = True
+
+    def _index_macros(self) -> None:
+        all_macros = [elem.split(" ")[1].upper() for elem in self._objects_list if elem.split(" ")[0] == "gcode_macro"]
+        self._macros_all = frozenset(all_macros)
+        self._macros = [key for key in all_macros if key not in self._hidden_macros and (self._show_private_macros or not key.startswith("_"))]
+        self._macro_commands = []
+        for macro in self._macros:
+            if MACRO_COMMAND.match(macro):
+                self._macro_commands.append(macro)
+            else:
+                logger.debug("Macro %s is not a valid bot command name", macro)
 
     def _reset_file_info(self) -> None:
         self.printing_duration = 0.0
@@ -260,6 +423,7 @@ class Klippy:
         self.filament_total = 0.0
         self.filament_weight = 0.0
         self._thumbnail_path = ""
+        self._thumbnail_modified = 0.0
 
     @property
     def printing_filename(self) -> str:
@@ -276,11 +440,13 @@ class Klippy:
         if not response.is_success:
             logger.warning("bad response for file request %s", response.status_code)
         resp = orjson.loads(response.text)["result"]
+        self._file_catalog.set_metadata(new_value, resp)
         self._printing_filename = new_value
         self.file_estimated_time = resp["estimated_time"] if resp.get("estimated_time") else 0.0
         self.file_print_start_time = resp["print_start_time"] if resp.get("print_start_time") else time.time()
         self.filament_total = resp["filament_total"] if "filament_total" in resp else 0.0
         self.filament_weight = resp["filament_weight_total"] if "filament_weight_total" in resp else 0.0
+        self._thumbnail_modified = resp.get("modified", 0.0)
 
         if "thumbnails" in resp and "filename" in resp:
             thumb = max(resp["thumbnails"], key=lambda el: el["size"])
@@ -299,59 +465,15 @@ class Klippy:
     def printing_filename_with_time(self) -> str:
         return f"{self._printing_filename}_{datetime.fromtimestamp(self.file_print_start_time):%Y-%m-%d_%H-%M}"
 
-    def _get_full_marco_list(self) -> List[str]:
-        macro_lines = list(filter(lambda it: "gcode_macro" in it, self._objects_list))
-        loaded_macros = list(map(lambda el: el.split(" ")[1].upper(), macro_lines))
-        return loaded_macros
-
-    def _get_marco_list(self) -> List[str]:
-        return [key for key in self._get_full_marco_list() if key not in self._hidden_macros and (True if self._show_private_macros else not key.startswith("_"))]
-
-    def _auth_moonraker(self) -> None:
-        if not self._user or not self._passwd:
-            return
-
-        res = httpx.post(f"{self._host}/access/login", json={"username": self._user, "password": self._passwd}, timeout=15, verify=self._ssl_verify)
-
-        try:
-            res.raise_for_status()
-            res_result = orjson.loads(res.text)["result"]
-            self._jwt_token = res_result["token"]
-            self._refresh_token = res_result["refresh_token"]
-        except httpx.HTTPError as err:
-            logger.error(err)
-
-    async def _refresh_moonraker_token(self) -> None:
-        if not self._refresh_token:
-            return
-        res = await self._client.post(f"{self._host}/access/refresh_jwt", content=orjson.dumps({"refresh_token": self._refresh_token}), timeout=15)
-
-        try:
-            res.raise_for_status()
-            logger.debug("JWT token successfully refreshed")
-            self._jwt_token = orjson.loads(res.text)["result"]["token"]
-        except httpx.HTTPError as err:
-            logger.error("Failed to refresh token: %s", err)
-
-    def _refresh_moonraker_token_sync(self) -> None:
-        if not self._refresh_token:
-            return
-        res = self._client_sync.post(f"{self._host}/access/refresh_jwt", content=orjson.dumps({"refresh_token": self._refresh_token}), timeout=15)
-
-        try:
-            res.raise_for_status()
-            logger.debug("JWT token successfully refreshed")
-            self._jwt_token = orjson.loads(res.text)["result"]["token"]
-        except httpx.HTTPError as err:
-            logger.error("Failed to refresh token: %s", err)
-
     async def make_request(self, method, url_path, json=None, headers=None, files=None, timeout=30) -> httpx.Response:
-        _headers = headers if headers else self._headers
-        res = await self._client.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=_headers, files=files, timeout=timeout)
+        if not headers:
+            await self._token.ensure_fresh()
+        generation = self._token.generation
+        res = await self._client.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=headers or self._token.headers, files=files, timeout=timeout)
         if res.status_code == 401:  # Unauthorized
             logger.debug("JWT token expired, refreshing...")
-            await self._refresh_moonraker_token()
-            res = await self._client.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=_headers, files=files, timeout=timeout)
+            await self._token.refresh(generation)
+            res = await self._client.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=headers or self._token.headers, files=files, timeout=timeout)
 
         try:
             res.raise_for_status()
@@ -361,12 +483,14 @@ class Klippy:
         return res
 
     def make_request_sync(self, method, url_path, json=None, headers=None, files=None, timeout=30) -> httpx.Response:
-        _headers = headers if headers else self._headers
-        res = self._client_sync.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=_headers, files=files, timeout=timeout)
+        if not headers:
+            self._token.ensure_fresh_sync()
+        generation = self._token.generation
+        res = self._client_sync.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=headers or self._token.headers, files=files, timeout=timeout)
         if res.status_code == 401:  # Unauthorized
             logger.debug("JWT token expired, refreshing...")
-            self._refresh_moonraker_token_sync()
-            res = self._client_sync.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=_headers, files=files, timeout=timeout)
+            self._token.refresh_sync(generation)
+            res = self._client_sync.request(method, f"{self._host}{url_path}", content=orjson.dumps(json) if json else None, headers=headers or self._token.headers, files=files, timeout=timeout)
 
         try:
             res.raise_for_status()
@@ -376,23 +500,26 @@ class Klippy:
         return res
 
     async def check_connection(self) -> str:
-        connected = False
-        retries = 0
+        start = time.monotonic()
         last_reason = ""
-        while not connected and retries < 10:
+        for retry in range(self._CONNECTION_RETRIES):
             try:
                 response = await self.make_request("GET", "/printer/info", timeout=3)
-                connected = response.is_success
-
-                if connected:
+                if response.is_success:
+                    logger.info("Moonraker connection checked in %.2fs", time.monotonic() - start)
                     return ""
-                else:
-                    # Todo: get reason from error handler
-                    last_reason = f"{response.status_code}"
+                # Todo: get reason from error handler
+                last_reason = f"{response.status_code}"
             except Exception as ex:
                 logger.error(ex, exc_info=True)
-            retries += 1
-            time.sleep(1)
+                last_reason = f"{ex}"
+
+            if retry < self._CONNECTION_RETRIES - 1:
+                delay = min(self._BACKOFF_MAX, self._BACKOFF_BASE * 2**retry) * random.uniform(0.5, 1.0)
+                # the websocket may reach klippy while we are waiting, no need to sleep out the whole delay then
+                if await self.wait_connected(delay):
+                    logger.info("Moonraker connection checked in %.2fs", time.monotonic() - start)
+                    return ""
         return f"Connection failed. {last_reason}"
 
     def update_sensor(self, name: str, value) -> None:
@@ -402,33 +529,6 @@ class Klippy:
             if key in value:
                 self._sensors_dict[name][key] = value[val]
 
-    @staticmethod
-    def _sensor_message(name: str, value) -> str:
-        sens_name = re.sub(r"([A-Z]|\d|_)", r" \1", name).replace("_", "")
-        message = ""
-
-        if "power" in value:
-            message = emoji.emojize(":hotsprings: ", language="alias")
-        elif "speed" in value:
-            message = emoji.emojize(":tornado: ", language="alias")
-        elif "temperature" in value:
-            message = emoji.emojize(":thermometer: ", language="alias")
-
-        message += f"{sens_name.title()}:"
-
-        if "temperature" in value:
-            message += f" {round(value['temperature'])} \N{DEGREE SIGN}C"
-        if "target" in value and value["target"] > 0.0 and abs(value["target"] - value["temperature"]) > 2:
-            message += emoji.emojize(" :arrow_right: ", language="alias") + f"{round(value['target'])} \N{DEGREE SIGN}C"
-        if "power" in value and value["power"] > 0.0:
-            message += emoji.emojize(" :fire:", language="alias")
-        if "speed" in value:
-            message += f" {round(value['speed'] * 100)}%"
-        if "rpm" in value and value["rpm"] is not None:
-            message += f" {round(value['rpm'])} RPM"
-
-        return message
-
     def update_power_device(self, name: str, value) -> None:
         if name not in self._power_devices:
             self._power_devices[name] = {}
@@ -436,30 +536,21 @@ class Klippy:
             if key in value:
                 self._power_devices[name][key] = value[val]
 
-    @staticmethod
-    def _device_message(name: str, value, emoji_symbol: str = ":vertical_traffic_light:") -> str:
-        message = emoji.emojize(f" {emoji_symbol} ", language="alias") + f"{name}: "
-        if "status" in value:
-            message += f" {value['status']} "
-        if "locked_while_printing" in value and value["locked_while_printing"] == "True":
-            message += emoji.emojize(" :lock: ", language="alias")
-        if message:
-            message += "\n"
-        return message
-
-    def _get_sensors_message(self) -> str:
-        return "\n".join([self._sensor_message(n, v) for n, v in self._sensors_dict.items()]) + "\n"
+    def _get_sensors_message(self, markdown: bool = False) -> str:
+        template = self._status_templates[markdown]
+        return "\n".join([template.sensor(n, v) for n, v in self._sensors_dict.items()]) + "\n"
 
-    def _get_power_devices_mess(self) -> str:
+    def _get_power_devices_mess(self, markdown: bool = False) -> str:
+        template = self._status_templates[markdown]
         message = ""
         for name, value in self._power_devices.items():
             if name in self._devices_list:
                 if name == self._light_device.name:
-                    message += self._device_message(name, value, ":flashlight:")
+                    message += template.device(name, value, ":flashlight:")
                 elif name == self._psu_device.name:
-                    message += self._device_message(name, value, ":electric_plug:")
+                    message += template.device(name, value, ":electric_plug:")
                 else:
-                    message += self._device_message(name, value)
+                    message += template.device(name, value)
         return message
 
     async def execute_command(self, *command) -> None:
@@ -468,9 +559,6 @@ class Klippy:
     async def execute_gcode_script(self, gcode: str) -> None:
         await self.make_request("GET", f"/printer/gcode/script?script={gcode}")
 
-    def execute_gcode_script_sync(self, gcode: str) -> None:
-        self.make_request_sync("GET", f"/printer/gcode/script?script={gcode}")
-
     def _get_eta(self) -> timedelta:
         if self._eta_source == "slicer":
             eta = int(self.file_estimated_time - self.printing_duration)
@@ -481,55 +569,61 @@ class Klippy:
         eta = max(eta, 0)
         return timedelta(seconds=eta)
 
-    async def _populate_with_thumb(self, thumb_path: str, message: str) -> Tuple[str, BytesIO]:
+    @staticmethod
+    def _encode_thumb(img: Image.Image) -> bytes:
+        bio = BytesIO()
+        img.convert("RGB").save(bio, "JPEG", quality=95, subsampling=0, optimize=True)
+        img.close()
+        return bio.getvalue()
+
+    def _nopreview(self) -> bytes:
+        if not self._nopreview_thumb:
+            self._nopreview_thumb = self._encode_thumb(Image.open("../imgs/nopreview.png"))
+        return self._nopreview_thumb
+
+    async def _get_thumb(self, thumb_path: str, modified: float) -> bytes:
         if not thumb_path:
-            img = Image.open("../imgs/nopreview.png").convert("RGB")
             logger.warning("Empty thumbnail_path")
-        else:
-            response = await self.make_request("GET", f"/server/files/gcodes/{urllib.parse.quote(thumb_path)}")
-            try:
-                response.raise_for_status()
-                img = Image.open(BytesIO(response.content)).convert("RGB")
-            except httpx.HTTPError as err:
-                logger.error("Thumbnail download failed for %s \n\n%s", thumb_path, err)
-                img = Image.open("../imgs/nopreview.png").convert("RGB")
+            return self._nopreview()
 
-        bio = BytesIO()
+        cached = await self._thumbnail_cache.get(thumb_path, modified)
+        if cached is not None:
+            return cached
+
+        response = await self.make_request("GET", f"/server/files/gcodes/{urllib.parse.quote(thumb_path)}")
+        try:
+            response.raise_for_status()
+            thumb = self._encode_thumb(Image.open(BytesIO(response.content)))
+            await self._thumbnail_cache.put(thumb_path, modified, thumb)
+            return thumb
+        except httpx.HTTPError as err:
+            logger.error("Thumbnail download failed for %s \n\n%s", thumb_path, err)
+            return self._nopreview()
+
+    async def _populate_with_thumb(self, thumb_path: str, message: str, modified: float = 0.0) -> Tuple[str, BytesIO]:
+        bio = BytesIO(await self._get_thumb(thumb_path, modified))
         bio.name = f"{self.printing_filename}.webp"
-        img.save(bio, "JPEG", quality=95, subsampling=0, optimize=True)
-        bio.seek(0)
-        img.close()
         return message, bio
 
     async def get_file_info(self, message: str = "") -> Tuple[str, BytesIO]:
         message = self.get_print_stats(message)
-        return await self._populate_with_thumb(self._thumbnail_path, message)
-
-    def _get_printing_file_info(self, message_pre: str = "") -> str:
-        message = f"Printing: {self.printing_filename} \n" if not message_pre else f"{message_pre}: {self.printing_filename} \n"
-        if "progress" in self._message_parts:
-            message += f"Progress {round(self.printing_progress * 100, 0)}%"
-        if "height" in self._message_parts:
-            message += f", height: {round(self.printing_height, 2)}mm\n" if self.printing_height > 0.0 else "\n"
-        if self.filament_total > 0.0:
-            if "filament_length" in self._message_parts:
-                message += f"Filament: {round(self.filament_used / 1000, 2)}m / {round(self.filament_total / 1000, 2)}m"
-            if self.filament_weight > 0.0 and "filament_weight" in self._message_parts:
-                message += f", weight: {round(self._filament_weight_used(), 2)}/{self.filament_weight}g"
-            message += "\n"
-        if "print_duration" in self._message_parts:
-            message += f"Printing for {timedelta(seconds=round(self.printing_duration))}\n"
-
-        eta = self._get_eta()
-        if "eta" in self._message_parts:
-            message += f"Estimated time left: {eta}\n"
-        if "finish_time" in self._message_parts:
-            message += f"Finish at {datetime.now() + eta:%Y-%m-%d %H:%M}\n"
-
-        return message
-
-    def get_print_stats(self, message_pre: str = "") -> str:
-        return self._get_printing_file_info(message_pre) + self._get_sensors_message() + self._get_power_devices_mess()
+        return await self._populate_with_thumb(self._thumbnail_path, message, self._thumbnail_modified)
+
+    def _get_printing_file_info(self, message_pre: str = "", markdown: bool = False) -> str:
+        return self._status_templates[markdown].file_info(
+            message_pre,
+            self.printing_filename,
+            self.printing_progress,
+            self.printing_height,
+            (self.filament_used, self.filament_total),
+            (self._filament_weight_used() if self.filament_weight > 0.0 else 0.0, self.filament_weight),
+            self.printing_duration,
+            self._get_eta(),
+        )
+
+    def get_print_stats(self, message_pre: str = "", markdown: bool = False) -> str:
+        """Printing file, sensors and devices lines, escaped for MarkdownV2 when `markdown` is set."""
+        return self._get_printing_file_info(message_pre, markdown) + self._get_sensors_message(markdown) + self._get_power_devices_mess(markdown)
 
     async def get_status(self) -> str:
         try:
@@ -570,16 +664,16 @@ class Klippy:
 
         return message
 
-    async def get_file_info_by_name(self, filename: str, message: str) -> Tuple[str, BytesIO]:
+    async def _get_file_metadata(self, filename: str) -> dict:
+        cached = self._file_catalog.metadata(filename)
+        if cached is not None:
+            return cached
         resp = orjson.loads((await self.make_request("GET", f"/server/files/metadata?filename={urllib.parse.quote(filename)}")).text)["result"]
-        message += "\n"
-        if "filament_total" in resp and resp["filament_total"] > 0.0:
-            message += f"Filament: {round(resp['filament_total'] / 1000, 2)}m"
-            if "filament_weight_total" in resp and resp["filament_weight_total"] > 0.0:
-                message += f", weight: {resp['filament_weight_total']}g"
-        if "estimated_time" in resp and resp["estimated_time"] > 0.0:
-            message += f"\nEstimated printing time: {timedelta(seconds=resp['estimated_time'])}"
+        self._file_catalog.set_metadata(filename, resp)
+        return resp
 
+    @staticmethod
+    def _file_thumb_path(resp: dict) -> str:
         thumb_path = ""
         if "thumbnails" in resp:
             thumb = max(resp["thumbnails"], key=lambda el: el["size"])
@@ -590,16 +684,78 @@ class Klippy:
                 thumb_path += thumb["relative_path"]
             else:
                 logger.error("Thumbnail relative_path and filename not found in %s", resp)
+        return thumb_path
 
-        return await self._populate_with_thumb(thumb_path, message)
+    async def _prefetch_file_info(self, filename: str, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                resp = await self._get_file_metadata(filename)
+                await self._get_thumb(self._file_thumb_path(resp), resp.get("modified", 0.0))
+            except Exception as err:
+                logger.debug("Prefetch failed for %s: %s", filename, err)
+            finally:
+                self._prefetch_tasks.pop(filename, None)
+
+    def prefetch_files_info(self, filenames: List[str]) -> None:
+        """Load metadata and thumbnails of the files shown on a keyboard page, so the print dialog opens from cache.
+
+        Only catalog files are prefetched, metadata is cached in the catalog and dropped with the file.
+        """
+        if self._prefetch_semaphore is None:
+            self._prefetch_semaphore = asyncio.Semaphore(self._PREFETCH_CONCURRENCY)
+        for filename in filenames:
+            if filename not in self._prefetch_tasks and self._file_catalog.get(filename) is not None and self._file_catalog.metadata(filename) is None:
+                self._prefetch_tasks[filename] = asyncio.create_task(self._prefetch_file_info(filename, self._prefetch_semaphore))
 
-    async def get_gcode_files(self):
-        response = await self.make_request("GET", "/server/files/list?root=gcodes")
-        files = sorted(orjson.loads(response.text)["result"], key=lambda item: item["modified"], reverse=True)
-        return files
+    async def get_file_info_by_name(self, filename: str, message: str) -> Tuple[str, BytesIO]:
+        if filename in self._prefetch_tasks:
+            await self._prefetch_tasks[filename]
+        resp = await self._get_file_metadata(filename)
+        message += "\n"
+        if "filament_total" in resp and resp["filament_total"] > 0.0:
+            message += f"Filament: {round(resp['filament_total'] / 1000, 2)}m"
+            if "filament_weight_total" in resp and resp["filament_weight_total"] > 0.0:
+                message += f", weight: {resp['filament_weight_total']}g"
+        if "estimated_time" in resp and resp["estimated_time"] > 0.0:
+            message += f"\nEstimated printing time: {timedelta(seconds=resp['estimated_time'])}"
+
+        return await self._populate_with_thumb(self._file_thumb_path(resp), message, resp.get("modified", 0.0))
 
-    async def upload_gcode_file(self, file: BytesIO, upload_path: str) -> bool:
-        return (await self.make_request("POST", "/server/files/upload", files={"file": file, "root": "gcodes", "path": upload_path})).is_success
+    async def get_gcode_files(self) -> List[dict]:
+        if not self._file_catalog.valid:
+            response = await self.make_request("GET", "/server/files/list?root=gcodes")
+            if not response.is_success:
+                return []
+            self._file_catalog.load(orjson.loads(response.text)["result"])
+        return self._file_catalog.files
+
+    async def _load_file_metadata(self, filename: str, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                await self._get_file_metadata(filename)
+            except (httpx.HTTPError, orjson.JSONDecodeError, KeyError) as err:
+                logger.debug("Metadata request failed for %s: %s", filename, err)
+
+    async def search_gcode_files(self, query: str) -> Tuple[List[dict], List[str]]:
+        """Catalog search, metadata of the searched files is loaded first when the query sorts or filters by it."""
+        await self.get_gcode_files()
+        missing = self._file_catalog.missing_metadata(query)
+        if missing:
+            semaphore = asyncio.Semaphore(self._PREFETCH_CONCURRENCY)
+            await asyncio.gather(*[self._load_file_metadata(filename, semaphore) for filename in missing])
+        return self._file_catalog.search(query)
+
+    async def get_gcode_file_by_hash(self, file_hash: str) -> Optional[str]:
+        await self.get_gcode_files()
+        return self._file_catalog.path_by_hash(file_hash)
+
+    def update_gcode_files(self, changes: List[dict]) -> None:
+        for change in changes:
+            self._file_catalog.apply_change(change)
+
+    def upload_gcode_file_sync(self, file: IO[bytes], filename: str, upload_path: str) -> bool:
+        # httpx streams the multipart body from the file in chunks, reading it may block on archive decompression
+        return self.make_request_sync("POST", "/server/files/upload", files={"file": (filename, file), "root": "gcodes", "path": upload_path}).is_success
 
     async def start_printing_file(self, filename: str) -> bool:
         return (await self.make_request("POST", f"/printer/print/start?filename={urllib.parse.quote(filename)}")).is_success
@@ -634,30 +790,81 @@ class Klippy:
         await self.make_request("POST", "/server/announcements/feed?name=moonraker-telegram-bot")
 
     # moonraker databse section
-    async def get_param_from_db(self, param_name: str):
-        res = await self.make_request("GET", f"/server/database/item?namespace={self._dbname}&key={param_name}")
+    async def load_db(self) -> None:
+        """Reads the whole bot namespace into the cache, writes still pending are kept on top of it."""
+        res = await self.make_request("GET", f"/server/database/item?namespace={self._dbname}")
         if res.is_success:
-            return orjson.loads(res.text)["result"]["value"]
+            values = orjson.loads(res.text)["result"]["value"]
+        elif res.status_code == 404:
+            values = {}
         else:
-            logger.error("Failed getting %s from %s \n\n%s", param_name, self._dbname, res)
-            # Fixme: return default value? check for 404!
-            return None
+            logger.error("Failed loading %s \n\n%s", self._dbname, res)
+            return
+        self._db_cache = {key: val for key, val in values.items() if key not in self._db_pending}
+        self._db_cache.update((key, val) for key, val in self._db_pending.items() if val is not self._DB_DELETED)
+        self._db_loaded = True
+
+    async def get_param_from_db(self, param_name: str):
+        if not self._db_loaded:
+            await self.load_db()
+        return self._db_cache.get(param_name)
 
     async def save_param_to_db(self, param_name: str, value) -> None:
-        data = {"namespace": self._dbname, "key": param_name, "value": value}
-        res = await self.make_request("POST", "/server/database/item", json=data)
-        if not res.is_success:
-            logger.error("Failed saving %s to %s \n\n%s", param_name, self._dbname, res)
+        self._db_cache[param_name] = value
+        self._schedule_db_write(param_name, value)
 
     async def delete_param_from_db(self, param_name: str) -> None:
-        res = await self.make_request("DELETE", f"/server/database/item?namespace={self._dbname}&key={param_name}")
-        if not res.is_success:
-            logger.error("Failed getting %s from %s \n\n%s", param_name, self._dbname, res)
+        self._db_cache.pop(param_name, None)
+        self._schedule_db_write(param_name, self._DB_DELETED)
+
+    def _schedule_db_write(self, param_name: str, value) -> None:
+        self._db_pending[param_name] = value
+        if self._db_flush_task is None or self._db_flush_task.done():
+            self._db_flush_task = asyncio.create_task(self._flush_db_later())
+
+    async def _flush_db_later(self) -> None:
+        """Flushes until nothing is pending, saves made during a flush go out with the next one.
+
+        Failed writes are retried with the delay doubled each time, up to _DB_RETRY_MAX_DELAY.
+        """
+        delay = self._DB_FLUSH_DELAY
+        while self._db_pending:
+            await asyncio.sleep(delay)
+            written = await self.flush_db()
+            delay = self._DB_FLUSH_DELAY if written else min(delay * 2, self._DB_RETRY_MAX_DELAY)
+
+    async def _write_db_param(self, param_name: str, value) -> bool:
+        if value is self._DB_DELETED:
+            res = await self.make_request("DELETE", f"/server/database/item?namespace={self._dbname}&key={param_name}")
+            # already missing in the database is fine for a delete
+            success = res.is_success or res.status_code == 404
+        else:
+            res = await self.make_request("POST", "/server/database/item", json={"namespace": self._dbname, "key": param_name, "value": value})
+            success = res.is_success
+        if not success:
+            logger.error("Failed writing %s to %s \n\n%s", param_name, self._dbname, res)
+        return success
+
+    async def flush_db(self) -> bool:
+        """Writes all pending changes and returns False if some failed and were requeued.
+
+        Only the last value of a key changed several times since the previous flush is sent.
+        """
+        if not self._db_pending:
+            return True
+        pending, self._db_pending = self._db_pending, {}
+        results = await asyncio.gather(*[self._write_db_param(key, val) for key, val in pending.items()], return_exceptions=True)
+        written = True
+        for (key, val), result in zip(pending.items(), results):
+            if result is not True:
+                written = False
+                if key not in self._db_pending:
+                    self._db_pending[key] = val
+        return written
 
     # macro data section
     async def save_data_to_marco(self, lapse_size: int, filename: str, path: str) -> None:
-        full_macro_list = self._get_full_marco_list()
-        if self._DATA_MACRO in full_macro_list:
+        if self._DATA_MACRO in self._macros_all:
             await self.execute_gcode_script(f"SET_GCODE_VARIABLE MACRO=bot_data VARIABLE=lapse_video_size VALUE={lapse_size}")
             await self.execute_gcode_script(f"SET_GCODE_VARIABLE MACRO=bot_data VARIABLE=lapse_filename VALUE='\"{filename}\"'")
             await self.execute_gcode_script(f"SET_GCODE_VARIABLE MACRO=bot_data VARIABLE=lapse_path VALUE='\"{path}\"'")
@@ -1,11 +1,12 @@
 import argparse
 import asyncio
+from collections import OrderedDict
 from collections.abc import Coroutine
 from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import faulthandler
+import functools
 import hashlib
-from io import BytesIO
 import itertools
 import logging
 from logging.handlers import RotatingFileHandler
@@ -17,9 +18,7 @@ import socket
 import subprocess
 import sys
 import tarfile
-import time
-from typing import Any, Dict, List, Optional, Union
-from zipfile import ZipFile
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from apscheduler.events import EVENT_JOB_ERROR  # type: ignore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler  # type: ignore
@@ -29,13 +28,16 @@ import orjson
 import telegram
 from telegram import BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message, MessageEntity, ReplyKeyboardMarkup, Update
 from telegram.constants import ChatAction, ParseMode
-from telegram.error import BadRequest
+from telegram.error import BadRequest, NetworkError
 from telegram.ext import Application, CallbackContext, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
 
 from camera import Camera, FFmpegCamera, MjpegCamera
 from configuration import ConfigWrapper
-from klippy import Klippy, PowerDevice
+from file_catalog import FileCatalog
+from gcode_upload import ARCHIVE_EXTENSIONS, UploadError, download_document, upload_gcodes
+from klippy import MACRO_COMMAND, Klippy, PowerDevice
 from notifications import Notifier
+from send_scheduler import SendScheduler
 from timelapse import Timelapse
 from websocket_helper import WebSocketHelper
 
@@ -121,6 +123,9 @@ light_power_device: PowerDevice
 psu_power_device: PowerDevice
 ws_helper: WebSocketHelper
 executors_pool: ThreadPoolExecutor = ThreadPoolExecutor(2, thread_name_prefix="bot_pool")
+send_scheduler: SendScheduler = SendScheduler()
+# callback data is limited to 64 bytes, so file keyboards refer to search queries by a short key
+files_queries: OrderedDict[str, str] = OrderedDict()
 
 
 async def echo_unknown(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
@@ -148,8 +153,7 @@ async def unknown_chat(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def status_no_confirm(effective_message: Message) -> None:
     if klippy.printing and not configWrap.notifications.group_only:
-        notifier.update_status()
-        time.sleep(configWrap.camera.light_timeout + 1.5)
+        await notifier.update_status()
         await effective_message.delete()
     else:
         mess = await klippy.get_status()
@@ -632,8 +636,10 @@ async def print_file_dialog_handler(update: Update, context: ContextTypes.DEFAUL
     if update.effective_message.reply_to_message is None:
         logger.error("Undefined reply_to_message for %s", update.effective_message.to_json())
         return
-    keyboard_keys = dict((x["callback_data"], x["text"]) for x in itertools.chain.from_iterable(query.message.reply_markup.to_dict()["inline_keyboard"]))
-    pri_filename = keyboard_keys[query.data]
+    pri_filename = await klippy.get_gcode_file_by_hash(query.data.removesuffix(".gcode")) if query.data else None
+    if pri_filename is None:
+        keyboard_keys = dict((x["callback_data"], x["text"]) for x in itertools.chain.from_iterable(query.message.reply_markup.to_dict()["inline_keyboard"]))
+        pri_filename = keyboard_keys[query.data]
     keyboard = [
         [
             InlineKeyboardButton(
@@ -749,10 +755,11 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         delete_query = False
     elif "gcode_files_offset:" in query.data:
-        offset = int(query.data.replace("gcode_files_offset:", ""))
+        offset, _, query_key = query.data.replace("gcode_files_offset:", "").partition(":")
+        text, keyboard = await gcode_files_keyboard(int(offset), files_queries.get(query_key, ""))
         await query.edit_message_text(
-            "Gcode files to print:",
-            reply_markup=await gcode_files_keyboard(offset),
+            text,
+            reply_markup=keyboard,
         )
         delete_query = False
     elif "print_file" in query.data:
@@ -783,7 +790,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif "send_logs:" in query.data:
         await send_logs_no_confirm(update.effective_message.reply_to_message)
     elif "files:" in query.data:
-        await get_gcode_files_no_confirm(update.effective_message.reply_to_message)
+        await get_gcode_files_no_confirm(update.effective_message.reply_to_message, files_queries.get(query.data.replace("files:", ""), ""))
     elif "services:" in query.data:
         await services_keyboard_no_confirm(update.effective_message.reply_to_message)
     elif "macros:" in query.data:
@@ -805,46 +812,81 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.delete_message()
 
 
-async def get_gcode_files_no_confirm(effective_message: Message) -> None:
+async def get_gcode_files_no_confirm(effective_message: Message, query: str = "") -> None:
     await effective_message.get_bot().send_chat_action(chat_id=configWrap.secrets.chat_id, action=ChatAction.TYPING)
+    text, keyboard = await gcode_files_keyboard(query=query)
     await effective_message.reply_text(
-        "Gcode files to print:",
-        reply_markup=await gcode_files_keyboard(),
+        text,
+        reply_markup=keyboard,
         disable_notification=notifier.silent_commands,
         quote=True,
     )
 
 
-async def get_gcode_files(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+async def get_gcode_files(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_message is None or update.effective_message.get_bot() is None:
         logger.warning("Undefined effective message or bot")
         return
 
+    query = " ".join(context.args) if context.args else ""
     if configWrap.telegram_ui.is_present_in_require_confirmation("files") or configWrap.telegram_ui.confirm_command():
-        await command_confirm_message(update, text="List gcode files?", callback_mess="files:")
+        await command_confirm_message(update, text="List gcode files?", callback_mess=f"files:{files_query_key(query)}")
     else:
-        await get_gcode_files_no_confirm(update.effective_message)
+        await get_gcode_files_no_confirm(update.effective_message, query)
+
 
+def files_query_key(query: str) -> str:
+    if not query:
+        return ""
+    key = hashlib.md5(query.encode()).hexdigest()[:10]
+    files_queries[key] = query
+    files_queries.move_to_end(key)
+    while len(files_queries) > 256:
+        files_queries.popitem(last=False)
+    return key
 
-async def gcode_files_keyboard(offset: int = 0):
+
+async def gcode_files_keyboard(offset: int = 0, query: str = "") -> Tuple[str, InlineKeyboardMarkup]:
     def create_file_button(element) -> List[InlineKeyboardButton]:
         filename = element["path"] if "path" in element else element["filename"]
         return [
             InlineKeyboardButton(
                 filename,
-                callback_data=hashlib.md5(filename.encode()).hexdigest() + ".gcode",
+                callback_data=FileCatalog.file_hash(filename) + ".gcode",
+            )
+        ]
+
+    def create_dir_button(directory: str, label: str) -> List[InlineKeyboardButton]:
+        return [
+            InlineKeyboardButton(
+                emoji.emojize(f":file_folder: {label}", language="alias"),
+                callback_data=f"gcode_files_offset:0:{files_query_key(f'dir:{directory}/ sort:{sort}')}",
             )
         ]
 
-    gcodes = await klippy.get_gcode_files()
-    files_keys: List[List[InlineKeyboardButton]] = list(map(create_file_button, gcodes[offset : offset + 10]))
+    if query:
+        gcodes, subdirs = await klippy.search_gcode_files(query)
+        _, directory, sort = FileCatalog.parse_query(query)
+        text = f"Gcode files for '{query}': {len(gcodes)}" if gcodes or subdirs else f"No gcode files found for '{query}'"
+    else:
+        gcodes, subdirs, directory, sort = await klippy.get_gcode_files(), [], None, "new"
+        text = "Gcode files to print:"
+    query_key = files_query_key(query)
+
+    files_keys: List[List[InlineKeyboardButton]] = []
+    if offset == 0 and directory:
+        files_keys.append(create_dir_button(directory.rpartition("/")[0], ".."))
+    if offset == 0:
+        files_keys += [create_dir_button(subdir, subdir.rpartition("/")[2] + "/") for subdir in subdirs]
+    files_keys += list(map(create_file_button, gcodes[offset : offset + 10]))
+    klippy.prefetch_files_info([element["path"] for element in gcodes[offset : offset + 10] if "path" in element])
     if len(gcodes) > 10:
         arrows = []
         if offset >= 10:
             arrows.append(
                 InlineKeyboardButton(
                     emoji.emojize(":arrow_backward:previous", language="alias"),
-                    callback_data=f"gcode_files_offset:{offset - 10}",
+                    callback_data=f"gcode_files_offset:{offset - 10}:{query_key}",
                 )
             )
         arrows.append(
@@ -857,13 +899,13 @@ async def gcode_files_keyboard(offset: int = 0):
             arrows.append(
                 InlineKeyboardButton(
                     emoji.emojize("next:arrow_forward:", language="alias"),
-                    callback_data=f"gcode_files_offset:{offset + 10}",
+                    callback_data=f"gcode_files_offset:{offset + 10}:{query_key}",
                 )
             )
 
         files_keys += [arrows]
 
-    return InlineKeyboardMarkup(files_keys)
+    return text, InlineKeyboardMarkup(files_keys)
 
 
 async def services_keyboard_no_confirm(effective_message: Message) -> None:
@@ -972,6 +1014,56 @@ async def macros_handler(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         await echo_unknown(update, _)
 
 
+async def send_uploaded_file(effective_message: Message, gcode_name: str) -> None:
+    start_pre_mess = "Successfully uploaded file:"
+    uploaded_path = f"{configWrap.bot_config.formatted_upload_path}{gcode_name}"
+    mess, thumb = await klippy.get_file_info_by_name(uploaded_path, f"{start_pre_mess}{uploaded_path}")
+    filehash = hashlib.md5(uploaded_path.encode()).hexdigest() + ".gcode"
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                emoji.emojize(":robot: print file", language="alias"),
+                callback_data=f"print_file:{filehash}",
+            ),
+            InlineKeyboardButton(
+                emoji.emojize(":cross_mark: do nothing", language="alias"),
+                callback_data="do_nothing",
+            ),
+        ]
+    ]
+    await effective_message.reply_photo(
+        photo=thumb,
+        caption=mess,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        disable_notification=notifier.silent_commands,
+        quote=True,
+        caption_entities=[MessageEntity(type="bold", offset=len(start_pre_mess), length=len(uploaded_path))],
+    )
+    thumb.close()
+    # Todo: delete uploaded file
+    # bot.delete_message(effective_message.chat_id, effective_message.message_id)
+
+
+async def send_upload_summary(effective_message: Message, archive_name: str, uploaded: List[str], failed: List[str]) -> None:
+    summary = f"Uploaded {len(uploaded)} of {len(uploaded) + len(failed)} files from {archive_name}"
+    if failed:
+        summary += f"\nFailed: {', '.join(failed)}"
+    if len(uploaded) > 10:
+        summary += "\nPreviews of the first 10 files:"
+
+    paths = [f"{configWrap.bot_config.formatted_upload_path}{name}" for name in uploaded[:10]]
+    files_info = await asyncio.gather(*[klippy.get_file_info_by_name(path, path) for path in paths])
+    captions = [f"{summary}\n\n{mess}"[:1024] if pos == 0 else mess[:1024] for pos, (mess, _) in enumerate(files_info)]
+    if len(files_info) == 1:
+        # media groups need at least two items
+        await effective_message.reply_photo(photo=files_info[0][1], caption=captions[0], disable_notification=notifier.silent_commands, quote=True)
+    else:
+        media = [InputMediaPhoto(thumb, caption=caption) for (_, thumb), caption in zip(files_info, captions)]
+        await effective_message.reply_media_group(media, disable_notification=notifier.silent_commands, quote=True, write_timeout=120)
+    for _, thumb in files_info:
+        thumb.close()
+
+
 async def upload_file(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_message is None or update.effective_message.get_bot() is None:
         logger.warning("Undefined effective message or bot")
@@ -987,7 +1079,7 @@ async def upload_file(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
-    if not doc.file_name.endswith((".gcode", ".zip", ".tar.gz", ".tar.bz2", ".tar.xz")):
+    if not doc.file_name.endswith((".gcode", *ARCHIVE_EXTENSIONS)):
         await update.effective_message.reply_text(
             f"unknown filetype in {doc.file_name}",
             disable_notification=notifier.silent_commands,
@@ -996,7 +1088,7 @@ async def upload_file(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     try:
-        file_byte_array = await (await doc.get_file()).download_as_bytearray()
+        document = await download_document(await doc.get_file())
     except BadRequest as badreq:
         await update.effective_message.reply_text(
             f"Bad request: {badreq.message}",
@@ -1004,92 +1096,37 @@ async def upload_file(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
             quote=True,
         )
         return
+    except NetworkError as err:
+        logger.error("Failed downloading %s: %s", doc.file_name, err)
+        await update.effective_message.reply_text(
+            f"Failed downloading file: {doc.file_name}",
+            disable_notification=notifier.silent_commands,
+            quote=True,
+        )
+        return
 
-    # Todo: add context managment!
-    uploaded_bio = BytesIO()
-    uploaded_bio.name = doc.file_name
-    uploaded_bio.write(file_byte_array)
-    uploaded_bio.seek(0)
-
-    sending_bio = BytesIO()
-    if doc.file_name.endswith(".gcode"):
-        sending_bio = uploaded_bio
-    elif doc.file_name.endswith(".zip"):
-        with ZipFile(uploaded_bio) as my_zip_file:
-            if len(my_zip_file.namelist()) > 1:
-                await update.effective_message.reply_text(
-                    f"Multiple files in archive {doc.file_name}",
-                    disable_notification=notifier.silent_commands,
-                    quote=True,
-                )
-            else:
-                with my_zip_file.open(my_zip_file.namelist()[0]) as contained_file:
-                    sending_bio.name = contained_file.name
-                    sending_bio.write(contained_file.read())
-                    sending_bio.seek(0)
-
-    elif doc.file_name.endswith((".tar.gz", ".tar.bz2", ".tar.xz")):
-        with tarfile.open(fileobj=uploaded_bio, mode="r:*") as tararch:
-            if len(tararch.getmembers()) > 1:
-                await update.effective_message.reply_text(
-                    f"Multiple files in archive {doc.file_name}",
-                    disable_notification=notifier.silent_commands,
-                    quote=True,
-                )
-            else:
-                archived_file = tararch.getmembers()[0]
-                extracted_f = tararch.extractfile(archived_file)
-                if extracted_f:
-                    sending_bio.name = archived_file.name
-                    sending_bio.write(extracted_f.read())
-                    sending_bio.seek(0)
-
-    if sending_bio.name:
-        if not sending_bio.name.endswith(".gcode"):
-            await update.effective_message.reply_text(
-                f"Not a gcode file {doc.file_name}",
-                disable_notification=notifier.silent_commands,
-                quote=True,
-            )
-        else:
-            if await klippy.upload_gcode_file(sending_bio, configWrap.bot_config.upload_path):
-                start_pre_mess = "Successfully uploaded file:"
-                mess, thumb = await klippy.get_file_info_by_name(
-                    f"{configWrap.bot_config.formatted_upload_path}{sending_bio.name}", f"{start_pre_mess}{configWrap.bot_config.formatted_upload_path}{sending_bio.name}"
-                )
-                filehash = hashlib.md5(doc.file_name.encode()).hexdigest() + ".gcode"
-                keyboard = [
-                    [
-                        InlineKeyboardButton(
-                            emoji.emojize(":robot: print file", language="alias"),
-                            callback_data=f"print_file:{filehash}",
-                        ),
-                        InlineKeyboardButton(
-                            emoji.emojize(":cross_mark: do nothing", language="alias"),
-                            callback_data="do_nothing",
-                        ),
-                    ]
-                ]
-                await update.effective_message.reply_photo(
-                    photo=thumb,
-                    caption=mess,
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                    disable_notification=notifier.silent_commands,
-                    quote=True,
-                    caption_entities=[MessageEntity(type="bold", offset=len(start_pre_mess), length=len(f"{configWrap.bot_config.formatted_upload_path}{sending_bio.name}"))],
-                )
-                thumb.close()
-                # Todo: delete uploaded file
-                # bot.delete_message(update.effective_message.chat_id, update.effective_message.message_id)
-            else:
-                await update.effective_message.reply_text(
-                    f"Failed uploading file: {sending_bio.name}",
-                    disable_notification=notifier.silent_commands,
-                    quote=True,
-                )
+    try:
+        uploaded, failed = await upload_gcodes(document, doc.file_name, functools.partial(klippy.upload_gcode_file_sync, upload_path=configWrap.bot_config.upload_path))
+    except UploadError as err:
+        await update.effective_message.reply_text(
+            str(err),
+            disable_notification=notifier.silent_commands,
+            quote=True,
+        )
+        return
+    finally:
+        document.close()
 
-    uploaded_bio.close()
-    sending_bio.close()
+    if not uploaded:
+        await update.effective_message.reply_text(
+            f"Failed uploading file: {', '.join(failed)}",
+            disable_notification=notifier.silent_commands,
+            quote=True,
+        )
+    elif len(uploaded) == 1 and not failed:
+        await send_uploaded_file(update.effective_message, uploaded[0])
+    else:
+        await send_upload_summary(update.effective_message, doc.file_name, uploaded, failed)
 
 
 def bot_error_handler(_: object, context: CallbackContext) -> None:
@@ -1131,7 +1168,7 @@ def bot_commands() -> Dict[str, str]:
         "bot_restart": "restarts the bot service, useful for config updates",
         "fw_restart": "Execute klipper FIRMWARE_RESTART",
         "services": "List services and restart them",
-        "files": "list available gcode files",
+        "files": 'list available gcode files, search with "files benchy sort:name" or browse "files subdir/"',
         "macros": "list all visible macros from klipper",
         "gcode": 'run any gcode command, spaces are supported. "gcode G28 Z"',
         "logs": "get klipper, moonraker, bot logs",
@@ -1166,7 +1203,7 @@ async def help_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 def prepare_command(marco: str):
-    if re.match("^[a-zA-Z0-9_]{1,32}$", marco):
+    if MACRO_COMMAND.match(marco):
         try:
             return BotCommand(marco.lower(), marco)
         except Exception as ex:
@@ -1209,7 +1246,7 @@ async def greeting_message(bot: telegram.Bot) -> None:
             disable_notification=notifier.silent_status,
         )
 
-    await bot.set_my_commands(commands=prepare_commands_list(await klippy.get_macros_force(), configWrap.telegram_ui.include_macros_in_command_list))
+    await bot.set_my_commands(commands=prepare_commands_list(await klippy.get_macro_commands(), configWrap.telegram_ui.include_macros_in_command_list))
     await klippy.add_bot_announcements_feed()
     await check_unfinished_lapses(bot)
 
@@ -1226,6 +1263,12 @@ def get_local_ip():
     return ip_address
 
 
+async def flush_on_shutdown(_: Application) -> None:
+    await klippy.flush_db()
+    logger.info("Telegram send scheduler stats: %s", send_scheduler.metrics)
+    logger.info("Skipped unchanged status edits: %s", notifier.avoided_calls)
+
+
 def start_bot(bot_token, socks):
     app_builder = Application.builder()
     (
@@ -1243,6 +1286,8 @@ def start_bot(bot_token, socks):
         .get_updates_read_timeout(45)
         .get_updates_write_timeout(60)
         .token(bot_token)
+        .rate_limiter(send_scheduler)
+        .post_shutdown(flush_on_shutdown)
     )
 
     if socks:
@@ -1296,6 +1341,7 @@ async def start_scheduler(context: ContextTypes.DEFAULT_TYPE):
     )
     # bot_updater.create_task(ws_helper.run_forever_async())
     loop = asyncio.get_event_loop()
+    cameraWrap.loop = loop
     loop.create_task(ws_helper.run_forever_async())
 
 
@@ -1368,5 +1414,6 @@ if __name__ == "__main__":
 
     bot_updater.job_queue.run_once(start_scheduler, 1)
     bot_updater.run_polling(allowed_updates=Update.ALL_TYPES)
+    ws_helper.stop_recording()
 
     logger.info("Shutting down the bot")
@@ -1,14 +1,18 @@
 import asyncio
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from datetime import datetime
+import hashlib
 from io import BytesIO
 import logging
 from pathlib import Path
 import re
-from typing import Dict, List, Optional, Tuple, Union
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 from apscheduler.schedulers.base import BaseScheduler  # type: ignore
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message
+from telegram import Bot, Chat, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message, PhotoSize
 from telegram.constants import ChatAction, ParseMode
 from telegram.error import BadRequest
 from telegram.helpers import escape_markdown
@@ -21,6 +25,10 @@ logger = logging.getLogger(__name__)
 
 
 class Notifier:
+    _GROUPS_CONCURRENCY = 8
+    _STATE_PARAM = "notifier_state"
+    _MEDIA_GROUP_SIZE = 10
+
     def __init__(
         self,
         config: ConfigWrapper,
@@ -62,6 +70,16 @@ class Notifier:
         self._status_message: Optional[Message] = None
         self._bzz_mess_id: int = 0
         self._groups_status_mesages: Dict[int, Message] = {}
+        self._groups_semaphore: Optional[asyncio.Semaphore] = None
+
+        # the latest status update waiting for the editor, older ones are dropped
+        self._status_lock: threading.Lock = threading.Lock()
+        self._pending_status: Optional[Dict[str, Any]] = None
+        self._status_waiters: List[asyncio.Future] = []
+        self._status_editor_running: bool = False
+        # digests of the text and photo last sent to each status message, by chat and message id
+        self._status_hashes: Dict[Tuple[int, int], Tuple[bytes, bytes]] = {}
+        self._avoided_calls: Counter = Counter()
 
         if logging_handler:
             logger.addHandler(logging_handler)
@@ -127,113 +145,225 @@ class Notifier:
             self._interval = new_value
             self._reschedule_notifier_timer()
 
-    async def _send_message(self, message: str, silent: bool, group_only: bool = False, manual: bool = False) -> None:
-        if not group_only:
-            await self._bot.send_chat_action(chat_id=self._chat_id, action=ChatAction.TYPING)
-            if self._status_message and not manual:
-                if self._bzz_mess_id != 0:
-                    try:
-                        await self._bot.delete_message(self._chat_id, self._bzz_mess_id)
-                    except BadRequest as badreq:
-                        logger.warning("Failed deleting bzz message \n%s", badreq)
-                        self._bzz_mess_id = 0
-
-                if self._status_message.caption:
-                    await self._status_message.edit_caption(caption=message, parse_mode=ParseMode.MARKDOWN_V2)
-                else:
-                    await self._status_message.edit_text(text=message, parse_mode=ParseMode.MARKDOWN_V2)
+    def subscription_fields(self) -> Dict[str, List[str]]:
+        fields: Dict[str, List[str]] = {}
+        if self._percent > 0:
+            fields.setdefault("display_status", []).append("progress")
+        if self._status_message_m117_update or "m117_status" in self._message_parts:
+            fields.setdefault("display_status", []).append("message")
+        if self._height > 0:
+            fields["gcode_move"] = ["gcode_position"]
+        return fields
+
+    async def _fan_out(self, send: Callable[[int, Optional[int]], Awaitable[Any]], groups: Optional[List[Tuple[int, Optional[int]]]] = None) -> Dict[int, BaseException]:
+        """Runs send for every notify group or the given ones, at most _GROUPS_CONCURRENCY at once, and returns the errors by group.
+
+        A failing group is logged and doesn't stop or delay the others.
+        """
+        if self._groups_semaphore is None:
+            self._groups_semaphore = asyncio.Semaphore(self._GROUPS_CONCURRENCY)
+        semaphore = self._groups_semaphore
+
+        async def send_limited(group: int, message_thread_id: Optional[int]) -> None:
+            async with semaphore:
+                await send(group, message_thread_id)
+
+        if groups is None:
+            groups = self._notify_groups
+        results = await asyncio.gather(*[send_limited(group, message_thread_id) for group, message_thread_id in groups], return_exceptions=True)
+        errors = {group: res for (group, _), res in zip(groups, results) if isinstance(res, BaseException)}
+        for group, error in errors.items():
+            logger.error("Failed sending notification to group %s: %s", group, error)
+        return errors
 
-                if self._progress_update_message:
-                    mes = await self._bot.send_message(self._chat_id, text="Status has been updated\nThis message will be deleted", disable_notification=silent)
-                    self._bzz_mess_id = mes.message_id
-            else:
-                sent_message = await self._bot.send_message(
-                    self._chat_id,
-                    text=message,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    disable_notification=silent,
-                )
-                if not self._status_message and not manual:
-                    self._status_message = sent_message
-
-        for group, message_thread_id in self._notify_groups:
-            await self._bot.send_chat_action(chat_id=group, message_thread_id=message_thread_id, action=ChatAction.TYPING)
-            if group in self._groups_status_mesages and not manual:
-                mess = self._groups_status_mesages[group]
-                if mess.caption:
-                    await mess.edit_caption(caption=message, parse_mode=ParseMode.MARKDOWN_V2)
-                else:
-                    await mess.edit_text(text=message, parse_mode=ParseMode.MARKDOWN_V2)
+    @staticmethod
+    def _photo_file_id(message: Union[Message, bool, None]) -> Optional[str]:
+        if isinstance(message, bool) or message is None or not message.photo:
+            return None
+        return message.photo[-1].file_id
+
+    @staticmethod
+    def _digest(content: bytes) -> bytes:
+        return hashlib.blake2b(content, digest_size=16).digest()
+
+    def _remember_status(self, mess: Union[Message, bool], message: str, photo_digest: bytes = b"") -> None:
+        if not isinstance(mess, bool):
+            self._status_hashes[(mess.chat_id, mess.message_id)] = (self._digest(message.encode()), photo_digest)
+
+    def _status_unchanged(self, mess: Message, message: str, photo_digest: bytes = b"") -> bool:
+        """True when the status message already shows this text and photo, the calls the edit would have cost are counted."""
+        if self._status_hashes.get((mess.chat_id, mess.message_id)) != (self._digest(message.encode()), photo_digest):
+            return False
+        if photo_digest:
+            self._avoided_calls["edit_message_media"] += 1
+        self._avoided_calls["edit_message_caption" if mess.caption else "edit_message_text"] += 1
+        return True
+
+    async def _edit_status(self, mess: Message, message: str, photo: Union[BytesIO, bytes, str, None] = None, photo_digest: bytes = b"") -> Union[Message, bool]:
+        """Edits only the changed parts of the status message, a new photo is sent together with its caption."""
+        text_digest, last_photo_digest = self._status_hashes.get((mess.chat_id, mess.message_id), (b"", b""))
+        if photo is not None and photo_digest != last_photo_digest:
+            edited = await mess.edit_media(media=InputMediaPhoto(photo, caption=message, parse_mode=ParseMode.MARKDOWN_V2))
+            self._avoided_calls["edit_message_caption"] += 1
+        else:
+            if photo is not None:
+                self._avoided_calls["edit_message_media"] += 1
+            if text_digest == self._digest(message.encode()):
+                return mess
+            if mess.caption:
+                edited = await mess.edit_caption(caption=message, parse_mode=ParseMode.MARKDOWN_V2)
             else:
-                sent_message = await self._bot.send_message(
-                    chat_id=group,
-                    message_thread_id=message_thread_id,
-                    text=message,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    disable_notification=silent,
-                )
-                if group in self._groups_status_mesages or manual:
-                    continue
+                edited = await mess.edit_text(text=message, parse_mode=ParseMode.MARKDOWN_V2)
+        self._remember_status(mess, message, photo_digest)
+        return edited
+
+    @property
+    def avoided_calls(self) -> Dict[str, int]:
+        """Telegram api calls the notifier skipped, unchanged status edits and chat actions before fast requests, by api method."""
+        return dict(self._avoided_calls)
+
+    async def _chat_action(self, chat_id: int, message_thread_id: Optional[int] = None, photo: Union[BytesIO, bytes, str, None] = None) -> None:
+        """Shows the upload action before a photo upload, sending or editing text or reusing a file_id is quick enough without one."""
+        if photo is None or isinstance(photo, str):
+            self._avoided_calls["send_chat_action"] += 1
+            return
+        await self._bot.send_chat_action(chat_id=chat_id, message_thread_id=message_thread_id, action=ChatAction.UPLOAD_PHOTO)
+
+    async def _send_group_message(self, group: int, message_thread_id: Optional[int], message: str, silent: bool, manual: bool) -> None:
+        if group in self._groups_status_mesages and not manual:
+            mess = self._groups_status_mesages[group]
+            if self._status_unchanged(mess, message):
+                return
+            await self._chat_action(group, message_thread_id)
+            await self._edit_status(mess, message)
+        else:
+            await self._chat_action(group, message_thread_id)
+            sent_message = await self._bot.send_message(
+                chat_id=group,
+                message_thread_id=message_thread_id,
+                text=message,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                disable_notification=silent,
+            )
+            if group not in self._groups_status_mesages and not manual:
                 self._groups_status_mesages[group] = sent_message
+                self._remember_status(sent_message, message)
+
+    async def _send_message(self, message: str, silent: bool, group_only: bool = False, manual: bool = False) -> None:
+        groups_task = asyncio.create_task(self._fan_out(lambda group, thread_id: self._send_group_message(group, thread_id, message, silent, manual)))
+        try:
+            if not group_only:
+                await self._send_chat_message(message, silent, manual)
+        finally:
+            await groups_task
+
+    async def _delete_bzz_message(self) -> None:
+        if self._bzz_mess_id != 0:
+            try:
+                await self._bot.delete_message(self._chat_id, self._bzz_mess_id)
+            except BadRequest as badreq:
+                logger.warning("Failed deleting bzz message \n%s", badreq)
+                self._bzz_mess_id = 0
+
+    async def _send_chat_message(self, message: str, silent: bool, manual: bool) -> None:
+        if self._status_message and not manual:
+            if self._status_unchanged(self._status_message, message):
+                return
+            await self._chat_action(self._chat_id)
+            await self._delete_bzz_message()
+            await self._edit_status(self._status_message, message)
+
+            if self._progress_update_message:
+                mes = await self._bot.send_message(self._chat_id, text="Status has been updated\nThis message will be deleted", disable_notification=silent)
+                self._bzz_mess_id = mes.message_id
+        else:
+            await self._chat_action(self._chat_id)
+            sent_message = await self._bot.send_message(
+                self._chat_id,
+                text=message,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                disable_notification=silent,
+            )
+            if not self._status_message and not manual:
+                self._status_message = sent_message
+                self._remember_status(sent_message, message)
+
+    async def _send_group_photo(self, group: int, message_thread_id: Optional[int], photo: Union[bytes, str], photo_digest: bytes, message: str, silent: bool, manual: bool) -> Union[Message, bool]:
+        if group in self._groups_status_mesages and not manual:
+            mess = self._groups_status_mesages[group]
+            if self._status_unchanged(mess, message, photo_digest):
+                return mess
+            await self._chat_action(group, message_thread_id, photo)
+            return await self._edit_status(mess, message, photo, photo_digest)
+
+        await self._chat_action(group, message_thread_id, photo)
+        sent_message = await self._bot.send_photo(
+            chat_id=group,
+            message_thread_id=message_thread_id,
+            photo=photo,
+            caption=message,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_notification=silent,
+        )
+        if group not in self._groups_status_mesages and not manual:
+            self._groups_status_mesages[group] = sent_message
+            self._remember_status(sent_message, message, photo_digest)
+        return sent_message
 
     async def _send_photo(self, group_only, manual, message, silent):
         loop = asyncio.get_running_loop()
         with await loop.run_in_executor(self._executors_pool, self._cam_wrap.take_photo) as photo:
-            if not group_only:
-                await self._bot.send_chat_action(chat_id=self._chat_id, action=ChatAction.UPLOAD_PHOTO)
-                if self._status_message and not manual:
-                    if self._bzz_mess_id != 0:
-                        try:
-                            await self._bot.delete_message(self._chat_id, self._bzz_mess_id)
-                        except BadRequest as badreq:
-                            logger.warning("Failed deleting bzz message \n%s", badreq)
-                            self._bzz_mess_id = 0
-
-                    # Fixme: check if media in message!
-                    await self._status_message.edit_media(media=InputMediaPhoto(photo))
-                    await self._status_message.edit_caption(caption=message, parse_mode=ParseMode.MARKDOWN_V2)
-
-                    if self._progress_update_message:
-                        mes = await self._bot.send_message(self._chat_id, text="Status has been updated\nThis message will be deleted", disable_notification=silent)
-                        self._bzz_mess_id = mes.message_id
+            # the photo is uploaded once, everyone after the first recipient gets the telegram file_id
+            photo_ref: Union[bytes, str] = photo.getvalue()
+            photo_digest = self._digest(photo_ref)
+            groups = self._notify_groups
+            try:
+                if not group_only:
+                    photo_ref = self._photo_file_id(await self._send_chat_photo(photo, photo_digest, message, silent, manual)) or photo_ref
+                elif groups:
 
-                else:
-                    sent_message = await self._bot.send_photo(
-                        self._chat_id,
-                        photo=photo,
-                        caption=message,
-                        parse_mode=ParseMode.MARKDOWN_V2,
-                        disable_notification=silent,
-                    )
-                    if not self._status_message and not manual:
-                        self._status_message = sent_message
-
-            for group, message_thread_id in self._notify_groups:
-                photo.seek(0)
-                await self._bot.send_chat_action(chat_id=group, message_thread_id=message_thread_id, action=ChatAction.UPLOAD_PHOTO)
-                if group in self._groups_status_mesages and not manual:
-                    mess = self._groups_status_mesages[group]
-                    await mess.edit_media(media=InputMediaPhoto(photo))
-                    await mess.edit_caption(caption=message, parse_mode=ParseMode.MARKDOWN_V2)
-                else:
-                    sent_message = await self._bot.send_photo(
-                        chat_id=group,
-                        message_thread_id=message_thread_id,
-                        photo=photo,
-                        caption=message,
-                        parse_mode=ParseMode.MARKDOWN_V2,
-                        disable_notification=silent,
-                    )
-                    if group in self._groups_status_mesages or manual:
-                        continue
-                    self._groups_status_mesages[group] = sent_message
+                    async def send_first(group: int, message_thread_id: Optional[int]) -> None:
+                        nonlocal photo_ref
+                        photo_ref = self._photo_file_id(await self._send_group_photo(group, message_thread_id, photo_ref, photo_digest, message, silent, manual)) or photo_ref
+
+                    await self._fan_out(send_first, groups[:1])
+                    groups = groups[1:]
+            finally:
+                await self._fan_out(lambda group, thread_id: self._send_group_photo(group, thread_id, photo_ref, photo_digest, message, silent, manual), groups)
 
-            photo.close()
+    async def _send_chat_photo(self, photo: BytesIO, photo_digest: bytes, message: str, silent: bool, manual: bool) -> Union[Message, bool]:
+        if self._status_message and not manual:
+            if self._status_unchanged(self._status_message, message, photo_digest):
+                return self._status_message
+            await self._chat_action(self._chat_id, photo=photo)
+            await self._delete_bzz_message()
+
+            # Fixme: check if media in message!
+            edited = await self._edit_status(self._status_message, message, photo, photo_digest)
+
+            if self._progress_update_message:
+                mes = await self._bot.send_message(self._chat_id, text="Status has been updated\nThis message will be deleted", disable_notification=silent)
+                self._bzz_mess_id = mes.message_id
+            return edited
+
+        else:
+            await self._chat_action(self._chat_id, photo=photo)
+            sent_message = await self._bot.send_photo(
+                self._chat_id,
+                photo=photo,
+                caption=message,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                disable_notification=silent,
+            )
+            if not self._status_message and not manual:
+                self._status_message = sent_message
+                self._remember_status(sent_message, message, photo_digest)
+            return sent_message
 
     async def _notify(self, message: str, silent: bool, group_only: bool = False, manual: bool = False, finish: bool = False) -> None:
         try:
             if not self._cam_wrap.enabled:
-                await self._send_message(message, silent, manual)
+                await self._send_message(message, silent, group_only, manual)
             else:
                 await self._send_photo(group_only, manual, message, silent)
         except Exception as ex:
@@ -315,7 +445,70 @@ class Notifier:
             replace_existing=False,
         )
 
-    async def reset_notifications(self) -> None:
+    def _message_state(self, mess: Message) -> Dict[str, Any]:
+        text_digest, photo_digest = self._status_hashes.get((mess.chat_id, mess.message_id), (b"", b""))
+        return {
+            "chat_id": mess.chat_id,
+            "message_id": mess.message_id,
+            "text": mess.text,
+            "caption": mess.caption,
+            "photo": self._photo_file_id(mess),
+            "digests": [text_digest.hex(), photo_digest.hex()],
+        }
+
+    def _restore_message(self, state: Dict[str, Any]) -> Message:
+        chat_id, message_id = state["chat_id"], state["message_id"]
+        message = Message(
+            message_id,
+            datetime.now(),
+            Chat(chat_id, Chat.PRIVATE if chat_id > 0 else Chat.SUPERGROUP),
+            text=state["text"],
+            caption=state["caption"],
+            photo=(PhotoSize(state["photo"], state["photo"], 0, 0),) if state["photo"] else None,
+        )
+        message.set_bot(self._bot)
+        self._status_hashes[(chat_id, message_id)] = (bytes.fromhex(state["digests"][0]), bytes.fromhex(state["digests"][1]))
+        return message
+
+    async def _save_state(self) -> None:
+        """Saves the status messages and notification progress of the current print to the moonraker database."""
+        if not self._status_message and not self._groups_status_mesages:
+            return
+        await self._klippy.save_param_to_db(
+            self._STATE_PARAM,
+            {
+                "filename": self._klippy.printing_filename,
+                "print_start_time": self._klippy.file_print_start_time,
+                "last_percent": self._last_percent,
+                "last_height": self._last_height,
+                "status_message": self._message_state(self._status_message) if self._status_message else None,
+                "groups_status_messages": {str(group): self._message_state(mess) for group, mess in self._groups_status_mesages.items()},
+            },
+        )
+
+    async def restore_state(self) -> None:
+        """Picks up the status messages of a print that was running before the bot or moonraker restarted.
+
+        The saved state is only used for the same print job, matched by file name and print start time,
+        so a new print of the same file never edits the messages of an old one.
+        """
+        state = await self._klippy.get_param_from_db(self._STATE_PARAM)
+        if not state or self._status_message or self._groups_status_mesages:
+            return
+        if state["filename"] != self._klippy.printing_filename or state.get("print_start_time") != self._klippy.file_print_start_time:
+            return
+        self._last_percent = state["last_percent"]
+        self._last_height = state["last_height"]
+        if state["status_message"]:
+            self._status_message = self._restore_message(state["status_message"])
+        notify_groups = {group for group, _ in self._notify_groups}
+        self._groups_status_mesages = {int(group): self._restore_message(mess) for group, mess in state["groups_status_messages"].items() if int(group) in notify_groups}
+        logger.info("Restored status messages of %s", state["filename"])
+
+    async def reset_notifications(self, keep_saved: bool = False) -> None:
+        """Forgets the status messages and notification progress, and the saved copy of them unless `keep_saved` is set."""
+        if not keep_saved:
+            await self._klippy.delete_param_from_db(self._STATE_PARAM)
         self._last_percent = 0
         self._last_height = 0
         self._klippy.printing_duration = 0
@@ -323,6 +516,7 @@ class Notifier:
         self._last_tgnotify_status = ""
         self._status_message = None
         self._groups_status_mesages = {}
+        self._status_hashes = {}
         if self._bzz_mess_id != 0:
             try:
                 await self._bot.delete_message(self._chat_id, self._bzz_mess_id)
@@ -331,8 +525,8 @@ class Notifier:
             finally:
                 self._bzz_mess_id = 0
 
-    def _schedule_notification(self, message: str = "", schedule: bool = False, finish: bool = False) -> None:  # pylint: disable=W0613
-        mess = escape_markdown(self._klippy.get_print_stats(message), version=2)
+    def _schedule_notification(self, message: str = "", schedule: bool = False, finish: bool = False, applied: Optional[asyncio.Future] = None) -> None:  # pylint: disable=W0613
+        mess = self._klippy.get_print_stats(message, markdown=True)
         if self._last_m117_status and "m117_status" in self._message_parts:
             mess += f"{escape_markdown(self._last_m117_status, version=2)}\n"
         if self._last_tgnotify_status and "tgnotify_status" in self._message_parts:
@@ -340,14 +534,7 @@ class Notifier:
         if "last_update_time" in self._message_parts:
             mess += f"_Last update at {datetime.now():%H:%M:%S}_"
 
-        self._sched.add_job(
-            self._notify,
-            kwargs={"message": mess, "silent": self._silent_progress, "group_only": self._group_only, "finish": finish},
-            misfire_grace_time=180,
-            coalesce=False,
-            max_instances=6,
-            replace_existing=False,
-        )
+        self._queue_status_update({"message": mess, "silent": self._silent_progress, "group_only": self._group_only, "finish": finish}, applied)
 
         # if schedule:
         #     self._sched.add_job(
@@ -365,6 +552,55 @@ class Notifier:
         # else:
         #     self._notify(mess, self._silent_progress, self._group_only)
 
+    def _queue_status_update(self, update: Dict[str, Any], applied: Optional[asyncio.Future] = None) -> None:
+        """Makes the update the pending one and starts the status editor unless it is already running.
+
+        Called from the event loop and from scheduler threads. A pending finish is carried over to the newer update,
+        the `applied` future is resolved once the pending update has been sent.
+        """
+        with self._status_lock:
+            if self._pending_status is not None:
+                logger.debug("Dropping superseded status update")
+                update["finish"] = update["finish"] or self._pending_status["finish"]
+            self._pending_status = update
+            if applied is not None:
+                self._status_waiters.append(applied)
+            if self._status_editor_running:
+                return
+            self._status_editor_running = True
+        self._sched.add_job(
+            self._status_editor,
+            misfire_grace_time=None,
+            coalesce=False,
+            max_instances=1,
+            replace_existing=False,
+        )
+
+    async def _status_editor(self) -> None:
+        try:
+            while True:
+                with self._status_lock:
+                    update, self._pending_status = self._pending_status, None
+                    waiters, self._status_waiters = self._status_waiters, []
+                    if update is None:
+                        self._status_editor_running = False
+                        return
+                try:
+                    await self._notify(**update)
+                    if not update["finish"]:
+                        await self._save_state()
+                except Exception as ex:
+                    logger.error("Status update failed: %s", ex)
+                finally:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        except BaseException:
+            # cancelled, the next update starts a new editor
+            with self._status_lock:
+                self._status_editor_running = False
+            raise
+
     def schedule_notification(self, progress: int = 0, position_z: int = 0) -> None:
         if not self._klippy.printing or self._klippy.printing_duration <= 0.0 or (self._height == 0 and self._percent == 0):
             return
@@ -418,7 +654,7 @@ class Notifier:
             )
 
     async def stop_all(self) -> None:
-        await self.reset_notifications()
+        await self.reset_notifications(keep_saved=True)
         self.remove_notifier_timer()
 
     async def _send_print_start_info(self) -> None:
@@ -430,21 +666,28 @@ class Notifier:
                 caption=message,
                 disable_notification=self.silent_status,
             )
-            for group_, message_thread_id in self._notify_groups:
-                bio.seek(0)
-                self._groups_status_mesages[group_] = await self._bot.send_photo(
-                    chat_id=group_,
-                    message_thread_id=message_thread_id,
-                    photo=bio,
-                    caption=message,
-                    disable_notification=self.silent_status,
-                )
+            # the thumbnail is uploaded once, the groups get the telegram file_id
+            photo_ref: Union[bytes, str] = self._photo_file_id(status_message) or bio.getvalue()
             bio.close()
+
+            async def send_group_start(group: int, message_thread_id: Optional[int]) -> None:
+                self._groups_status_mesages[group] = await self._bot.send_photo(
+                    chat_id=group, message_thread_id=message_thread_id, photo=photo_ref, caption=message, disable_notification=self.silent_status
+                )
+
+            await self._fan_out(send_group_start)
         else:
-            status_message = await self._bot.send_message(chat_id=self._chat_id, text=message, disable_notification=self.silent_status)
-            for group_, message_thread_id in self._notify_groups:
-                self._groups_status_mesages[group_] = await self._bot.send_message(chat_id=group_, message_thread_id=message_thread_id, text=message, disable_notification=self.silent_status)
+
+            async def send_group_text_start(group: int, message_thread_id: Optional[int]) -> None:
+                self._groups_status_mesages[group] = await self._bot.send_message(chat_id=group, message_thread_id=message_thread_id, text=message, disable_notification=self.silent_status)
+
+            groups_task = asyncio.create_task(self._fan_out(send_group_text_start))
+            try:
+                status_message = await self._bot.send_message(chat_id=self._chat_id, text=message, disable_notification=self.silent_status)
+            finally:
+                await groups_task
         self._status_message = status_message
+        await self._save_state()
 
         if self._pin_status_single_message:
             await self._bot.unpin_all_chat_messages(self._chat_id)
@@ -474,8 +717,11 @@ class Notifier:
                 replace_existing=True,
             )
 
-    def update_status(self) -> None:
-        self._schedule_notification()
+    async def update_status(self) -> None:
+        """Updates the status message and returns once the update, or a newer one that replaced it, has been sent."""
+        applied = asyncio.get_running_loop().create_future()
+        self._schedule_notification(applied=applied)
+        await applied
 
     @staticmethod
     def _parse_message(ws_message) -> str:
@@ -499,138 +745,75 @@ class Notifier:
             path = [""]
         return path
 
-    async def _send_image(self, paths: List[str], message: str) -> None:
+    def _media_size_error(self, kind: str, path: Path) -> Optional[str]:
+        size = path.stat().st_size
+        if kind == "image":
+            if size > 10485760:
+                return f"Telegram bots have a 10mb filesize restriction for images, image couldn't be uploaded: `{path}`"
+        elif size > self._max_upload_file_size * 1024 * 1024:
+            return f"Telegram bots have a {self._max_upload_file_size}mb filesize restriction, {kind} couldn't be uploaded: `{path}`"
+        return None
+
+    async def _send_media_files(self, kind: str, paths: List[Path], caption: Optional[str]) -> None:
+        """Sends up to ten files as one media group, or a single file on its own, streaming them from disk."""
+        with contextlib.ExitStack() as stack:
+            files = [InputFile(stack.enter_context(open(path, "rb")), filename=path.name, attach=len(paths) > 1, read_file_handle=False) for path in paths]
+            if len(files) == 1:
+                send_single: Dict[str, Callable[..., Awaitable[Message]]] = {"image": self._bot.send_photo, "video": self._bot.send_video, "document": self._bot.send_document}
+                await send_single[kind](self._chat_id, files[0], caption=caption, disable_notification=self._silent_commands, write_timeout=120)
+                return
+
+            media_type = {"image": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}[kind]
+            media: List[Union[InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo]] = [media_type(file, caption=caption if num == 0 else None) for num, file in enumerate(files)]
+            await self._bot.send_media_group(self._chat_id, media=media, disable_notification=self._silent_commands, write_timeout=120)
+
+    async def _send_media(self, kind: str, paths: List[str], message: str) -> None:
+        """Sends image, video or document files from disk, in media groups of up to ten files.
+
+        Sizes are checked before any file is opened, oversized files are reported and skipped. The first file carries
+        the message as its caption. The groups are sent concurrently and the send scheduler paces them.
+        """
         try:
-            photos_list: List[Union[InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo]] = []
+            files: List[Path] = []
             for path in paths:
                 path_obj = Path(path)
                 if not path_obj.is_file():
                     await self._bot.send_message(self._chat_id, text="Provided path is not a file", disable_notification=self._silent_commands)
                     return
-
-                bio = BytesIO()
-                bio.name = path_obj.name
-
-                with open(path_obj, "rb") as fh:
-                    bio.write(fh.read())
-                bio.seek(0)
-                if bio.getbuffer().nbytes > 10485760:
-                    await self._bot.send_message(self._chat_id, text=f"Telegram bots have a 10mb filesize restriction for images, image couldn't be uploaded: `{path}`")
+                size_error = self._media_size_error(kind, path_obj)
+                if size_error:
+                    await self._bot.send_message(self._chat_id, text=size_error)
                 else:
-                    if not photos_list:
-                        photos_list.append(InputMediaPhoto(bio, filename=bio.name, caption=message))
-                    else:
-                        photos_list.append(InputMediaPhoto(bio, filename=bio.name))
-                bio.close()
+                    files.append(path_obj)
 
-            await self._bot.send_media_group(
-                self._chat_id,
-                media=photos_list,
-                disable_notification=self._silent_commands,
-            )
+            chunks = [files[start : start + self._MEDIA_GROUP_SIZE] for start in range(0, len(files), self._MEDIA_GROUP_SIZE)]
+            results = await asyncio.gather(*[self._send_media_files(kind, chunk, message if num == 0 else None) for num, chunk in enumerate(chunks)], return_exceptions=True)
+            errors = [res for res in results if isinstance(res, Exception)]
+            if errors:
+                raise errors[0]
 
         except Exception as ex:
             logger.warning(ex)
-            await self._bot.send_message(self._chat_id, text=f"Error sending image: {ex}", disable_notification=self._silent_commands)
+            await self._bot.send_message(self._chat_id, text=f"Error sending {kind}: {ex}", disable_notification=self._silent_commands)
 
-    def send_image(self, ws_message: str) -> None:
+    def _schedule_media(self, kind: str, ws_message: str) -> None:
         self._sched.add_job(
-            self._send_image,
-            kwargs={"paths": self._parse_path(ws_message), "message": self._parse_message(ws_message)},
+            self._send_media,
+            kwargs={"kind": kind, "paths": self._parse_path(ws_message), "message": self._parse_message(ws_message)},
             misfire_grace_time=None,
             coalesce=False,
             max_instances=6,
             replace_existing=False,
         )
 
-    async def _send_video(self, paths: List[str], message: str) -> None:
-        try:
-            photos_list: List[Union[InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo]] = []
-            for path in paths:
-                path_obj = Path(path)
-                if not path_obj.is_file():
-                    await self._bot.send_message(self._chat_id, text="Provided path is not a file", disable_notification=self._silent_commands)
-                    return
-
-                bio = BytesIO()
-                bio.name = path_obj.name
-
-                with open(path_obj, "rb") as fh:
-                    bio.write(fh.read())
-                bio.seek(0)
-                if bio.getbuffer().nbytes > self._max_upload_file_size * 1024 * 1024:
-                    await self._bot.send_message(self._chat_id, text=f"Telegram bots have a {self._max_upload_file_size}mb filesize restriction, video couldn't be uploaded: `{path}`")
-                else:
-                    if not photos_list:
-                        photos_list.append(InputMediaVideo(bio, filename=bio.name, caption=message))
-                    else:
-                        photos_list.append(InputMediaVideo(bio, filename=bio.name))
-                bio.close()
-
-            await self._bot.send_media_group(
-                self._chat_id,
-                media=photos_list,
-                disable_notification=self._silent_commands,
-                write_timeout=120,
-            )
-
-        except Exception as ex:
-            logger.warning(ex)
-            await self._bot.send_message(self._chat_id, text=f"Error sending video: {ex}", disable_notification=self._silent_commands)
+    def send_image(self, ws_message: str) -> None:
+        self._schedule_media("image", ws_message)
 
     def send_video(self, ws_message: str) -> None:
-        self._sched.add_job(
-            self._send_video,
-            kwargs={"paths": self._parse_path(ws_message), "message": self._parse_message(ws_message)},
-            misfire_grace_time=None,
-            coalesce=False,
-            max_instances=6,
-            replace_existing=False,
-        )
-
-    async def _send_document(self, paths: List[str], message: str) -> None:
-        try:
-            photos_list: List[Union[InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo]] = []
-            for path in paths:
-                path_obj = Path(path)
-                if not path_obj.is_file():
-                    await self._bot.send_message(self._chat_id, text="Provided path is not a file", disable_notification=self._silent_commands)
-                    return
-
-                bio = BytesIO()
-                bio.name = path_obj.name
-
-                with open(path_obj, "rb") as fh:
-                    bio.write(fh.read())
-                bio.seek(0)
-                if bio.getbuffer().nbytes > self._max_upload_file_size * 1024 * 1024:
-                    await self._bot.send_message(self._chat_id, text=f"Telegram bots have a {self._max_upload_file_size}mb filesize restriction, document couldn't be uploaded: `{path}`")
-                else:
-                    if not photos_list:
-                        photos_list.append(InputMediaDocument(bio, filename=bio.name, caption=message))
-                    else:
-                        photos_list.append(InputMediaDocument(bio, filename=bio.name))
-                bio.close()
-
-            await self._bot.send_media_group(
-                self._chat_id,
-                media=photos_list,
-                disable_notification=self._silent_commands,
-            )
-
-        except Exception as ex:
-            logger.warning(ex)
-            await self._bot.send_message(self._chat_id, text=f"Error sending document: {ex}", disable_notification=self._silent_commands)
+        self._schedule_media("video", ws_message)
 
     def send_document(self, ws_message: str) -> None:
-        self._sched.add_job(
-            self._send_document,
-            kwargs={"paths": self._parse_path(ws_message), "message": self._parse_message(ws_message)},
-            misfire_grace_time=None,
-            coalesce=False,
-            max_instances=6,
-            replace_existing=False,
-        )
+        self._schedule_media("document", ws_message)
 
     async def parse_notification_params(self, message: str) -> None:
         mass_parts = message.split(sep=" ")
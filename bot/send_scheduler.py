@@ -0,0 +1,167 @@
+import asyncio
+from collections import Counter
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+_Result = Union[bool, Dict[str, Any], List[Dict[str, Any]]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self._rate: float = rate
+        self._capacity: float = capacity
+        self._tokens: float = capacity
+        self._updated: float = time.monotonic()
+        self._blocked_until: float = 0.0
+
+    def block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        return max(self._blocked_until - now, 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self._rate)
+
+    async def acquire(self) -> None:
+        while (delay := self.delay()) > 0.0:
+            await asyncio.sleep(delay)
+        self._tokens -= 1.0
+
+
+class _ChatQueue:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket: TokenBucket = bucket
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.depth: int = 0
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Outbound rate limiter for every bot api call, plugged in with `ApplicationBuilder.rate_limiter`.
+
+    Requests to a chat are sent one at a time in order, each after taking a token from the chat bucket and the global one.
+    On `RetryAfter` the chat is paused for the requested time and the request retried, `rate_limit_args` overrides
+    the number of retries. An edit of a message that is still waiting when a newer edit of the same kind for the
+    same message arrives is dropped and answered with True, like an edit of an inline message.
+    Chat actions only take a global token and never wait for the chat queue. Telegram shows an action for five seconds,
+    so an action to a chat that already got the same action within `chat_action_interval` is dropped and answered with True.
+    Rates are requests per second, the defaults are the limits Telegram documents for bots.
+    """
+
+    _EDIT_ENDPOINTS = frozenset(["editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"])
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        private_burst: float = 3.0,
+        group_rate: float = 20.0 / 60.0,
+        group_burst: float = 3.0,
+        chat_action_interval: float = 5.0,
+    ):
+        self._max_retries: int = max_retries
+        self._private_rate: float = private_rate
+        self._private_burst: float = private_burst
+        self._group_rate: float = group_rate
+        self._group_burst: float = group_burst
+        self._chat_action_interval: float = chat_action_interval
+        self._global: TokenBucket = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[str, _ChatQueue] = {}
+        self._latest_edits: Dict[Tuple[str, Any, str], object] = {}
+        self._last_chat_actions: Dict[Tuple[str, Any, Any], float] = {}
+        self._counters: Counter = Counter()
+        self._max_depth: int = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat(self, chat_id: str) -> _ChatQueue:
+        if chat_id not in self._chats:
+            group = chat_id.startswith(("-", "@"))
+            self._chats[chat_id] = _ChatQueue(TokenBucket(self._group_rate, self._group_burst) if group else TokenBucket(self._private_rate, self._private_burst))
+        return self._chats[chat_id]
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        """Current and peak number of queued requests, with counters of requested, sent, dropped and flood limited requests."""
+        return {"queued": sum(chat.depth for chat in self._chats.values()), "max_queued": self._max_depth, **self._counters}
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {chat_id: chat.depth for chat_id, chat in self._chats.items() if chat.depth}
+
+    async def _call_with_retries(
+        self, callback: Callable[..., Coroutine[Any, Any, _Result]], args: Any, kwargs: Dict[str, Any], max_retries: int, chat: Optional[_ChatQueue], superseded: Callable[[], bool]
+    ) -> _Result:
+        attempt = 0
+        while True:
+            if superseded():
+                self._counters["dropped_edits"] += 1
+                return True
+            if chat:
+                await chat.bucket.acquire()
+            await self._global.acquire()
+            # a newer edit could have been queued while waiting for the tokens
+            if superseded():
+                self._counters["dropped_edits"] += 1
+                return True
+            try:
+                res = await callback(*args, **kwargs)
+                self._counters["sent"] += 1
+                return res
+            except RetryAfter as err:
+                self._counters["retry_after"] += 1
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                logger.warning("Flood control hit, retrying in %s seconds, queued requests: %s", err.retry_after, self.queue_depths())
+                (chat.bucket if chat else self._global).block(err.retry_after)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, _Result]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> _Result:
+        max_retries = rate_limit_args if rate_limit_args is not None else self._max_retries
+        self._counters["requested"] += 1
+        if endpoint == "sendChatAction":
+            # a different action replaces the shown one, like upload_photo after typing
+            action_key = (str(data.get("chat_id")), data.get("message_thread_id"), data.get("action"))
+            now = time.monotonic()
+            if now - self._last_chat_actions.get(action_key, float("-inf")) < self._chat_action_interval:
+                self._counters["dropped_chat_actions"] += 1
+                return True
+            self._last_chat_actions[action_key] = now
+        if data.get("chat_id") is None or endpoint == "sendChatAction":
+            return await self._call_with_retries(callback, args, kwargs, max_retries, None, lambda: False)
+
+        chat_id = str(data["chat_id"])
+        edit_key: Optional[Tuple[str, Any, str]] = None
+        marker = object()
+        if endpoint in self._EDIT_ENDPOINTS and "message_id" in data:
+            edit_key = (chat_id, data["message_id"], endpoint)
+            self._latest_edits[edit_key] = marker
+
+        chat = self._chat(chat_id)
+        chat.depth += 1
+        self._max_depth = max(self._max_depth, sum(chat_queue.depth for chat_queue in self._chats.values()))
+        try:
+            async with chat.lock:
+                return await self._call_with_retries(callback, args, kwargs, max_retries, chat, lambda: edit_key is not None and self._latest_edits.get(edit_key) is not marker)
+        finally:
+            chat.depth -= 1
+            if edit_key is not None and self._latest_edits.get(edit_key) is marker:
+                del self._latest_edits[edit_key]
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+import re
+from string import Formatter
+from typing import Any, Dict, FrozenSet, Iterable, Tuple
+
+import emoji
+
+
+def _emojize(text: str) -> str:
+    return emoji.emojize(text, language="alias")
+
+
+# same result as telegram.helpers.escape_markdown for MarkdownV2, without building a regex for every value
+_MARKDOWN_ESCAPES = str.maketrans({char: f"\\{char}" for char in r"\_*[]()~`>#+-=|{}.!"})
+
+_FILE_INFO_FORMATS: Dict[str, str] = {
+    "header": "{pre}: {filename} \n",
+    "progress": "Progress {progress}%",
+    "height": ", height: {height}mm\n",
+    "filament_length": "Filament: {used}m / {total}m",
+    "filament_weight": ", weight: {used}/{total}g",
+    "print_duration": "Printing for {duration}\n",
+    "eta": "Estimated time left: {eta}\n",
+    "finish_time": "Finish at {finish}\n",
+}
+
+_SENSOR_EMOJI: Dict[str, str] = {
+    "power": _emojize(":hotsprings: "),
+    "speed": _emojize(":tornado: "),
+    "temperature": _emojize(":thermometer: "),
+    "": "",
+}
+
+_SENSOR_FORMATS: Dict[str, str] = {
+    "name": "{emoji}{name}:",
+    "temperature": " {temperature} \N{DEGREE SIGN}C",
+    "target": _emojize(" :arrow_right: ") + "{target} \N{DEGREE SIGN}C",
+    "power": _emojize(" :fire:"),
+    "speed": " {speed}%",
+    "rpm": " {rpm} RPM",
+}
+
+_DEVICE_FORMATS: Dict[str, str] = {
+    "name": " {emoji} {name}: ",
+    "status": " {status} ",
+    "locked": _emojize(" :lock: "),
+}
+
+
+def _sensor_display_name(name: str) -> str:
+    return re.sub(r"([A-Z]|\d|_)", r" \1", name).replace("_", "").title()
+
+
+class StatusTemplate:
+    """Status message layout compiled once from the enabled `status_message_content` parts.
+
+    Emoji and static text are rendered, and escaped for MarkdownV2 when `markdown` is set, while the template is built.
+    Sensor and device name lines are rendered on first use. Rendering only formats and escapes the dynamic values.
+    """
+
+    def __init__(self, message_parts: Iterable[str], markdown: bool = False):
+        self._parts: FrozenSet[str] = frozenset(message_parts)
+        self._markdown: bool = markdown
+        self._file_info: Dict[str, str] = {part: self._compile(fmt) for part, fmt in _FILE_INFO_FORMATS.items() if part == "header" or part in self._parts}
+        self._sensor: Dict[str, str] = {part: self._compile(fmt) for part, fmt in _SENSOR_FORMATS.items()}
+        self._device: Dict[str, str] = {part: self._compile(fmt) for part, fmt in _DEVICE_FORMATS.items()}
+        self._sensor_names: Dict[Tuple[str, str], str] = {}
+        self._device_names: Dict[Tuple[str, str], str] = {}
+
+    def _escape(self, text: str) -> str:
+        return text.translate(_MARKDOWN_ESCAPES) if self._markdown else text
+
+    def _compile(self, fmt: str) -> str:
+        compiled = ""
+        for literal, field, _, _ in Formatter().parse(fmt):
+            compiled += self._escape(literal).replace("{", "{{").replace("}", "}}")
+            if field is not None:
+                compiled += f"{{{field}}}"
+        return compiled
+
+    def _format(self, compiled: str, **values: Any) -> str:
+        return compiled.format(**{key: self._escape(str(value)) for key, value in values.items()})
+
+    def file_info(
+        self,
+        pre: str,
+        filename: str,
+        progress: float,
+        height: float,
+        filament: Tuple[float, float],
+        weight: Tuple[float, float],
+        duration: float,
+        eta: timedelta,
+    ) -> str:
+        """Printing file lines, filament and weight are pairs of used and total amounts, in mm and grams."""
+        parts = self._file_info
+        message = self._format(parts["header"], pre=pre or "Printing", filename=filename)
+        if "progress" in parts:
+            message += self._format(parts["progress"], progress=round(progress * 100, 0))
+        if "height" in parts:
+            message += self._format(parts["height"], height=round(height, 2)) if height > 0.0 else "\n"
+        if filament[1] > 0.0:
+            if "filament_length" in parts:
+                message += self._format(parts["filament_length"], used=round(filament[0] / 1000, 2), total=round(filament[1] / 1000, 2))
+            if weight[1] > 0.0 and "filament_weight" in parts:
+                message += self._format(parts["filament_weight"], used=round(weight[0], 2), total=weight[1])
+            message += "\n"
+        if "print_duration" in parts:
+            message += self._format(parts["print_duration"], duration=timedelta(seconds=round(duration)))
+        if "eta" in parts:
+            message += self._format(parts["eta"], eta=eta)
+        if "finish_time" in parts:
+            message += self._format(parts["finish_time"], finish=f"{datetime.now() + eta:%Y-%m-%d %H:%M}")
+        return message
+
+    def sensor(self, name: str, value: Dict[str, Any]) -> str:
+        kind = next((key for key in ("power", "speed", "temperature") if key in value), "")
+        if (name, kind) not in self._sensor_names:
+            self._sensor_names[(name, kind)] = self._format(self._sensor["name"], emoji=_SENSOR_EMOJI[kind], name=_sensor_display_name(name))
+        message = self._sensor_names[(name, kind)]
+
+        if "temperature" in value:
+            message += self._format(self._sensor["temperature"], temperature=round(value["temperature"]))
+        if "target" in value and value["target"] > 0.0 and abs(value["target"] - value["temperature"]) > 2:
+            message += self._format(self._sensor["target"], target=round(value["target"]))
+        if "power" in value and value["power"] > 0.0:
+            message += self._sensor["power"]
+        if "speed" in value:
+            message += self._format(self._sensor["speed"], speed=round(value["speed"] * 100))
+        if "rpm" in value and value["rpm"] is not None:
+            message += self._format(self._sensor["rpm"], rpm=round(value["rpm"]))
+        return message
+
+    def device(self, name: str, value: Dict[str, Any], emoji_symbol: str = ":vertical_traffic_light:") -> str:
+        if (name, emoji_symbol) not in self._device_names:
+            self._device_names[(name, emoji_symbol)] = self._format(self._device["name"], emoji=_emojize(emoji_symbol), name=name)
+        message = self._device_names[(name, emoji_symbol)]
+        if "status" in value:
+            message += self._format(self._device["status"], status=value["status"])
+        if "locked_while_printing" in value and value["locked_while_printing"] == "True":
+            message += self._device["locked"]
+        return message + "\n"
@@ -0,0 +1,121 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    """Encoded gcode previews keyed by moonraker host, thumbnail path and gcode file mtime.
+
+    Recently used previews are kept in memory, everything else in `cache_dir`. Both are bounded by size
+    and evict the least recently used entries first. The disk index is read once on start and then kept in memory,
+    file reads and writes run on the default executor.
+    """
+
+    def __init__(self, cache_dir: str, host: str = "", memory_limit: int = 8 * 1024 * 1024, disk_limit: int = 64 * 1024 * 1024):
+        self._dir: Path = Path(cache_dir)
+        self._host: str = host
+        self._memory_limit: int = memory_limit
+        self._disk_limit: int = disk_limit
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size: int = 0
+        # file sizes of the disk entries, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+        except OSError as err:
+            logger.error("Thumbnail disk cache disabled: %s", err)
+            self._disk_limit = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def _key(self, thumb_path: str, modified: float) -> str:
+        return hashlib.sha1(f"{self._host}:{thumb_path}:{modified}".encode()).hexdigest()
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        for entry in self._dir.iterdir():
+            if entry.is_file() and entry.suffix != ".tmp":
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self._memory_limit and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _read_file(self, key: str) -> bytes:
+        cached_file = self._dir / key
+        data = cached_file.read_bytes()
+        # mtime marks the last use for the disk index on the next start
+        os.utime(cached_file)
+        return data
+
+    def _write_file(self, key: str, data: bytes, evicted: List[str]) -> None:
+        tmp_file = self._dir / f"{key}.tmp"
+        tmp_file.write_bytes(data)
+        tmp_file.replace(self._dir / key)
+        for evicted_key in evicted:
+            (self._dir / evicted_key).unlink(missing_ok=True)
+
+    async def get(self, thumb_path: str, modified: float) -> Optional[bytes]:
+        key = self._key(thumb_path, modified)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._hits += 1
+            return self._memory[key]
+
+        if key in self._disk:
+            self._disk.move_to_end(key)
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(None, self._read_file, key)
+                self._remember(key, data)
+                self._hits += 1
+                return data
+            except OSError:
+                self._disk_size -= self._disk.pop(key, 0)
+
+        self._misses += 1
+        return None
+
+    async def put(self, thumb_path: str, modified: float, data: bytes) -> None:
+        key = self._key(thumb_path, modified)
+        self._remember(key, data)
+        if self._disk_limit <= 0:
+            return
+
+        self._disk_size += len(data) - self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        evicted = []
+        while self._disk_size > self._disk_limit and len(self._disk) > 1:
+            evicted_key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(evicted_key)
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_file, key, data, evicted)
+        except OSError as err:
+            self._disk_size -= self._disk.pop(key, 0)
+            logger.error("Failed to store thumbnail %s in cache: %s", thumb_path, err)
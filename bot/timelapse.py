@@ -2,6 +2,7 @@ import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import gc
 import logging
+from typing import Dict, List
 
 from apscheduler.schedulers.base import BaseScheduler  # type: ignore
 from telegram import Bot, Message
@@ -114,6 +115,9 @@ class Timelapse:
         if new_value >= 0:
             self._height = new_value
 
+    def subscription_fields(self) -> Dict[str, List[str]]:
+        return {"gcode_move": ["gcode_position"]} if self._enabled and self._height > 0.0 else {}
+
     @property
     def target_fps(self) -> int:
         return self._target_fps
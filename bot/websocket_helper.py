@@ -1,9 +1,12 @@
+import asyncio
 from functools import wraps
 import logging
 import os
 import random
+import re
 import ssl
 import time
+from typing import Dict, Iterator, List, Optional, Tuple
 
 os.environ.setdefault("WEBSOCKETS_MAX_LOG_SIZE", "1048576")  # pylint: disable=C0413
 os.environ.setdefault("WEBSOCKETS_BACKOFF_MAX_DELAY", "15.0")  # pylint: disable=C0413
@@ -17,6 +20,7 @@ from configuration import ConfigWrapper
 from klippy import Klippy
 from notifications import Notifier
 from timelapse import Timelapse
+from websocket_recorder import FrameRecorder, LatencyStats, ReplayConnection, read_frames, read_log_frames
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +38,12 @@ def websocket_alive(func):
 
 
 class WebSocketHelper:
+    # moonraker writes notifications as {"jsonrpc": "2.0", "method": ..., "params": ...}, so the method can be read before decoding the frame
+    _NOTIFICATION_HEAD = re.compile(rb'^\{\s*"jsonrpc":\s*"2\.0",\s*"method":\s*"(\w+)"')
+    _HANDLED_NOTIFICATIONS = frozenset(
+        [b"notify_status_update", b"notify_gcode_response", b"notify_power_changed", b"notify_klippy_shutdown", b"notify_klippy_disconnected", b"notify_filelist_changed"]
+    )
+
     def __init__(
         self,
         config: ConfigWrapper,
@@ -56,6 +66,9 @@ class WebSocketHelper:
         self._timelapse: Timelapse = timelapse
         self._scheduler: BaseScheduler = scheduler
         self._log_parser: bool = config.bot_config.log_parser
+        self._recorder: Optional[FrameRecorder] = FrameRecorder(config.bot_config.websocket_record_file) if config.bot_config.websocket_record_file else None
+        self._latency_stats: Optional[LatencyStats] = None
+        self._subscribed_fields: Dict[str, List[str]] = {}
 
         self._ws: ClientConnection
 
@@ -73,19 +86,24 @@ class WebSocketHelper:
     def _my_id(self) -> int:
         return random.randint(0, 300000)
 
+    def _consumed_fields(self) -> Dict[str, List[str]]:
+        # only the fields status message, notifications and timelapse actually read, moonraker pushes diffs of those alone
+        consumed: Dict[str, List[str]] = {}
+        for fields in [self._klippy.subscription_fields(), self._notifier.subscription_fields(), self._timelapse.subscription_fields()]:
+            for obj, obj_fields in fields.items():
+                merged = consumed.setdefault(obj, [])
+                merged.extend(field for field in obj_fields if field not in merged)
+        return consumed
+
     async def subscribe(self):
-        subscribe_objects = {
-            "print_stats": None,
-            "display_status": None,
-            "toolhead": ["position"],
-            "gcode_move": ["position", "gcode_position"],
-            "virtual_sdcard": ["progress"],
-        }
+        self._subscribed_fields = self._consumed_fields()
+        subscribe_objects: Dict[str, Optional[List[str]]] = dict(self._subscribed_fields)
 
         sensors = self._klippy.prepare_sens_dict_subscribe()
         if sensors:
             subscribe_objects.update(sensors)
 
+        logger.debug("Subscribing to %s", subscribe_objects)
         await self._ws.send(
             orjson.dumps(
                 {
@@ -97,6 +115,11 @@ class WebSocketHelper:
             )
         )
 
+    async def _resubscribe_if_changed(self):
+        # set_timelapse_params / set_notify_params may enable height or percent notifications at runtime
+        if self._klippy.connected and self._consumed_fields() != self._subscribed_fields:
+            await self.subscribe()
+
     async def on_open(self):
         await self._ws.send(orjson.dumps({"jsonrpc": "2.0", "method": "printer.info", "id": self._my_id}))
         await self._ws.send(orjson.dumps({"jsonrpc": "2.0", "method": "machine.device_power.devices", "id": self._my_id}))
@@ -118,6 +141,7 @@ class WebSocketHelper:
                 await self._klippy.set_printing_filename(print_stats["filename"])
                 self._klippy.printing_duration = print_stats["print_duration"]
                 self._klippy.filament_used = print_stats["filament_used"]
+                await self._notifier.restore_state()
                 # Todo: maybe get print start time and set start interval for job?
                 self._notifier.add_notifier_timer()
                 if not self._timelapse.manual_mode:
@@ -134,8 +158,10 @@ class WebSocketHelper:
                 if not self._timelapse.manual_mode:
                     self._timelapse.paused = True
         if "display_status" in status_resp:
-            self._notifier.m117_status = status_resp["display_status"]["message"]
-            self._klippy.printing_progress = status_resp["display_status"]["progress"]
+            if "message" in status_resp["display_status"]:
+                self._notifier.m117_status = status_resp["display_status"]["message"]
+            if "progress" in status_resp["display_status"]:
+                self._klippy.printing_progress = status_resp["display_status"]["progress"]
         if "virtual_sdcard" in status_resp:
             self._klippy.vsd_progress = status_resp["virtual_sdcard"]["progress"]
 
@@ -176,8 +202,10 @@ class WebSocketHelper:
 
         if message_params_loc.startswith("set_timelapse_params "):
             await self._timelapse.parse_timelapse_params(message_params_loc)
+            await self._resubscribe_if_changed()
         if message_params_loc.startswith("set_notify_params "):
             await self._notifier.parse_notification_params(message_params_loc)
+            await self._resubscribe_if_changed()
         if message_params_loc.startswith("tgcustom_keyboard "):
             await self._notifier.send_custom_inline_keyboard(message_params_loc)
 
@@ -197,9 +225,6 @@ class WebSocketHelper:
                 self._klippy.printing_progress = message_params_loc["display_status"]["progress"]
                 self._notifier.schedule_notification(progress=int(message_params_loc["display_status"]["progress"] * 100))
 
-        if "toolhead" in message_params_loc and "position" in message_params_loc["toolhead"]:
-            # position_z = json_message["params"][0]['toolhead']['position'][2]
-            pass
         if "gcode_move" in message_params_loc and "gcode_position" in message_params_loc["gcode_move"]:
             position_z = message_params_loc["gcode_move"]["gcode_position"][2]
             self._klippy.printing_height = position_z
@@ -310,9 +335,27 @@ class WebSocketHelper:
             self._klippy.light_device.device_state = device_state
 
     async def websocket_to_message(self, ws_message):
-        logger.debug(ws_message)
+        if self._latency_stats is None:
+            await self._decode_message(ws_message)
+            return
+
+        start = time.perf_counter()
+        method = await self._decode_message(ws_message)
+        self._latency_stats.add(method, time.perf_counter() - start)
+
+    async def _decode_message(self, ws_message) -> str:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(ws_message)
+
+        notification = self._NOTIFICATION_HEAD.match(ws_message)
+        if notification and notification.group(1) not in self._HANDLED_NOTIFICATIONS:
+            return notification.group(1).decode()
+
         json_message = orjson.loads(ws_message)
+        await self._process_message(json_message)
+        return json_message.get("method", "response")
 
+    async def _process_message(self, json_message):
         if "error" in json_message:
             logger.warning("Error received from websocket: %s", json_message["error"])
             return
@@ -381,6 +424,9 @@ class WebSocketHelper:
             if message_method == "notify_status_update":
                 await self.notify_status_update(message_params)
 
+            if message_method == "notify_filelist_changed":
+                self._klippy.update_gcode_files(message_params)
+
     async def manage_printing(self, command: str) -> None:
         await self._ws.send(orjson.dumps({"jsonrpc": "2.0", "method": f"printer.print.{command}", "id": self._my_id}))
 
@@ -402,17 +448,27 @@ class WebSocketHelper:
     async def execute_ws_gcode_script(self, gcode: str) -> None:
         await self._ws.send(orjson.dumps({"jsonrpc": "2.0", "method": "printer.gcode.script", "params": {"script": gcode}, "id": self._my_id}))
 
-    def parselog(self):
-        with open("../telegram.log", encoding="utf-8") as file:
-            lines = file.readlines()
-
-        wslines = list(filter(lambda it: " - b'{" in it, lines))
-        messages = list(map(lambda el: el.split(" - b'")[-1].replace("'\n", ""), wslines))
+    async def replay(self, path: str, speed: float = 1.0) -> LatencyStats:
+        """Feed recorded frames through the message handlers, speed 0 replays them without delays."""
+        frames: Iterator[Tuple[float, bytes]] = read_frames(path) if not path.endswith(".log") else read_log_frames(path)
+        self._ws = ReplayConnection()  # type: ignore
+        self._latency_stats = LatencyStats()
+        last_timestamp = 0.0
+        for timestamp, frame in frames:
+            if speed > 0 and last_timestamp:
+                await asyncio.sleep(max(timestamp - last_timestamp, 0.0) / speed)
+            last_timestamp = timestamp
+            try:
+                await self.websocket_to_message(frame)
+            except Exception as ex:
+                logger.error("Replayed frame failed: %s\n%s", ex, frame)
+        self._latency_stats.finish()
+        stats, self._latency_stats = self._latency_stats, None
+        return stats
 
-        for mes in messages:
-            self.websocket_to_message(mes)
-            time.sleep(0.01)
-        print("lalal")
+    def stop_recording(self) -> None:
+        if self._recorder:
+            self._recorder.close()
 
     async def run_forever_async(self):
         # Todo: use headers instead of inline token
@@ -435,11 +491,15 @@ class WebSocketHelper:
 
                 while True:
                     res = await self._ws.recv(decode=False)
+                    if self._recorder:
+                        self._recorder.write(res)
                     await self.websocket_to_message(res)
 
             except Exception as ex:
                 # Todo: add some TG notification?
                 logger.error(ex)
+                if self._recorder:
+                    self._recorder.flush()
                 await self._klippy.set_connected(False)
                 if self._scheduler.get_job("ws_reschedule"):
                     self._scheduler.remove_job("ws_reschedule")
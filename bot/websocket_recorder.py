@@ -0,0 +1,125 @@
+import ast
+from collections import defaultdict
+from datetime import datetime
+import logging
+import math
+import struct
+import time
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from websockets.protocol import State
+
+logger = logging.getLogger(__name__)
+
+# record layout: float64 unix timestamp, uint32 payload length, raw frame bytes
+_FRAME_HEADER = struct.Struct("<dI")
+_FILE_MAGIC = b"MTBWS1\n"
+
+
+class FrameRecorder:
+    def __init__(self, path: str):
+        self._path: str = path
+        self._file: BinaryIO = open(path, "ab")  # pylint: disable=consider-using-with
+        if self._file.tell() == 0:
+            self._file.write(_FILE_MAGIC)
+        self._frames: int = 0
+
+    @property
+    def frames(self) -> int:
+        return self._frames
+
+    def write(self, frame: bytes) -> None:
+        self._file.write(_FRAME_HEADER.pack(time.time(), len(frame)))
+        self._file.write(frame)
+        self._frames += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+            logger.info("Recorded %s websocket frames to %s", self._frames, self._path)
+
+
+def read_frames(path: str) -> Iterator[Tuple[float, bytes]]:
+    with open(path, "rb") as fh:
+        if fh.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+            raise ValueError(f"{path} is not a websocket recording")
+        while True:
+            header = fh.read(_FRAME_HEADER.size)
+            if len(header) < _FRAME_HEADER.size:
+                return
+            timestamp, length = _FRAME_HEADER.unpack(header)
+            frame = fh.read(length)
+            if len(frame) < length:
+                logger.warning("Truncated frame at the end of %s", path)
+                return
+            yield timestamp, frame
+
+
+def read_log_frames(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Extract frames logged by websocket_helper in debug mode from a telegram.log file."""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if " - b'{" not in line:
+                continue
+            try:
+                timestamp = datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f").timestamp()
+                frame = ast.literal_eval(line.rstrip("\n").split(" - ", 4)[-1])
+            except (ValueError, SyntaxError) as err:
+                logger.debug("Skipping log line: %s", err)
+                continue
+            if isinstance(frame, bytes):
+                yield timestamp, frame
+
+
+class ReplayConnection:
+    """Stand-in for the websocket connection while frames are replayed, keeps everything the bot sends."""
+
+    def __init__(self):
+        self.state: State = State.OPEN
+        self.sent: List[bytes] = []
+
+    async def send(self, message) -> None:
+        self.sent.append(message)
+
+
+class LatencyStats:
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._started: float = time.perf_counter()
+        self._finished: float = 0.0
+
+    def add(self, handler: str, duration: float) -> None:
+        self._samples[handler].append(duration)
+
+    def finish(self) -> None:
+        self._finished = time.perf_counter()
+
+    @property
+    def messages(self) -> int:
+        return sum(len(samples) for samples in self._samples.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished if self._finished else time.perf_counter()) - self._started
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentile(self, handler: str, pct: float) -> float:
+        samples = sorted(self._samples.get(handler, []))
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))]
+
+    def report(self) -> str:
+        lines = [f"{self.messages} messages in {self.elapsed:.3f}s, {self.messages_per_second:.1f} msg/s", f"{'handler':<32}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for handler, samples in sorted(self._samples.items(), key=lambda el: -len(el[1])):
+            lines.append(
+                f"{handler:<32}{len(samples):>8}"
+                f"{self.percentile(handler, 50) * 1000:>10.3f}{self.percentile(handler, 90) * 1000:>10.3f}{self.percentile(handler, 99) * 1000:>10.3f}{max(samples) * 1000:>10.3f}"
+            )
+        return "\n".join(lines)
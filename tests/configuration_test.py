@@ -46,3 +46,7 @@ def test_config_has_no_errors(config_helper):
 
 def test_config_bot_is_valid(config_helper):
     assert config_helper.secrets.chat_id == 16612341234 and config_helper.secrets.token == "23423423334:sdfgsdfg-dfgdfgsdfg"
+
+
+def test_cache_path_is_not_the_log_path(config_helper):
+    assert config_helper.bot_config.cache_path != config_helper.bot_config.log_path and not config_helper.unknown_fields
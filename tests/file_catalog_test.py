@@ -0,0 +1,48 @@
+from bot.file_catalog import FileCatalog  # type: ignore
+
+
+def test_incremental_updates_keep_order_and_hashes():
+    catalog = FileCatalog()
+    catalog.load([{"path": "a.gcode", "modified": 1.0}, {"path": "sub/b.gcode", "modified": 3.0}, {"path": "c.gcode", "modified": 2.0}])
+    catalog.apply_change({"action": "create_file", "item": {"path": "d.gcode", "root": "gcodes", "modified": 2.5, "size": 10}})
+    catalog.apply_change({"action": "create_file", "item": {"path": "notes.txt", "root": "gcodes", "modified": 5.0}})
+    catalog.apply_change({"action": "delete_file", "item": {"path": "a.gcode", "root": "gcodes"}})
+    catalog.apply_change({"action": "move_file", "item": {"path": "e.gcode", "root": "gcodes", "modified": 3.0}, "source_item": {"path": "sub/b.gcode", "root": "gcodes"}})
+    catalog.apply_change({"action": "create_file", "item": {"path": "printer.cfg", "root": "config", "modified": 9.0}})
+    assert [item["path"] for item in catalog.files] == ["e.gcode", "d.gcode", "c.gcode"]
+    assert catalog.path_by_hash(FileCatalog.file_hash("d.gcode")) == "d.gcode" and catalog.path_by_hash(FileCatalog.file_hash("sub/b.gcode")) is None
+
+    catalog.apply_change({"action": "delete_dir", "item": {"path": "sub", "root": "gcodes"}})
+    assert not catalog.valid
+
+
+def test_search_ranks_prefix_matches_and_browses_directories():
+    catalog = FileCatalog()
+    catalog.load(
+        [
+            {"path": "benchy.gcode", "modified": 1.0, "size": 10},
+            {"path": "parts/mybenchy_v2.gcode", "modified": 3.0, "size": 30},
+            {"path": "parts/bracket.gcode", "modified": 2.0, "size": 20},
+            {"path": "parts/old/benchy_old.gcode", "modified": 4.0, "size": 40},
+        ]
+    )
+    catalog.set_metadata("parts/bracket.gcode", {"slicer": "OrcaSlicer", "estimated_time": 600.0})
+
+    files, _ = catalog.search("benchy")
+    assert [item["path"] for item in files] == ["parts/old/benchy_old.gcode", "benchy.gcode", "parts/mybenchy_v2.gcode"]
+    assert [item["path"] for item in catalog.search("orca")[0]] == ["parts/bracket.gcode"]
+    assert [item["path"] for item in catalog.search("parts/ sort:name")[0]] == ["parts/bracket.gcode", "parts/mybenchy_v2.gcode"] and catalog.search("parts/")[1] == ["parts/old"]
+    assert [item["path"] for item in catalog.search("dir:parts benchy sort:size")[0]] == ["parts/old/benchy_old.gcode", "parts/mybenchy_v2.gcode"]
+
+
+def test_metadata_is_searchable_and_survives_reloads():
+    files = [{"path": "a.gcode", "modified": 1.0}, {"path": "b.gcode", "modified": 2.0}, {"path": "c.gcode", "modified": 3.0}]
+    catalog = FileCatalog()
+    catalog.load([dict(item) for item in files])
+    catalog.set_metadata("a.gcode", {"modified": 1.0, "estimated_time": 3900.0, "filament_total": 12480.0})
+    catalog.set_metadata("b.gcode", {"modified": 2.0, "estimated_time": 600.0, "filament_total": 2000.0})
+    assert catalog.missing_metadata("benchy") == [] and catalog.missing_metadata("sort:time") == ["c.gcode"] and catalog.missing_metadata("1h") == ["c.gcode"]
+
+    catalog.load([dict(item) for item in files[:1]] + [{"path": "b.gcode", "modified": 5.0}] + [dict(item) for item in files[2:]])
+    assert [item["path"] for item in catalog.search("1h05")[0]] == ["a.gcode"] and [item["path"] for item in catalog.search("12.5m")[0]] == ["a.gcode"]
+    assert [item["path"] for item in catalog.search("sort:time")[0]] == ["a.gcode", "b.gcode", "c.gcode"] and catalog.metadata("b.gcode") is None
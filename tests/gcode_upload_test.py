@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+from io import BytesIO
+import tarfile
+import threading
+import time
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import pytest
+from telegram import Bot, File
+from telegram.request import BaseRequest
+
+from bot.gcode_upload import UploadError, download_document, iter_gcodes, upload_gcodes  # type: ignore
+
+GCODE = b"G28\nG1 X10 Y10 F3000\n" * 50000
+
+
+def _zip_archive(*names: str) -> BytesIO:
+    archive = BytesIO()
+    with ZipFile(archive, "w", ZIP_DEFLATED) as zip_file:
+        for name in names:
+            zip_file.writestr(name, GCODE)
+    archive.seek(0)
+    return archive
+
+
+def _tar_archive(*names: str) -> BytesIO:
+    archive = BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar_file:
+        for name in names:
+            info = tarfile.TarInfo(name)
+            info.size = len(GCODE)
+            tar_file.addfile(info, BytesIO(GCODE))
+    archive.seek(0)
+    return archive
+
+
+class _FileRequest(BaseRequest):
+    def __init__(self):
+        self.urls = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.urls.append(url)
+        return 200, GCODE
+
+
+def test_download_uses_the_bot_request():
+    request = _FileRequest()
+    file = File("file-id", "unique-id", file_path="https://api.telegram.org/file/bot123:abc/documents/my file.zip")
+    file.set_bot(Bot("123:abc", request=request))
+
+    document = asyncio.run(download_document(file))
+    with document:
+        assert document.read() == GCODE
+    assert len(request.urls) == 1 and request.urls[0].endswith("/documents/my%20file.zip")
+
+
+@pytest.mark.parametrize("archive,file_name", [(_zip_archive("dir/a.gcode", "readme.txt", "b.gcode"), "parts.zip"), (_tar_archive("a.gcode", "dir/b.gcode", "model.stl"), "parts.tar.gz")])
+def test_archive_gcodes_are_streamed(archive, file_name):
+    names = []
+    with contextlib.closing(iter_gcodes(archive, file_name)) as gcodes:
+        for gcode_name, gcode_file in gcodes:
+            with gcode_file:
+                assert gcode_file.seek(0, 2) == len(GCODE)
+                gcode_file.seek(0)
+                assert gcode_file.read(1000) == GCODE[:1000] and gcode_file.read() == GCODE[1000:]
+            names.append(gcode_name)
+    assert names == ["a.gcode", "b.gcode"]
+
+
+def test_finder_archive_metadata_is_skipped():
+    archive = _zip_archive("part.gcode", "__MACOSX/._part.gcode", "dir/._notes.gcode")
+    names = []
+    with contextlib.closing(iter_gcodes(archive, "part.zip")) as gcodes:
+        for gcode_name, gcode_file in gcodes:
+            gcode_file.close()
+            names.append(gcode_name)
+    assert names == ["part.gcode"]
+
+
+def test_uploads_are_bounded_and_summarized():
+    in_flight = []
+    lock = threading.Lock()
+
+    def upload(gcode_file, gcode_name) -> bool:
+        with lock:
+            in_flight.append(len(in_flight) + 1 if not in_flight else in_flight[-1] + 1)
+        data = gcode_file.read()
+        time.sleep(0.05)
+        with lock:
+            in_flight.append(in_flight[-1] - 1)
+        return data == GCODE and gcode_name != "part_3.gcode"
+
+    archive = _zip_archive(*[f"part_{num}.gcode" for num in range(6)])
+    uploaded, failed = asyncio.run(upload_gcodes(archive, "parts.zip", upload, concurrency=2))
+    assert uploaded == ["part_0.gcode", "part_1.gcode", "part_2.gcode", "part_4.gcode", "part_5.gcode"] and failed == ["part_3.gcode"]
+    assert max(in_flight) == 2
+
+
+def test_archive_errors():
+    with pytest.raises(UploadError, match="Not a gcode"):
+        list(iter_gcodes(_tar_archive("model.stl"), "model.tar.gz"))
+    with pytest.raises(UploadError, match="Broken archive"):
+        list(iter_gcodes(BytesIO(b"garbage"), "broken.zip"))
+
+
+def test_duplicate_names_and_broken_members_are_reported():
+    archive = _zip_archive("a.gcode", "b.gcode", "dir/a.gcode", "c.gcode")
+
+    def upload(gcode_file, gcode_name) -> bool:
+        if gcode_name == "b.gcode":
+            raise OSError("read failed")
+        return gcode_file.read() == GCODE
+
+    uploaded, failed = asyncio.run(upload_gcodes(archive, "parts.zip", upload))
+    assert uploaded == ["a.gcode", "c.gcode"] and failed == ["b.gcode", "a.gcode"]
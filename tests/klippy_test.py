@@ -1,3 +1,7 @@
+import logging
+import pathlib
+
+from bot.configuration import ConfigWrapper  # type: ignore
 from bot.klippy import Klippy  # type: ignore
 
 test_sensors = {
@@ -8,7 +12,8 @@ test_sensors = {
 
 
 def test_sensor_message():
-    heater_message = Klippy._sensor_message("heater", test_sensors["heater"])
-    temp_sensor_message = Klippy._sensor_message("temp", test_sensors["temp"])
-    fan_message = Klippy._sensor_message("fan", test_sensors["fan"])
+    klippy = Klippy(ConfigWrapper(pathlib.Path("tests/resources/telegram.conf").absolute().as_posix()), logging.NullHandler())
+    for name, value in test_sensors.items():
+        klippy.update_sensor(name, value)
+    heater_message, temp_sensor_message, fan_message, _ = klippy._get_sensors_message().split("\n")
     assert heater_message == "♨️ Heater: 155 °C ➡️ 255 °C 🔥" and fan_message == "🌪️ Fan: 155 °C ➡️ 255 °C 75% 2550 RPM" and temp_sensor_message == "🌡️ Temp: 155 °C"
@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler  # type: ignore
+from apscheduler.triggers.date import DateTrigger  # type: ignore
+
+from bot.camera import Camera  # type: ignore
+from bot.configuration import ConfigWrapper  # type: ignore
+from bot.klippy import Klippy, PowerDevice  # type: ignore
+from bot.notifications import Notifier  # type: ignore
+from bot.timelapse import Timelapse  # type: ignore
+from bot.websocket_helper import WebSocketHelper  # type: ignore
+from tests.simulator import MoonrakerSimulator, TelegramBotStub
+
+logger = logging.getLogger(__name__)
+
+
+async def _drain(scheduler: AsyncIOScheduler, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(isinstance(job.trigger, DateTrigger) for job in scheduler.get_jobs()):
+        await asyncio.sleep(0.05)
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    if pending:
+        await asyncio.wait(pending, timeout=max(deadline - time.monotonic(), 0.1))
+
+
+async def replay(config_path: str, recording: str, speed: float, telegram_latency: float, drain_timeout: float) -> str:
+    config = ConfigWrapper(config_path)
+    moonraker = MoonrakerSimulator()
+    bot = TelegramBotStub(latency=telegram_latency)
+    scheduler = AsyncIOScheduler({"apscheduler.job_defaults.coalesce": "false", "apscheduler.job_defaults.max_instances": "4"})
+    scheduler.start()
+    handler = logging.NullHandler()
+
+    klippy = Klippy(config, handler, **moonraker.transports())
+    klippy.light_device = PowerDevice(config.bot_config.light_device_name, klippy)
+    klippy.psu_device = PowerDevice(config.bot_config.poweroff_device_name, klippy)
+    camera = Camera(config, klippy, handler)
+    camera.loop = asyncio.get_running_loop()
+    timelapse = Timelapse(config, klippy, camera, scheduler, bot, handler)  # type: ignore
+    notifier = Notifier(config, bot, klippy, camera, scheduler, handler)  # type: ignore
+    ws_helper = WebSocketHelper(config, klippy, notifier, timelapse, scheduler, handler)
+
+    stats = await ws_helper.replay(recording, speed)
+    await _drain(scheduler, drain_timeout)
+    scheduler.shutdown(wait=False)
+
+    report = stats.report()
+    report += "\n\nTelegram api calls:\n" + "\n".join(f"  {name}: {count}" for name, count in bot.calls.most_common())
+    report += "\n\nMoonraker requests:\n" + "\n".join(f"  {name}: {count}" for name, count in moonraker.requests.most_common())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded moonraker websocket frames through the bot handlers")
+    parser.add_argument("recording", help="websocket_record_file recording or a telegram.log written with debug enabled")
+    parser.add_argument("-c", "--configfile", default="./telegram.conf", metavar="<configfile>", help="Bot configuration used to build the handlers")
+    parser.add_argument("-s", "--speed", type=float, default=0.0, help="Replay speed multiplier, 0 replays without delays")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Simulated telegram api round trip in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="Seconds to wait for scheduled notifications after the last frame")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    print(asyncio.run(replay(args.configfile, args.recording, args.speed, args.telegram_latency, args.drain_timeout)))
@@ -0,0 +1,80 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from bot.send_scheduler import SendScheduler, TokenBucket  # type: ignore
+
+
+def test_superseded_edits_are_dropped():
+    async def scenario():
+        scheduler = SendScheduler()
+        sent = []
+
+        async def callback(endpoint, data):
+            sent.append((endpoint, data["text"]))
+            await asyncio.sleep(0.05)
+            return {"message_id": data["message_id"]}
+
+        results = await asyncio.gather(
+            *[
+                scheduler.process_request(callback, ("editMessageText", {"chat_id": 1, "message_id": 7, "text": f"progress {num}"}), {}, "editMessageText", {"chat_id": 1, "message_id": 7}, None)
+                for num in range(5)
+            ]
+        )
+        return scheduler, sent, results
+
+    scheduler, sent, results = asyncio.run(scenario())
+    assert sent == [("editMessageText", "progress 0"), ("editMessageText", "progress 4")] and results[1:4] == [True, True, True]
+    assert scheduler.metrics == {"queued": 0, "max_queued": 5, "requested": 5, "sent": 2, "dropped_edits": 3}
+
+
+def test_chat_rate_and_retry_after(monkeypatch):
+    blocks = []
+    block = TokenBucket.block
+
+    def record_block(bucket, seconds):
+        # the chat is paused for the requested time, the test only checks that it was asked to
+        blocks.append(seconds)
+        block(bucket, 0.0)
+
+    monkeypatch.setattr(TokenBucket, "block", record_block)
+
+    async def scenario():
+        scheduler = SendScheduler(private_rate=10.0)
+        sent = []
+        flood = [True]
+
+        async def callback(endpoint, data):
+            if data["text"] == "3" and flood:
+                flood.pop()
+                raise RetryAfter(1)
+            sent.append((endpoint, data["text"]))
+            return True
+
+        await asyncio.gather(*[scheduler.process_request(callback, ("sendMessage", {"chat_id": 1, "text": str(num)}), {}, "sendMessage", {"chat_id": 1}, None) for num in range(6)])
+        return scheduler, sent
+
+    scheduler, sent = asyncio.run(scenario())
+    assert [text for _, text in sent] == ["0", "1", "2", "3", "4", "5"] and blocks == [1]
+    assert scheduler.metrics["retry_after"] == 1 and scheduler.metrics["sent"] == 6
+
+
+def test_chat_actions_are_throttled_per_chat():
+    async def scenario():
+        scheduler = SendScheduler(chat_action_interval=0.2)
+        sent = []
+
+        async def callback(endpoint, data):
+            sent.append((data["chat_id"], data["action"]))
+            return True
+
+        async def chat_action(chat_id, action):
+            return await scheduler.process_request(callback, ("sendChatAction", {"chat_id": chat_id, "action": action}), {}, "sendChatAction", {"chat_id": chat_id, "action": action}, None)
+
+        await asyncio.gather(chat_action(1, "typing"), chat_action(1, "upload_photo"), chat_action(1, "typing"), chat_action(2, "typing"))
+        await asyncio.sleep(0.25)
+        await chat_action(1, "typing")
+        return scheduler, sent
+
+    scheduler, sent = asyncio.run(scenario())
+    assert sent == [(1, "typing"), (1, "upload_photo"), (2, "typing"), (1, "typing")] and scheduler.metrics["requested"] == 5 and scheduler.metrics["dropped_chat_actions"] == 1
@@ -0,0 +1,626 @@
+import argparse
+import asyncio
+import base64
+from collections import Counter
+from io import BytesIO
+import itertools
+import logging
+import math
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import urllib.parse
+
+from PIL import Image
+import httpx
+import orjson
+from telegram import PhotoSize
+from telegram.error import Forbidden
+from websockets.frames import Frame, Opcode
+from websockets.http11 import Request
+from websockets.server import ServerProtocol
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatorConnection:
+    def __init__(self, protocol: ServerProtocol, writer: asyncio.StreamWriter):
+        self.protocol: ServerProtocol = protocol
+        self.writer: asyncio.StreamWriter = writer
+        self.subscription: Dict[str, Optional[List[str]]] = {}
+
+    def flush(self) -> None:
+        for data in self.protocol.data_to_send():
+            if data:
+                self.writer.write(data)
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self.protocol.send_text(orjson.dumps(message))
+        self.flush()
+
+    def subscribed_part(self, status: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        res = {}
+        for name, values in status.items():
+            if name not in self.subscription:
+                continue
+            fields = self.subscription[name]
+            part = values if not fields else {key: val for key, val in values.items() if key in fields}
+            if part:
+                res[name] = part
+        return res
+
+
+class MoonrakerSimulator:
+    """In-process stand-in for Moonraker: HTTP api, websocket JSON-RPC and scripted print lifecycles."""
+
+    def __init__(self, files_count: int = 20, macros: Optional[List[str]] = None, token_lifetime: float = 0.0):
+        self.objects: List[str] = [
+            "webhooks",
+            "configfile",
+            "print_stats",
+            "display_status",
+            "virtual_sdcard",
+            "toolhead",
+            "gcode_move",
+            "extruder",
+            "heater_bed",
+            "fan",
+            "temperature_sensor chamber",
+            "heater_fan hotend_fan",
+        ] + [f"gcode_macro {macro}" for macro in (macros if macros is not None else ["PRINT_START", "PRINT_END", "_PRIVATE_MACRO"])]
+        self.status: Dict[str, Dict[str, Any]] = {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "print_stats": {"state": "standby", "filename": "", "print_duration": 0.0, "filament_used": 0.0, "message": ""},
+            "display_status": {"progress": 0.0, "message": None},
+            "virtual_sdcard": {"progress": 0.0},
+            "toolhead": {"position": [0.0, 0.0, 0.0, 0.0]},
+            "gcode_move": {"position": [0.0, 0.0, 0.0, 0.0], "gcode_position": [0.0, 0.0, 0.0, 0.0]},
+            "extruder": {"temperature": 24.5, "target": 0.0, "power": 0.0},
+            "heater_bed": {"temperature": 23.1, "target": 0.0, "power": 0.0},
+            "fan": {"speed": 0.0, "rpm": None},
+            "temperature_sensor chamber": {"temperature": 25.0},
+            "heater_fan hotend_fan": {"speed": 0.0},
+        }
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.database: Dict[str, Dict[str, Any]] = {}
+        self.power_devices: Dict[str, Dict[str, Any]] = {
+            "printer": {"device": "printer", "status": "on", "locked_while_printing": True, "type": "gpio", "is_shutdown": False},
+            "light": {"device": "light", "status": "off", "locked_while_printing": False, "type": "gpio", "is_shutdown": False},
+        }
+        self.gcode_scripts: List[str] = []
+        self.requests: Counter = Counter()
+        # with a positive lifetime every request needs a bearer token from /access/login or /access/refresh_jwt
+        self.token_lifetime: float = token_lifetime
+        self._tokens_not_before: float = 0.0
+        self.notifications: Counter = Counter()
+        self.thumbnail: bytes = self._create_thumbnail()
+        self.connections: Set[SimulatorConnection] = set()
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.Server] = None
+
+        now = time.time()
+        for num in range(files_count):
+            self.add_file(f"{'subdir/' if num % 5 == 4 else ''}model_{num:04d}.gcode", modified=now - num * 3600)
+
+    @staticmethod
+    def _create_thumbnail() -> bytes:
+        bio = BytesIO()
+        img = Image.new("RGB", (300, 300), (40, 120, 200))
+        img.save(bio, "PNG")
+        img.close()
+        return bio.getvalue()
+
+    def add_file(self, path: str, modified: Optional[float] = None, size: int = 1048576) -> None:
+        name = path.rpartition("/")[2]
+        self.files[path] = {
+            "path": path,
+            "modified": modified if modified is not None else time.time(),
+            "size": size,
+            "permissions": "rw",
+            "metadata": {
+                "filename": path,
+                "size": size,
+                "modified": modified if modified is not None else time.time(),
+                "slicer": "PrusaSlicer",
+                "estimated_time": 3600.0,
+                "filament_total": 12000.0,
+                "filament_weight_total": 36.5,
+                "print_start_time": None,
+                "thumbnails": [
+                    {"width": 32, "height": 32, "size": 1500, "relative_path": f".thumbs/{name[:-6]}-32x32.png"},
+                    {"width": 300, "height": 300, "size": 25000, "relative_path": f".thumbs/{name[:-6]}-300x300.png"},
+                ],
+            },
+        }
+
+    @staticmethod
+    def _result(result: Any, status_code: int = 200) -> httpx.Response:
+        return httpx.Response(status_code, content=orjson.dumps({"result": result}), headers={"Content-Type": "application/json"})
+
+    @staticmethod
+    def _error(status_code: int, message: str) -> httpx.Response:
+        return httpx.Response(status_code, content=orjson.dumps({"error": {"code": status_code, "message": message}}), headers={"Content-Type": "application/json"})
+
+    def query_objects(self, objects: Dict[str, Optional[List[str]]]) -> Dict[str, Dict[str, Any]]:
+        res = {}
+        for name, fields in objects.items():
+            if name not in self.status:
+                continue
+            res[name] = dict(self.status[name]) if not fields else {key: val for key, val in self.status[name].items() if key in fields}
+        return res
+
+    def _printer_info(self, *_) -> httpx.Response:
+        return self._result({"state": self.status["webhooks"]["state"], "state_message": self.status["webhooks"]["state_message"], "hostname": "simulator"})
+
+    def _objects_list(self, *_) -> httpx.Response:
+        return self._result({"objects": self.objects})
+
+    def _objects_query(self, _, params: Dict[str, str], __) -> httpx.Response:
+        return self._result({"eventtime": time.monotonic(), "status": self.query_objects({name: None for name in params})})
+
+    def _gcode_script(self, _, params: Dict[str, str], json_body: Dict[str, Any]) -> httpx.Response:
+        self.gcode_scripts.extend([params["script"]] if "script" in params else json_body.get("commands", []))
+        return self._result("ok")
+
+    def _print_start(self, _, params: Dict[str, str], __) -> httpx.Response:
+        if params.get("filename") not in self.files:
+            return self._error(404, f"File {params.get('filename')} not found")
+        self.status["print_stats"]["filename"] = params["filename"]
+        return self._result("ok")
+
+    def _files_list(self, *_) -> httpx.Response:
+        return self._result([{key: val for key, val in file.items() if key != "metadata"} for file in self.files.values()])
+
+    def _files_metadata(self, _, params: Dict[str, str], __) -> httpx.Response:
+        if params.get("filename") not in self.files:
+            return self._error(404, f"Metadata not available for <{params.get('filename')}>")
+        return self._result(self.files[params["filename"]]["metadata"])
+
+    def _files_upload(self, body: bytes) -> httpx.Response:
+        fields = {match.group(1).decode(): match.group(2).decode() for match in re.finditer(rb'name="(root|path|print)"\r\n\r\n([^\r]*)\r\n', body)}
+        filename = re.search(rb'name="file"; filename="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n', body)
+        if not filename:
+            return self._error(400, "No file name specifed in upload form")
+        upload_dir = fields.get("path", "").strip("/")
+        path = f"{upload_dir}/{filename.group(1).decode()}" if upload_dir else filename.group(1).decode()
+        content_end = body.index(b"\r\n--", filename.end())
+        self.add_file(path, size=content_end - filename.end())
+        try:
+            asyncio.get_running_loop().create_task(self.notify_filelist_changed("create_file", path))
+        except RuntimeError:
+            # mock transport used from a sync client thread, there are no websocket connections to notify
+            pass
+        return self._result({"item": {"path": path, "root": fields.get("root", "gcodes")}, "print_started": False, "action": "create_file"}, 201)
+
+    def _database_item(self, method: str, params: Dict[str, str], json_body: Dict[str, Any]) -> httpx.Response:
+        namespace_name = params.get("namespace", json_body.get("namespace", ""))
+        key = params.get("key", json_body.get("key", ""))
+        if not key and method == "GET":
+            if namespace_name not in self.database:
+                return self._error(404, f"Namespace '{namespace_name}' not found")
+            return self._result({"namespace": namespace_name, "key": None, "value": self.database[namespace_name]})
+        namespace = self.database.setdefault(namespace_name, {})
+        if method == "POST":
+            namespace[key] = json_body.get("value")
+        elif key not in namespace:
+            return self._error(404, f"Key '{key}' in namespace '{namespace_name}' not found")
+        return self._result({"namespace": namespace_name, "key": key, "value": namespace.pop(key) if method == "DELETE" else namespace[key]})
+
+    def _power_devices_list(self, *_) -> httpx.Response:
+        return self._result({"devices": list(self.power_devices.values())})
+
+    def _power_device(self, _, params: Dict[str, str], __) -> httpx.Response:
+        if params.get("device") not in self.power_devices:
+            return self._error(404, f"No valid power device named {params.get('device')}")
+        self.power_devices[params["device"]]["status"] = params.get("action", "off")
+        return self._result({params["device"]: params.get("action", "off")})
+
+    def _update_status(self, *_) -> httpx.Response:
+        return self._result({"busy": False, "version_info": {"moonraker-telegram-bot": {"version": "v1.5.0-simulator"}, "moonraker": {"version": "v0.9.0-simulator"}}})
+
+    def _oneshot_token(self, *_) -> httpx.Response:
+        return self._result("simulator_oneshot_token")
+
+    def _issue_token(self) -> str:
+        payload = base64.urlsafe_b64encode(orjson.dumps({"username": "simulator", "iat": time.time(), "exp": time.time() + self.token_lifetime})).rstrip(b"=").decode()
+        return f"simulator.{payload}.token"
+
+    def _token_valid(self, headers: Dict[str, str]) -> bool:
+        token = headers.get("authorization", "").removeprefix("Bearer ")
+        try:
+            payload = token.split(".")[1]
+            claims = orjson.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return claims["iat"] >= self._tokens_not_before and claims["exp"] > time.time()
+        except (IndexError, KeyError, ValueError):
+            return False
+
+    def revoke_tokens(self) -> None:
+        self._tokens_not_before = time.time()
+
+    def _login(self, *_) -> httpx.Response:
+        return self._result({"username": "simulator", "token": self._issue_token(), "refresh_token": "simulator.refresh.token", "action": "user_logged_in"})
+
+    def _refresh_jwt(self, *_) -> httpx.Response:
+        return self._result({"username": "simulator", "token": self._issue_token(), "action": "user_jwt_refresh"})
+
+    def _announcements_feed(self, *_) -> httpx.Response:
+        return self._result({"feed": "moonraker-telegram-bot", "action": "added"})
+
+    def handle_request(self, method: str, path: str, params: Dict[str, str], body: bytes, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        self.requests[f"{method} {path}"] += 1
+        if self.token_lifetime > 0 and path not in ["/access/login", "/access/refresh_jwt"] and not self._token_valid(headers or {}):
+            return self._error(401, "Unauthorized")
+        routes: Dict[str, Callable[[str, Dict[str, str], Dict[str, Any]], httpx.Response]] = {
+            "/printer/info": self._printer_info,
+            "/printer/objects/list": self._objects_list,
+            "/printer/objects/query": self._objects_query,
+            "/printer/gcode/script": self._gcode_script,
+            "/api/printer/command": self._gcode_script,
+            "/printer/print/start": self._print_start,
+            "/server/files/list": self._files_list,
+            "/server/files/metadata": self._files_metadata,
+            "/server/database/item": self._database_item,
+            "/machine/device_power/devices": self._power_devices_list,
+            "/machine/device_power/device": self._power_device,
+            "/machine/update/status": self._update_status,
+            "/access/oneshot_token": self._oneshot_token,
+            "/access/login": self._login,
+            "/access/refresh_jwt": self._refresh_jwt,
+            "/server/announcements/feed": self._announcements_feed,
+        }
+        if path == "/server/files/upload":
+            return self._files_upload(body)
+        if path.startswith("/server/files/gcodes/"):
+            if ".thumbs/" not in urllib.parse.unquote(path):
+                return self._error(404, "File not found")
+            return httpx.Response(200, content=self.thumbnail, headers={"Content-Type": "image/png"})
+        if path not in routes:
+            return self._error(404, f"Not Found: {path}")
+        return routes[path](method, params, orjson.loads(body) if body[:1] == b"{" else {})
+
+    def _handle_mock_request(self, request: httpx.Request) -> httpx.Response:
+        params = dict(urllib.parse.parse_qsl(request.url.query.decode(), keep_blank_values=True))
+        return self.handle_request(request.method, request.url.path, params, request.read(), dict(request.headers))
+
+    def transports(self) -> Dict[str, httpx.MockTransport]:
+        """Keyword arguments that route the async and sync moonraker clients of Klippy to the simulator."""
+        transport = httpx.MockTransport(self._handle_mock_request)
+        return {"transport": transport, "sync_transport": transport}
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            return 0
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self) -> None:
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.sleep(0)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    return body
+                body += chunk[:-2]
+        return await reader.readexactly(int(headers.get("content-length", "0")))
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+                headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in header_lines if line)}
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(head, reader, writer)
+                    return
+                url = urllib.parse.urlsplit(target)
+                response = self.handle_request(method, urllib.parse.unquote(url.path), dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True)), await self._read_body(reader, headers), headers)
+                writer.write(
+                    f"HTTP/1.1 {response.status_code} {response.reason_phrase}\r\nContent-Type: {response.headers['Content-Type']}\r\nContent-Length: {len(response.content)}\r\n\r\n".encode()
+                    + response.content
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle_websocket(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        protocol = ServerProtocol(max_size=None)
+        protocol.receive_data(head)
+        request = protocol.events_received()[0]
+        if not isinstance(request, Request):
+            return
+        protocol.send_response(protocol.accept(request))
+        connection = SimulatorConnection(protocol, writer)
+        connection.flush()
+        self.connections.add(connection)
+        try:
+            while not protocol.close_expected():
+                data = await reader.read(65536)
+                if not data:
+                    protocol.receive_eof()
+                    break
+                protocol.receive_data(data)
+                for frame in protocol.events_received():
+                    if isinstance(frame, Frame) and frame.opcode in [Opcode.TEXT, Opcode.BINARY]:
+                        self._handle_rpc(connection, orjson.loads(frame.data))
+                connection.flush()
+                await writer.drain()
+        finally:
+            self.connections.discard(connection)
+
+    def _rpc_result(self, connection: SimulatorConnection, method: str, params: Dict[str, Any]) -> Any:
+        if method == "printer.info":
+            return orjson.loads(self._printer_info().content)["result"]
+        if method == "machine.device_power.devices":
+            return {"devices": list(self.power_devices.values())}
+        if method in ["printer.objects.subscribe", "printer.objects.query"]:
+            if method == "printer.objects.subscribe":
+                connection.subscription = params.get("objects", {})
+            return {"eventtime": time.monotonic(), "status": self.query_objects(params.get("objects", {}))}
+        if method == "printer.gcode.script":
+            self.gcode_scripts.append(params.get("script", ""))
+            return "ok"
+        if method.startswith(("printer.print.", "printer.emergency_stop", "printer.firmware_restart", "machine.")):
+            return "ok"
+        return None
+
+    def _handle_rpc(self, connection: SimulatorConnection, message: Dict[str, Any]) -> None:
+        self.requests[f"RPC {message.get('method')}"] += 1
+        result = self._rpc_result(connection, message.get("method", ""), message.get("params", {}))
+        if result is None:
+            connection.send({"jsonrpc": "2.0", "error": {"code": -32601, "message": f"Method not found: {message.get('method')}"}, "id": message.get("id")})
+        else:
+            connection.send({"jsonrpc": "2.0", "result": result, "id": message.get("id")})
+
+    async def notify(self, method: str, params: Optional[List[Any]] = None) -> None:
+        message: Dict[str, Any] = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        self.notifications[method] += 1
+        for connection in list(self.connections):
+            connection.send(message)
+        await asyncio.gather(*(connection.writer.drain() for connection in self.connections), return_exceptions=True)
+
+    async def notify_filelist_changed(self, action: str, path: str, source_path: Optional[str] = None) -> None:
+        item: Dict[str, Any] = {"path": path, "root": "gcodes"}
+        if path in self.files:
+            item.update(modified=self.files[path]["modified"], size=self.files[path]["size"], permissions="rw")
+        change: Dict[str, Any] = {"action": action, "item": item}
+        if source_path is not None:
+            change["source_item"] = {"path": source_path, "root": "gcodes"}
+        await self.notify("notify_filelist_changed", [change])
+
+    async def notify_status(self, status: Dict[str, Dict[str, Any]]) -> None:
+        for name, values in status.items():
+            self.status.setdefault(name, {}).update(values)
+        eventtime = time.monotonic()
+        self.notifications["notify_status_update"] += 1
+        for connection in list(self.connections):
+            part = connection.subscribed_part(status)
+            if part:
+                connection.send({"jsonrpc": "2.0", "method": "notify_status_update", "params": [part, eventtime]})
+        await asyncio.gather(*(connection.writer.drain() for connection in self.connections), return_exceptions=True)
+
+    async def notify_proc_stat(self) -> None:
+        await self.notify(
+            "notify_proc_stat_update",
+            [
+                {
+                    "moonraker_stats": {"time": time.time(), "cpu_usage": 2.5, "memory": 41000, "mem_units": "kB"},
+                    "cpu_temp": 48.3,
+                    "network": {"lo": {"rx_bytes": 1024, "tx_bytes": 1024, "bandwidth": 12.5}, "eth0": {"rx_bytes": 4096, "tx_bytes": 2048, "bandwidth": 312.5}},
+                    "system_cpu_usage": {"cpu": 12.1, "cpu0": 10.2, "cpu1": 14.0},
+                    "system_memory": {"total": 3910000, "available": 3200000, "used": 710000},
+                    "websocket_connections": len(self.connections),
+                }
+            ],
+        )
+
+    async def set_klippy_state(self, state: str, state_message: str = "") -> None:
+        self.status["webhooks"] = {"state": state, "state_message": state_message if state_message else f"Klipper state: {state}"}
+        if state == "ready":
+            await self.notify("notify_klippy_ready")
+        elif state == "shutdown":
+            await self.notify("notify_klippy_shutdown")
+        else:
+            await self.notify("notify_klippy_disconnected")
+
+    async def gcode_response(self, response: str) -> None:
+        await self.notify("notify_gcode_response", [response])
+
+    async def run_print(
+        self, filename: str, duration: float = 10.0, rate: float = 10.0, object_height: float = 20.0, final_state: str = "complete", proc_stat_interval: float = 1.0, m117_every: int = 0
+    ) -> None:
+        """Emit a print lifecycle: start, `rate` status updates per second for `duration` seconds and the final state."""
+        if filename not in self.files:
+            self.add_file(filename)
+        filament_total = self.files[filename]["metadata"]["filament_total"]
+        # moonraker's job history marks the start of every print job in the file metadata
+        self.files[filename]["metadata"]["print_start_time"] = time.time()
+        await self.notify_status({"print_stats": {"state": "printing", "filename": filename, "print_duration": 0.0, "filament_used": 0.0, "message": ""}})
+
+        steps = max(int(duration * rate), 1)
+        started = time.monotonic()
+        last_proc_stat = started
+        for step in range(1, steps + 1):
+            progress = step / steps
+            position_z = round(math.ceil(progress * object_height / 0.2) * 0.2, 2)
+            update: Dict[str, Dict[str, Any]] = {
+                "display_status": {"progress": progress},
+                "virtual_sdcard": {"progress": progress},
+                "toolhead": {"position": [100.0 + step % 50, 100.0 - step % 50, position_z, step * 0.1]},
+                "gcode_move": {"position": [100.0 + step % 50, 100.0 - step % 50, position_z, step * 0.1], "gcode_position": [100.0 + step % 50, 100.0 - step % 50, position_z, step * 0.1]},
+                "print_stats": {"print_duration": progress * duration, "filament_used": progress * filament_total},
+                "extruder": {"temperature": 210.0 + (step % 7 - 3) * 0.1, "target": 210.0, "power": 0.45},
+                "heater_bed": {"temperature": 60.0 + (step % 5 - 2) * 0.1, "target": 60.0, "power": 0.3},
+            }
+            if m117_every and step % m117_every == 0:
+                update["display_status"]["message"] = f"Layer {int(position_z / 0.2)}"
+            await self.notify_status(update)
+
+            now = time.monotonic()
+            if 0 < proc_stat_interval <= now - last_proc_stat:
+                last_proc_stat = now
+                await self.notify_proc_stat()
+            await asyncio.sleep(max(started + step / rate - now, 0.0))
+
+        await self.notify_status({"print_stats": {"state": final_state, "message": "Simulated error" if final_state == "error" else ""}})
+
+
+async def _run_forever(port: int, duration: float, rate: float, pause: float) -> None:
+    simulator = MoonrakerSimulator(files_count=200)
+    await simulator.start("0.0.0.0", port)
+    logger.info("Moonraker simulator listening on port %s", simulator.port)
+    for num in itertools.count():
+        while not simulator.connections:
+            await asyncio.sleep(1)
+        await simulator.run_print(list(simulator.files)[num % len(simulator.files)], duration=duration, rate=rate)
+        logger.info("Print %s finished, %s", num, dict(simulator.notifications))
+        await asyncio.sleep(pause)
+
+
+class TelegramStubMessage:
+    def __init__(self, bot: "TelegramBotStub", chat_id: int, message_id: int, text: Optional[str] = None, caption: Optional[str] = None, photo: Optional[str] = None):
+        self._bot = bot
+        self.chat_id: int = chat_id
+        self.message_id: int = message_id
+        self.text: Optional[str] = text
+        self.caption: Optional[str] = caption
+        self.photo: Tuple[PhotoSize, ...] = (PhotoSize(photo, photo, 640, 480),) if photo else ()
+
+    async def edit_text(self, text: str, **_) -> "TelegramStubMessage":
+        await self._bot.api_call("edit_message_text", chat_id=self.chat_id, message_id=self.message_id, text=text)
+        self.text = text
+        return self
+
+    async def edit_caption(self, caption: str, **_) -> "TelegramStubMessage":
+        await self._bot.api_call("edit_message_caption", chat_id=self.chat_id, message_id=self.message_id, caption=caption)
+        self.caption = caption
+        return self
+
+    async def edit_media(self, media, **_) -> "TelegramStubMessage":
+        await self._bot.api_call("edit_message_media", chat_id=self.chat_id, message_id=self.message_id, media=media)
+        self.photo = (PhotoSize(self._bot.file_id(media.media), "stub", 640, 480),)
+        self.caption = media.caption
+        return self
+
+    async def delete(self, **_) -> bool:
+        await self._bot.api_call("delete_message", chat_id=self.chat_id, message_id=self.message_id)
+        return True
+
+
+class TelegramBotStub:
+    """Stand-in for telegram.Bot, counts api calls and answers them after a simulated round trip.
+
+    Calls to chats in `failing_chats` fail after the round trip like calls to a chat the bot was removed from.
+    `max_in_flight` is the highest number of calls that waited for their round trip at the same time.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency: float = latency
+        self.failing_chats: Set[int] = set()
+        self.uploads: int = 0
+        self.calls: Counter = Counter()
+        self.sent: List[Tuple[str, Dict[str, Any]]] = []
+        self.max_in_flight: int = 0
+        self._in_flight: int = 0
+        self._message_ids = itertools.count(1)
+
+    async def api_call(self, name: str, **kwargs) -> None:
+        self.calls[name] += 1
+        self.sent.append((name, kwargs))
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            if self.latency > 0:
+                await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+        if kwargs.get("chat_id") in self.failing_chats:
+            raise Forbidden("Forbidden: bot was kicked from the group chat")
+
+    def _message(self, chat_id, text: Optional[str] = None, caption: Optional[str] = None, photo: Optional[str] = None) -> TelegramStubMessage:
+        return TelegramStubMessage(self, chat_id, next(self._message_ids), text=text, caption=caption, photo=photo)
+
+    def file_id(self, media) -> str:
+        """Telegram file_id of sent media, a new one for every upload."""
+        if isinstance(media, str):
+            return media
+        self.uploads += 1
+        return f"stub-file-{self.uploads}"
+
+    async def send_message(self, chat_id, text: str, **kwargs) -> TelegramStubMessage:
+        await self.api_call("send_message", chat_id=chat_id, text=text, **kwargs)
+        return self._message(chat_id, text=text)
+
+    async def send_photo(self, chat_id, photo, caption: Optional[str] = None, **kwargs) -> TelegramStubMessage:
+        await self.api_call("send_photo", chat_id=chat_id, photo=photo, caption=caption, **kwargs)
+        return self._message(chat_id, caption=caption if caption else "", photo=self.file_id(photo))
+
+    async def send_video(self, chat_id, video, caption: Optional[str] = None, **kwargs) -> TelegramStubMessage:
+        await self.api_call("send_video", chat_id=chat_id, video=video, caption=caption, **kwargs)
+        return self._message(chat_id, caption=caption if caption else "")
+
+    async def send_document(self, chat_id, document, caption: Optional[str] = None, **kwargs) -> TelegramStubMessage:
+        await self.api_call("send_document", chat_id=chat_id, document=document, caption=caption, **kwargs)
+        return self._message(chat_id, caption=caption if caption else "")
+
+    async def send_media_group(self, chat_id, media, **kwargs) -> Tuple[TelegramStubMessage, ...]:
+        await self.api_call("send_media_group", chat_id=chat_id, media=media, **kwargs)
+        return tuple(self._message(chat_id) for _ in media)
+
+    async def edit_message_text(self, text: str, chat_id, message_id, **_) -> TelegramStubMessage:
+        return await TelegramStubMessage(self, chat_id, message_id).edit_text(text)
+
+    async def edit_message_caption(self, chat_id, message_id, caption: str, **_) -> TelegramStubMessage:
+        return await TelegramStubMessage(self, chat_id, message_id).edit_caption(caption)
+
+    async def edit_message_media(self, media, chat_id, message_id, **_) -> TelegramStubMessage:
+        return await TelegramStubMessage(self, chat_id, message_id).edit_media(media)
+
+    async def send_chat_action(self, chat_id, action, **kwargs) -> bool:
+        await self.api_call("send_chat_action", chat_id=chat_id, action=action, **kwargs)
+        return True
+
+    async def delete_message(self, chat_id, message_id, **kwargs) -> bool:
+        await self.api_call("delete_message", chat_id=chat_id, message_id=message_id, **kwargs)
+        return True
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs) -> bool:
+        await self.api_call("pin_chat_message", chat_id=chat_id, message_id=message_id, **kwargs)
+        return True
+
+    async def unpin_all_chat_messages(self, chat_id, **kwargs) -> bool:
+        await self.api_call("unpin_all_chat_messages", chat_id=chat_id, **kwargs)
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local moonraker simulator for offline load testing of the bot")
+    parser.add_argument("-p", "--port", type=int, default=7125, help="Port to serve http api and websocket on")
+    parser.add_argument("-d", "--duration", type=float, default=60.0, help="Duration of a simulated print in seconds")
+    parser.add_argument("-r", "--rate", type=float, default=10.0, help="Status updates per second while printing")
+    parser.add_argument("--pause", type=float, default=10.0, help="Seconds between simulated prints")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_run_forever(args.port, args.duration, args.rate, args.pause))
@@ -0,0 +1,485 @@
+import asyncio
+import functools
+from io import BytesIO
+import logging
+import socket
+import time
+from typing import Callable, Optional
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler  # type: ignore
+import pytest
+
+from bot.camera import Camera, LightManager  # type: ignore
+from bot.configuration import ConfigWrapper  # type: ignore
+from bot.gcode_upload import upload_gcodes  # type: ignore
+from bot.klippy import Klippy, PowerDevice  # type: ignore
+from bot.notifications import Notifier  # type: ignore
+from bot.timelapse import Timelapse  # type: ignore
+from bot.websocket_helper import WebSocketHelper  # type: ignore
+from tests.simulator import MoonrakerSimulator, TelegramBotStub
+
+SIMULATOR_CONFIG = """
+[bot]
+server: 127.0.0.1:{port}
+chat_id: 16612341234
+bot_token: 23423423334:sdfgsdfg-dfgdfgsdfg
+log_path: {log_path}
+cache_path: {log_path}/cache
+light_device: light
+{bot_options}
+
+[progress_notification]
+percent: 10
+{notification_options}
+
+[status_message_content]
+heaters: extruder, heater_bed
+"""
+
+
+def _simulator_config(tmp_path, port: int, bot_options: str = "", notification_options: str = "") -> ConfigWrapper:
+    config_path = tmp_path / "telegram.conf"
+    config_path.write_text(SIMULATOR_CONFIG.format(port=port, log_path=tmp_path.as_posix(), bot_options=bot_options, notification_options=notification_options))
+    return ConfigWrapper(config_path.as_posix())
+
+
+class SimulatedBot:
+    """Klippy, camera and notifier of one bot instance, talking to a moonraker simulator and a telegram bot stub."""
+
+    def __init__(self, config: ConfigWrapper, simulator: MoonrakerSimulator, bot: TelegramBotStub, scheduler: AsyncIOScheduler):
+        self.config: ConfigWrapper = config
+        self.simulator: MoonrakerSimulator = simulator
+        self.bot: TelegramBotStub = bot
+        self.scheduler: AsyncIOScheduler = scheduler
+        self.klippy: Klippy = Klippy(config, logging.NullHandler(), **simulator.transports())
+        self.klippy.light_device = PowerDevice(config.bot_config.light_device_name, self.klippy)
+        self.camera: Camera = Camera(config, self.klippy, logging.NullHandler())
+
+    @functools.cached_property
+    def notifier(self) -> Notifier:
+        return Notifier(self.config, self.bot, self.klippy, self.camera, self.scheduler, logging.NullHandler())
+
+
+@pytest.fixture
+def simulated_bot(tmp_path) -> Callable[..., SimulatedBot]:
+    """Factory of bots on the simulator config, pass `simulator` or `bot` to share them between bots."""
+
+    def build(bot_options: str = "", notification_options: str = "", simulator: Optional[MoonrakerSimulator] = None, bot: Optional[TelegramBotStub] = None) -> SimulatedBot:
+        config = _simulator_config(tmp_path, 7125, bot_options, notification_options)
+        return SimulatedBot(config, simulator or MoonrakerSimulator(), bot or TelegramBotStub(), AsyncIOScheduler())
+
+    return build
+
+
+def test_klippy_with_simulator(tmp_path):
+    async def scenario():
+        simulator = MoonrakerSimulator(files_count=25)
+        await simulator.start()
+        klippy = Klippy(_simulator_config(tmp_path, simulator.port), logging.NullHandler())
+        connection_error = await klippy.check_connection()
+        await klippy.set_connected(True)
+        files = await klippy.get_gcode_files()
+        message, thumb = await klippy.get_file_info_by_name(files[0]["path"], "")
+        _, cached_thumb = await klippy.get_file_info_by_name(files[0]["path"], "")
+        same_thumb = thumb.getvalue() == cached_thumb.getvalue()
+        thumb.close()
+        await simulator.stop()
+        return connection_error, klippy.macros, files, message, same_thumb, simulator
+
+    connection_error, macros, files, message, same_thumb, simulator = asyncio.run(scenario())
+    assert connection_error == "" and macros == ["PRINT_START", "PRINT_END"] and len(files) == 25 and files[0]["path"] == "model_0000.gcode" and "Filament: 12.0m" in message
+    assert same_thumb and simulator.requests["GET /server/files/gcodes/.thumbs/model_0000-300x300.png"] == 1
+
+
+def test_macro_index_built_once_per_ready(simulated_bot):
+    async def scenario():
+        sim = simulated_bot()
+        simulator, klippy = sim.simulator, sim.klippy
+        simulator.objects += ["gcode_macro bot_data", "gcode_macro _private", "gcode_macro load-filament"]
+        await klippy.set_connected(True)
+        commands = await klippy.get_macro_commands()
+        await klippy.save_data_to_marco(10, "lapse.mp4", "/tmp")
+        return simulator, klippy, commands
+
+    simulator, klippy, commands = asyncio.run(scenario())
+    assert klippy.macros == ["PRINT_START", "PRINT_END", "LOAD-FILAMENT"] and commands == ["PRINT_START", "PRINT_END"]
+    assert "_PRIVATE" in klippy.macros_all and simulator.requests["GET /printer/objects/list"] == 1 and len(simulator.gcode_scripts) == 3
+
+
+def test_database_params_are_written_behind(simulated_bot):
+    async def scenario():
+        sim = simulated_bot()
+        simulator, klippy = sim.simulator, sim.klippy
+        simulator.database["telegram-bot"] = {"silent": True, "lapse": "old"}
+        klippy._DB_FLUSH_DELAY = 0.05
+        await klippy.set_connected(True)
+        values = [await klippy.get_param_from_db("silent"), await klippy.get_param_from_db("missing")]
+        for percent in range(10):
+            await klippy.save_param_to_db("percent", percent)
+        await klippy.delete_param_from_db("lapse")
+        values.append(await klippy.get_param_from_db("percent"))
+        written_early = dict(simulator.database["telegram-bot"])
+        await asyncio.sleep(0.2)
+        return simulator, values, written_early
+
+    simulator, values, written_early = asyncio.run(scenario())
+    assert values == [True, None, 9] and written_early == {"silent": True, "lapse": "old"} and simulator.database["telegram-bot"] == {"silent": True, "percent": 9}
+    assert simulator.requests["GET /server/database/item"] == 1 and simulator.requests["POST /server/database/item"] == 1 and simulator.requests["DELETE /server/database/item"] == 1
+
+
+def test_database_saves_during_flush_are_written(simulated_bot):
+    async def scenario():
+        sim = simulated_bot()
+        simulator, klippy = sim.simulator, sim.klippy
+        klippy._DB_FLUSH_DELAY = 0.05
+        await klippy.set_connected(True)
+        write_db_param = klippy._write_db_param
+        failures = ["c"]
+
+        async def slow_write(param_name, value):
+            await asyncio.sleep(0.1)
+            if param_name in failures:
+                failures.remove(param_name)
+                return False
+            return await write_db_param(param_name, value)
+
+        klippy._write_db_param = slow_write
+        await klippy.save_param_to_db("a", 1)
+        await klippy.save_param_to_db("c", 3)
+        await asyncio.sleep(0.1)
+        await klippy.save_param_to_db("b", 2)
+        await asyncio.sleep(0.6)
+        return simulator
+
+    simulator = asyncio.run(scenario())
+    assert simulator.database["telegram-bot"] == {"a": 1, "b": 2, "c": 3}
+
+
+def test_group_notifications_fan_out(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(notification_options="groups: " + ", ".join(str(-100 - num) for num in range(6)), bot=TelegramBotStub(latency=0.1))
+        bot, notifier = sim.bot, sim.notifier
+        bot.failing_chats.add(-102)
+        await notifier._send_message("progress 10%", silent=True)
+        await notifier._send_message("progress 20%", silent=True)
+        return bot
+
+    bot = asyncio.run(scenario())
+    sent_to = [kwargs["chat_id"] for name, kwargs in bot.sent if name == "send_message"]
+    assert bot.max_in_flight == 7 and sorted(sent_to) == sorted([16612341234, -100, -101, -102, -102, -103, -104, -105]) and bot.calls["edit_message_text"] == 6
+
+
+def test_photo_uploaded_once_for_all_recipients(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(notification_options="groups: -100, -101, -102")
+        bot, notifier = sim.bot, sim.notifier
+        frames = iter([b"jpeg 1", b"jpeg 2", b"jpeg 2"])
+        sim.camera.take_photo = lambda: BytesIO(next(frames))
+        await notifier._send_photo(False, False, "progress 10%", True)
+        await notifier._send_photo(False, False, "progress 20%", True)
+        await notifier._send_photo(False, False, "progress 20%", True)
+        return bot, notifier
+
+    bot, notifier = asyncio.run(scenario())
+    assert bot.calls["send_photo"] == 4 and bot.calls["edit_message_media"] == 4 and bot.uploads == 2 and bot.calls["edit_message_caption"] == 0
+    assert bot.calls["send_chat_action"] == 2 and notifier.avoided_calls == {"send_chat_action": 6, "edit_message_media": 4, "edit_message_caption": 8}
+
+
+def test_status_updates_are_coalesced(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(notification_options="groups: -100", bot=TelegramBotStub(latency=0.1))
+        bot, notifier, scheduler = sim.bot, sim.notifier, sim.scheduler
+        scheduler.start()
+        notifier._message_parts.remove("last_update_time")
+        for num in range(6):
+            notifier._schedule_notification(f"progress {num}\n")
+            await asyncio.sleep(0.01)
+        for _ in range(500):
+            if bot.calls["edit_message_text"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        notifier._schedule_notification("progress 5\n")
+        await asyncio.sleep(0.3)
+        scheduler.shutdown(wait=False)
+        return bot
+
+    bot = asyncio.run(scenario())
+    texts = [kwargs["text"] for name, kwargs in bot.sent if name in ("send_message", "edit_message_text") and kwargs["chat_id"] == 16612341234]
+    assert len(texts) == 2 and texts[0].startswith("progress 0") and texts[1].startswith("progress 5")
+    assert bot.calls["send_message"] == 2 and bot.calls["edit_message_text"] == 2
+
+
+def test_status_editor_survives_a_failed_update(simulated_bot):
+    async def scenario():
+        sim = simulated_bot()
+        bot, notifier, scheduler = sim.bot, sim.notifier, sim.scheduler
+        scheduler.start()
+        notify = notifier._notify
+
+        async def failing_notify(**kwargs):
+            notifier._notify = notify
+            raise RuntimeError("Forbidden: bot was blocked by the user")
+
+        notifier._notify = failing_notify
+        await notifier.update_status()
+        await notifier.update_status()
+        scheduler.shutdown(wait=False)
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert bot.calls["send_message"] == 1
+
+
+def test_status_command_waits_for_the_edit(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(bot=TelegramBotStub(latency=0.2))
+        bot, notifier, scheduler = sim.bot, sim.notifier, sim.scheduler
+        scheduler.start()
+        events = []
+        send_message = bot.send_message
+
+        async def recorded_send_message(*args, **kwargs):
+            sent = await send_message(*args, **kwargs)
+            events.append("status sent")
+            return sent
+
+        async def ticker():
+            while True:
+                events.append("tick")
+                await asyncio.sleep(0.01)
+
+        async def status_command():
+            await notifier.update_status()
+            events.append("command done")
+
+        bot.send_message = recorded_send_message
+        ticker_task = asyncio.create_task(ticker())
+        await asyncio.gather(status_command(), status_command())
+        ticker_task.cancel()
+        scheduler.shutdown(wait=False)
+        return bot, events
+
+    bot, events = asyncio.run(scenario())
+    replies = [event for event in events if event != "tick"]
+    assert bot.calls["send_message"] == 1 and replies == ["status sent", "command done", "command done"]
+    # the loop kept running while the commands waited for the edit
+    assert events.index("status sent") > 5
+
+
+def test_status_messages_restored_after_restart(simulated_bot):
+    async def start_bot(simulator, bot):
+        sim = simulated_bot(notification_options="groups: -100, -101", simulator=simulator, bot=bot)
+        await sim.klippy.set_printing_filename("model_0001.gcode")
+        return sim.klippy, sim.notifier
+
+    async def scenario():
+        simulator, bot = MoonrakerSimulator(), TelegramBotStub()
+        simulator.files["model_0001.gcode"]["metadata"]["print_start_time"] = 1700000000.0
+        klippy, notifier = await start_bot(simulator, bot)
+        notifier._last_percent = 30
+        await notifier._send_message("progress 30%", silent=True)
+        await notifier._save_state()
+        await klippy.flush_db()
+
+        klippy, notifier = await start_bot(simulator, bot)
+        await notifier.restore_state()
+        await notifier._send_message("progress 30%", silent=True)
+        await notifier._send_message("progress 40%", silent=True)
+        await notifier._save_state()
+        await klippy.flush_db()
+
+        # the same file printed again is a new job with its own messages
+        simulator.files["model_0001.gcode"]["metadata"]["print_start_time"] = 1700003600.0
+        klippy, reprint_notifier = await start_bot(simulator, bot)
+        await reprint_notifier.restore_state()
+        restored = reprint_notifier._status_message is not None or bool(reprint_notifier._groups_status_mesages)
+        await reprint_notifier.reset_notifications()
+        await klippy.flush_db()
+        return bot, notifier, simulator, restored
+
+    bot, notifier, simulator, restored = asyncio.run(scenario())
+    assert not restored and bot.calls["send_message"] == 3 and bot.calls["edit_message_text"] == 3 and notifier.avoided_calls["edit_message_text"] == 3
+    assert [kwargs["text"] for name, kwargs in bot.sent if name == "edit_message_text"] == ["progress 40%"] * 3 and "notifier_state" not in simulator.database["telegram-bot"]
+
+
+def test_media_files_are_streamed_in_groups(tmp_path, simulated_bot):
+    paths = []
+    for num in range(12):
+        paths.append(tmp_path / f"frame_{num:02}.jpg")
+        paths[-1].write_bytes(b"jpeg %d" % num)
+    paths.append(tmp_path / "huge.jpg")
+    with open(paths[-1], "wb") as huge:
+        huge.truncate(11 * 1024 * 1024)
+
+    async def scenario():
+        sim = simulated_bot(bot=TelegramBotStub(latency=0.1))
+        bot, notifier = sim.bot, sim.notifier
+        await notifier._send_media("image", [path.as_posix() for path in paths], "frames")
+        await notifier._send_media("document", [paths[0].as_posix()], "single")
+        return bot
+
+    bot = asyncio.run(scenario())
+    groups = [kwargs["media"] for name, kwargs in bot.sent if name == "send_media_group"]
+    assert [len(media) for media in groups] == [10, 2] and groups[0][0].caption == "frames" and groups[1][0].caption is None
+    assert all(media.media.input_file_content.closed for media in groups[0]) and bot.max_in_flight == 2
+    assert [kwargs["text"] for name, kwargs in bot.sent if name == "send_message"] == [f"Telegram bots have a 10mb filesize restriction for images, image couldn't be uploaded: `{paths[-1]}`"]
+    assert bot.calls["send_document"] == 1
+
+
+def test_file_page_prefetch(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(simulator=MoonrakerSimulator(files_count=30))
+        simulator, klippy = sim.simulator, sim.klippy
+        files = await klippy.get_gcode_files()
+        klippy.prefetch_files_info([item["path"] for item in files[10:20]] + ["just_uploaded.gcode"])
+        message, thumb = await klippy.get_file_info_by_name(files[12]["path"], "")
+        thumb.close()
+        await asyncio.sleep(0.1)
+        for item in files[10:20]:
+            await klippy.get_file_info_by_name(item["path"], "")
+        return simulator, message
+
+    simulator, message = asyncio.run(scenario())
+    assert "Filament: 12.0m" in message and simulator.requests["GET /server/files/metadata"] == 10
+
+
+def test_metadata_loaded_before_sorting_by_it(simulated_bot):
+    async def scenario():
+        sim = simulated_bot(simulator=MoonrakerSimulator(files_count=30))
+        simulator, klippy = sim.simulator, sim.klippy
+        simulator.files["model_0003.gcode"]["metadata"]["estimated_time"] = 60.0
+        await klippy.search_gcode_files("benchy")
+        requests_without_metadata = simulator.requests["GET /server/files/metadata"]
+        files, _ = await klippy.search_gcode_files("sort:time")
+        # a reconnect reloads the listing
+        klippy._file_catalog.invalidate()
+        await klippy.search_gcode_files("sort:filament")
+        return simulator, requests_without_metadata, files
+
+    simulator, requests_without_metadata, files = asyncio.run(scenario())
+    assert requests_without_metadata == 0 and simulator.requests["GET /server/files/metadata"] == 30 and files[0]["path"] == "model_0003.gcode"
+
+
+def test_gcode_upload_is_streamed(simulated_bot):
+    sim = simulated_bot()
+    simulator, klippy = sim.simulator, sim.klippy
+    gcode = b"G1 X10 Y10 F3000\n" * 100000
+    archive = BytesIO()
+    with ZipFile(archive, "w", ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("models/part.gcode", gcode)
+        zip_file.writestr("models/part_copy.gcode", gcode)
+    uploaded, failed = asyncio.run(upload_gcodes(archive, "parts.zip", functools.partial(klippy.upload_gcode_file_sync, upload_path="")))
+    assert uploaded == ["part.gcode", "part_copy.gcode"] and not failed
+    assert simulator.files["part.gcode"]["size"] == simulator.files["part_copy.gcode"]["size"] == len(gcode)
+
+
+def test_token_refresh_is_single_flight(simulated_bot):
+    async def scenario():
+        sim = simulated_bot("user: admin\npassword: secret", simulator=MoonrakerSimulator(token_lifetime=3600.0))
+        simulator, klippy = sim.simulator, sim.klippy
+        simulator.revoke_tokens()
+        loop = asyncio.get_running_loop()
+        responses = await asyncio.gather(
+            *[klippy.make_request("GET", "/printer/info") for _ in range(10)],
+            *[loop.run_in_executor(None, klippy.make_request_sync, "GET", "/printer/info") for _ in range(5)],
+        )
+        return simulator, responses
+
+    simulator, responses = asyncio.run(scenario())
+    assert all(response.is_success for response in responses)
+    assert simulator.requests["POST /access/login"] == 1 and simulator.requests["POST /access/refresh_jwt"] == 1
+
+
+def test_token_refreshed_before_expiry(simulated_bot):
+    sim = simulated_bot("user: admin\npassword: secret", simulator=MoonrakerSimulator(token_lifetime=30.0))
+    simulator, klippy = sim.simulator, sim.klippy
+    response = klippy.make_request_sync("GET", "/printer/info")
+    assert response.is_success and simulator.requests["POST /access/refresh_jwt"] == 1 and simulator.requests["GET /printer/info"] == 1
+
+
+def test_light_switched_once_for_overlapping_captures(simulated_bot):
+    async def scenario():
+        sim = simulated_bot()
+        simulator = sim.simulator
+        light = LightManager(sim.klippy.light_device, 1)
+
+        async def capture():
+            await light.acquire()
+            await asyncio.sleep(0.1)
+            light.release()
+
+        await asyncio.gather(capture(), capture(), capture())
+        await asyncio.sleep(0.5)
+        await capture()
+        light_on = simulator.power_devices["light"]["status"]
+        while light.busy:
+            await asyncio.sleep(0.05)
+        return simulator, light_on
+
+    simulator, light_on = asyncio.run(scenario())
+    assert light_on == "on" and simulator.power_devices["light"]["status"] == "off" and simulator.requests["POST /machine/device_power/device"] == 2
+
+
+def test_check_connection_does_not_block_loop(tmp_path):
+    async def scenario():
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        simulator = MoonrakerSimulator()
+        klippy = Klippy(_simulator_config(tmp_path, port), logging.NullHandler())
+        stalls = []
+
+        async def ticker():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - last)
+                last = time.monotonic()
+
+        async def late_start():
+            await asyncio.sleep(0.5)
+            await simulator.start(port=port)
+
+        ticker_task, start_task = asyncio.create_task(ticker()), asyncio.create_task(late_start())
+        connection_error = await klippy.check_connection()
+        ticker_task.cancel()
+        await start_task
+        await simulator.stop()
+        return connection_error, max(stalls)
+
+    connection_error, max_stall = asyncio.run(scenario())
+    assert connection_error == "" and max_stall < 0.5
+
+
+def test_print_lifecycle_with_simulator(tmp_path):
+    async def scenario():
+        simulator = MoonrakerSimulator()
+        await simulator.start()
+        config = _simulator_config(tmp_path, simulator.port)
+        scheduler = AsyncIOScheduler()
+        scheduler.start()
+        bot = TelegramBotStub()
+        klippy = Klippy(config, logging.NullHandler())
+        klippy.light_device = PowerDevice(config.bot_config.light_device_name, klippy)
+        klippy.psu_device = PowerDevice(config.bot_config.poweroff_device_name, klippy)
+        camera = Camera(config, klippy, logging.NullHandler())
+        notifier = Notifier(config, bot, klippy, camera, scheduler, logging.NullHandler())
+        timelapse = Timelapse(config, klippy, camera, scheduler, bot, logging.NullHandler())
+        ws_helper = WebSocketHelper(config, klippy, notifier, timelapse, scheduler, logging.NullHandler())
+
+        ws_task = asyncio.create_task(ws_helper.run_forever_async())
+        while not klippy.connected or not any(connection.subscription for connection in simulator.connections):
+            await asyncio.sleep(0.05)
+        subscription = next(connection.subscription for connection in simulator.connections if connection.subscription)
+        await simulator.run_print("model_0003.gcode", duration=1.0, rate=100.0)
+        await asyncio.sleep(0.5)
+        ws_task.cancel()
+        scheduler.shutdown(wait=False)
+        await simulator.stop()
+        return klippy, bot, subscription
+
+    klippy, bot, subscription = asyncio.run(scenario())
+    assert subscription["print_stats"] == ["state", "filename", "print_duration", "filament_used", "message"] and subscription["display_status"] == ["progress", "message"]
+    assert subscription["gcode_move"] == ["gcode_position"] and "toolhead" not in subscription and "virtual_sdcard" not in subscription and "extruder" in subscription
+    assert not klippy.printing and bot.calls["send_photo"] == 1 and bot.calls["edit_message_caption"] == 11
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from telegram.helpers import escape_markdown
+
+from bot.status_template import StatusTemplate  # type: ignore
+
+PARTS = ["progress", "height", "filament_length", "filament_weight", "print_duration", "eta"]
+SENSORS = {
+    "heater_bed": {"temperature": 60.2, "target": 90.0, "power": 0.4},
+    "chamberFan": {"speed": 0.5, "rpm": None},
+}
+
+
+def _render(template: StatusTemplate) -> str:
+    message = template.file_info("", "benchy_v2.1 (final).gcode", 0.423, 12.4, (1234.5, 5000.0), (3.7, 15.0), 3723.4, timedelta(minutes=95))
+    message += "\n".join(template.sensor(name, value) for name, value in SENSORS.items()) + "\n"
+    return message + template.device("psu-1", {"status": "on", "locked_while_printing": "True"}, ":electric_plug:")
+
+
+def test_markdown_template_matches_escaped_text():
+    plain, markdown = _render(StatusTemplate(PARTS)), _render(StatusTemplate(PARTS, markdown=True))
+    assert plain.startswith("Printing: benchy_v2.1 (final).gcode \nProgress 42.0%, height: 12.4mm\nFilament: 1.23m / 5.0m, weight: 3.7/15.0g\n")
+    assert "Printing for 1:02:03\nEstimated time left: 1:35:00\n♨️ Heater Bed: 60 °C ➡️ 90 °C 🔥\n🌪️ Chamber Fan: 50%\n 🔌 psu-1:  on  🔒 \n" in plain
+    assert markdown == escape_markdown(plain, version=2)
+
+
+def test_disabled_parts_are_not_rendered():
+    message = StatusTemplate(["eta"]).file_info("Printer started printing", "cube.gcode", 0.5, 3.0, (0.0, 0.0), (0.0, 0.0), 60.0, timedelta(seconds=30))
+    assert message == "Printer started printing: cube.gcode \nEstimated time left: 0:00:30\n"
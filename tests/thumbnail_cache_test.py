@@ -0,0 +1,22 @@
+import asyncio
+
+from bot.thumbnail_cache import ThumbnailCache  # type: ignore
+
+
+def test_memory_and_disk_lru(tmp_path):
+    async def scenario():
+        cache = ThumbnailCache((tmp_path / "thumbs").as_posix(), "http://printer-a:7125", memory_limit=20, disk_limit=30)
+        await cache.put(".thumbs/a.png", 1.0, b"a" * 10)
+        await cache.put(".thumbs/b.png", 1.0, b"b" * 10)
+        hit = await cache.get(".thumbs/a.png", 1.0)
+        await cache.put(".thumbs/c.png", 1.0, b"c" * 10)
+        await cache.put(".thumbs/d.png", 1.0, b"d" * 10)
+        miss = await cache.get(".thumbs/a.png", 2.0)
+
+        reopened = ThumbnailCache((tmp_path / "thumbs").as_posix(), "http://printer-a:7125", memory_limit=20, disk_limit=30)
+        other_printer = ThumbnailCache((tmp_path / "thumbs").as_posix(), "http://printer-b:7125", memory_limit=20, disk_limit=30)
+        return hit, miss, await reopened.get(".thumbs/d.png", 1.0), reopened, await other_printer.get(".thumbs/d.png", 1.0)
+
+    hit, miss, reopened_hit, reopened, other_hit = asyncio.run(scenario())
+    assert hit == b"a" * 10 and miss is None and len(list((tmp_path / "thumbs").iterdir())) == 3
+    assert reopened_hit == b"d" * 10 and reopened.hits == 1 and other_hit is None
@@ -0,0 +1,20 @@
+from bot.websocket_recorder import FrameRecorder, LatencyStats, read_frames  # type: ignore
+
+
+def test_recorded_frames_roundtrip(tmp_path):
+    record_path = (tmp_path / "frames.rec").as_posix()
+    frames = [b'{"jsonrpc": "2.0", "method": "notify_proc_stat_update"}', b'{"jsonrpc": "2.0", "result": {"state": "ready"}, "id": 1}']
+    recorder = FrameRecorder(record_path)
+    for frame in frames:
+        recorder.write(frame)
+    recorder.close()
+    replayed = list(read_frames(record_path))
+    assert [frame for _, frame in replayed] == frames and replayed[0][0] <= replayed[1][0]
+
+
+def test_latency_percentiles():
+    stats = LatencyStats()
+    for num in range(1, 101):
+        stats.add("notify_status_update", num / 1000)
+    stats.finish()
+    assert stats.messages == 100 and stats.percentile("notify_status_update", 50) == 0.05 and stats.percentile("notify_status_update", 99) == 0.099 and stats.percentile("unknown", 50) == 0.0